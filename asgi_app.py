@@ -0,0 +1,175 @@
+# ASGI serving mode for the budget app.
+#
+#   pip install uvicorn asgiref
+#   python asgi_app.py                      # or: uvicorn asgi_app:app
+#
+# A deliberate adaptation of the request for async handlers on every
+# route: the synchronous routes stay flask_app's own views, run on a thread
+# through asgiref's WsgiToAsgi adapter, so validation, sessions, ETags and
+# errors are the same in both modes. Only the budget event streams are
+# native async handlers on the event loop, where an idle stream holds no
+# thread. Password hashing shares the route threads rather than having a
+# pool of its own, and the adapter reads a request body in full (spooled to
+# disk past 64KB) before Flask sees it; response bodies still go out a chunk
+# at a time. Like the Flask server, run one worker per storage directory.
+import asyncio
+import io
+import logging
+import os
+import re
+import time
+
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi
+
+import flask_app
+from flask_app import EVENT_HEARTBEAT_SECONDS, EVENT_STREAM_HEADERS, budget_manager
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Flask requests running at once, each on its own thread
+wsgi_slots = asyncio.Semaphore(int(os.environ.get('ASGI_WSGI_THREADS', 16)))
+
+EVENTS_RULE = '/api/budget/<budget_id>/events'
+EVENTS_PATH = re.compile(r'^/api/budget/(?P<budget_id>[^/]+)/events$')
+
+wsgi_app = WsgiToAsgi(flask_app.app)
+
+
+def wsgi_environ(scope, body):
+    # Enough of a WSGI environ for flask_app.app.request_context()
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        # The body ends where the ASGI messages end, with or without a Content-Length
+        'wsgi.input_terminated': True,
+        'wsgi.errors': io.StringIO(),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+        else:
+            key = 'HTTP_' + name
+            if key in environ:
+                # Repeated headers fold into one; cookies have their own separator
+                value = environ[key] + ('; ' if key == 'HTTP_COOKIE' else ',') + value
+            environ[key] = value
+    return environ
+
+
+async def budget_events(scope, receive, send, budget_id):
+    # flask_app.budget_events without the thread: the publisher wakes this
+    # coroutine instead of a thread blocking in get()
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+
+    def open_stream():
+        # In a request context, so the session, user and access checks are
+        # Flask's own; an error comes back as a finished Flask response
+        with flask_app.app.request_context(wsgi_environ(scope, io.BytesIO())):
+            subscription, opening = flask_app.open_event_stream(budget_id)
+            if subscription is None:
+                return None, flask_app.app.make_response(opening)
+            return subscription, opening
+
+    subscription, opening = await loop.run_in_executor(None, open_stream)
+    if subscription is None:
+        response = opening
+        status = response.status_code
+        headers = response.headers.items()
+    else:
+        status = 200
+        headers = dict(EVENT_STREAM_HEADERS, **{'Content-Type': 'text/event-stream'}).items()
+    # Streams are timed up to the first byte only, as in flask_app
+    REGISTRY.histogram('http_request_duration_seconds', "Request latency by route", route=EVENTS_RULE,
+                       method='GET', status=str(status)).observe(time.perf_counter() - start)
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]})
+    if subscription is None:
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+        return
+
+    wakeup = asyncio.Event()
+    subscription.listener = lambda: loop.call_soon_threadsafe(wakeup.set)
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    # Runs until the stream ends (resync) or the client goes away
+    watcher = asyncio.ensure_future(watch_disconnect())
+    try:
+        await send({'type': 'http.response.body', 'body': opening.encode('utf-8'), 'more_body': True})
+        while not watcher.done():
+            wakeup.clear()
+            event = subscription.get(0)
+            if event is None:
+                waiter = asyncio.ensure_future(wakeup.wait())
+                await asyncio.wait((waiter, watcher), timeout=EVENT_HEARTBEAT_SECONDS,
+                                   return_when=asyncio.FIRST_COMPLETED)
+                if not waiter.done():
+                    waiter.cancel()
+                    if not watcher.done():
+                        await send({'type': 'http.response.body', 'body': b": heartbeat\n\n", 'more_body': True})
+                continue
+            await send({'type': 'http.response.body', 'body': flask_app.format_event(event).encode('utf-8'),
+                        'more_body': True})
+            if event['type'] == 'resync':
+                await send({'type': 'http.response.body', 'body': b''})
+                return
+    finally:
+        watcher.cancel()
+        subscription.close()
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    found = EVENTS_PATH.match(scope['path']) if scope['method'] == 'GET' else None
+    if found:
+        await budget_events(scope, receive, send, found['budget_id'])
+    else:
+        # WsgiToAsgi runs the app "thread sensitive": without a context of
+        # their own, all requests would share a single thread
+        async with wsgi_slots, ThreadSensitiveContext():
+            await wsgi_app(scope, receive, send)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            budget_manager.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("The ASGI mode needs uvicorn: pip install uvicorn")
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 8000)))
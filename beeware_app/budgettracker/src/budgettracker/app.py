@@ -2,17 +2,28 @@
 tracking budget and recording transactions
 """
 
+from datetime import datetime
+
 import toga
 from toga.style import Pack
 from toga.style.pack import COLUMN, ROW
-import requests
+
+from budgettracker.localstore import LocalStore
+from budgettracker.sync import OFFLINE_ERRORS, ServerError, SessionExpired, SyncClient
+
+SERVER_URL = 'https://atariq6298.pythonanywhere.com'
 
 
 class BudgetTracker(toga.App):
     def startup(self):
         self.user = None
         self.budgets = []
-        self.transactions = []
+        self.syncing = False
+        self.dashboard_box = None
+        # Screens read from the on-device cache; the network only refreshes it
+        self.paths.data.mkdir(parents=True, exist_ok=True)
+        self.store = LocalStore(str(self.paths.data / 'budgets.db'))
+        self.sync = SyncClient(SERVER_URL, self.store)
         self.main_window = toga.MainWindow(title=self.formal_name)
         self.show_login()
         self.main_window.show()
@@ -21,61 +32,106 @@ class BudgetTracker(toga.App):
         email_input = toga.TextInput(placeholder='Email')
         password_input = toga.PasswordInput(placeholder='Password')
         login_button = toga.Button('Login', on_press=self.handle_login)
+        self.login_status = toga.Label('')
         self.login_box = toga.Box(children=[
             toga.Label('Login to Budget Tracker'),
             email_input,
             password_input,
-            login_button
+            login_button,
+            self.login_status
         ], style=Pack(direction=COLUMN, padding=10))
         self.email_input = email_input
         self.password_input = password_input
         self.main_window.content = self.login_box
 
-    def handle_login(self, widget):
-        # Placeholder: Accept any login
-        self.user = self.email_input.value
+    async def handle_login(self, widget):
+        email = self.email_input.value.strip().lower()
+        password = self.password_input.value
+        try:
+            ok = await self.loop.run_in_executor(None, self.sync.login, email, password)
+        except OFFLINE_ERRORS:
+            # No connection: the account last used on this device can still
+            # browse its cached budgets and queue changes, with its password
+            ok = await self.loop.run_in_executor(None, self.store.check_password, email, password)
+        except ServerError:
+            self.login_status.text = 'Server unavailable, try again later'
+            return
+        if not ok:
+            self.login_status.text = 'Login failed'
+            return
+        self.user = email
         self.show_dashboard()
 
-    def show_dashboard(self):
-        self.budgets = self.fetch_budgets()
+    def show_dashboard(self, sync=True):
+        # Rendered straight from the cache; a background sync then uploads
+        # queued changes, pulls the delta and renders it again
+        self.budgets = self.store.budgets()
         budgets_label = toga.Label(f'Welcome, {self.user}! Your Budgets:')
         add_budget_button = toga.Button('Add Budget', on_press=self.show_add_budget)
         add_transaction_button = toga.Button('Add Transaction', on_press=self.show_add_transaction)
         budget_items = []
         for idx, budget in enumerate(self.budgets):
-            budget_button = toga.Button(f"{budget['name']} (${budget['budget']})", on_press=lambda w, i=idx: self.show_budget_detail(i))
+            pending = ' (not synced)' if budget['pending'] else ''
+            budget_button = toga.Button(f"{budget['name']} (${budget['balance']:.2f}){pending}",
+                                        on_press=lambda w, i=idx: self.show_budget_detail(i))
             budget_items.append(budget_button)
         budgets_box = toga.Box(children=budget_items, style=Pack(direction=COLUMN, padding=5))
         self.dashboard_box = toga.Box(children=[
             budgets_label,
             budgets_box,
             add_budget_button,
-            add_transaction_button
-        ], style=Pack(direction=COLUMN, padding=10))
+            add_transaction_button,
+            toga.Label(self.sync_status())
+        ] + self.rejected_items(), style=Pack(direction=COLUMN, padding=10))
         self.main_window.content = self.dashboard_box
+        if sync:
+            self.loop.create_task(self.refresh())
 
-    def fetch_budgets(self):
-        try:
-            # Use deployed backend URL
-            user_id = self.user or ''
-            url = f'https://atariq6298.pythonanywhere.com/api/budget/{user_id}/list'  # Adjust endpoint as needed
-            response = requests.get(url, verify=False)
-            if response.status_code == 200:
-                return response.json().get('budgets', [])
-            else:
-                return []
-        except Exception as e:
-            print(f"Error fetching budgets: {e}")
+    def rejected_items(self):
+        # Offline changes the server refused, until the user dismisses them
+        rejected = self.store.rejected()
+        if not rejected:
             return []
+        items = [toga.Label(f'{len(rejected)} change(s) were not saved by the server:')]
+        for kind, payload, reason in rejected:
+            what = payload['name'] if kind == 'create_budget' else f"{payload['description']} ${payload['amount']}"
+            items.append(toga.Label(f'{what}: {reason}'))
+        items.append(toga.Button('Dismiss', on_press=self.dismiss_rejected))
+        return items
+
+    def dismiss_rejected(self, widget):
+        self.store.dismiss_rejected()
+        self.show_dashboard(sync=False)
+
+    def sync_status(self):
+        waiting = self.store.pending_count()
+        if waiting:
+            return f'{waiting} change(s) waiting to upload'
+        return 'Up to date' if self.sync.online else 'Offline'
+
+    async def refresh(self):
+        if self.syncing:
+            return
+        self.syncing = True
+        try:
+            await self.loop.run_in_executor(None, self.sync.sync)
+        except SessionExpired:
+            self.show_login()
+            return
+        finally:
+            self.syncing = False
+        if self.main_window.content is self.dashboard_box:
+            self.show_dashboard(sync=False)
 
     def show_budget_detail(self, idx):
         budget = self.budgets[idx]
-        budget_label = toga.Label(f"Budget: {budget['name']} (${budget['amount']})")
+        budget_label = toga.Label(f"Budget: {budget['name']} (${budget['budget']:.2f}, balance ${budget['balance']:.2f})")
         back_button = toga.Button('Back', on_press=lambda w: self.show_dashboard())
         transactions_label = toga.Label('Transactions:')
         transaction_items = []
-        for t in self.transactions:
-            transaction_items.append(toga.Label(f"{t['description']}: ${t['amount']}"))
+        for t in self.store.transactions(budget['id']):
+            pending = ' (not synced)' if t['pending'] else ''
+            transaction_items.append(toga.Label(f"{t['date']} {t['description']}: ${t['amount']}{pending}"))
         transactions_box = toga.Box(children=transaction_items, style=Pack(direction=COLUMN, padding=5))
         budget_detail_box = toga.Box(children=[
             budget_label,
@@ -100,16 +156,28 @@ class BudgetTracker(toga.App):
         self.main_window.content = add_budget_box
 
     def save_budget(self, name, amount):
-        self.budgets.append({'name': name, 'amount': amount})
+        # Queued; uploaded by the next sync, which the dashboard starts
+        try:
+            amount = float(amount or 0)
+        except ValueError:
+            return
+        if name:
+            self.store.queue_budget(name, amount)
         self.show_dashboard()
 
     def show_add_transaction(self, widget):
+        budget_input = toga.Selection(items=[{'name': b['name'], 'id': b['id']} for b in self.budgets],
+                                      accessor='name')
+        type_input = toga.Selection(items=['expense', 'income'])
         amount_input = toga.TextInput(placeholder='Amount')
         description_input = toga.TextInput(placeholder='Description')
-        save_button = toga.Button('Save', on_press=lambda w: self.save_transaction(amount_input.value, description_input.value))
+        save_button = toga.Button('Save', on_press=lambda w: self.save_transaction(
+            budget_input.value, amount_input.value, description_input.value, type_input.value))
         back_button = toga.Button('Back', on_press=lambda w: self.show_dashboard())
         add_transaction_box = toga.Box(children=[
             toga.Label('Add Transaction'),
+            budget_input,
+            type_input,
             amount_input,
             description_input,
             save_button,
@@ -117,10 +185,13 @@ class BudgetTracker(toga.App):
         ], style=Pack(direction=COLUMN, padding=10))
         self.main_window.content = add_transaction_box
 
-    def save_transaction(self, amount, description):
-        self.transactions.append({'amount': amount, 'description': description})
+    def save_transaction(self, budget, amount, description, transaction_type):
+        # Stamped now, so it keeps its real date however late it is uploaded
+        if budget is None:
+            return
+        self.store.queue_transaction(budget.id, amount, description, transaction_type,
+                                     datetime.now().strftime("%Y-%m-%d %H:%M"))
         self.show_dashboard()
 
-
 def main():
     return BudgetTracker()
@@ -0,0 +1,202 @@
+"""
+on-device cache of the user's budgets, plus the outbox of writes made offline
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import sqlite3
+import threading
+import uuid
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS budgets (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    budget REAL NOT NULL,
+    balance REAL NOT NULL,
+    role TEXT,
+    version INTEGER,
+    last_modified TEXT
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    budget_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    date TEXT,
+    type TEXT,
+    amount REAL,
+    description TEXT,
+    added_by TEXT,
+    PRIMARY KEY (budget_id, seq)
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rejected (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    reason TEXT
+);
+"""
+
+# Budgets created offline get an id with this prefix until the server
+# assigns the real one
+LOCAL_PREFIX = 'local-'
+
+# PBKDF2 rounds for the offline password check
+PASSWORD_ITERATIONS = 200000
+
+
+def password_verifier(password, salt):
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, PASSWORD_ITERATIONS).hex()
+
+
+class LocalStore:
+    # Everything the screens show comes from here, so they render without
+    # the network. apply_sync() folds in a /api/sync response; writes made
+    # on the device go to the outbox and show up as pending until uploaded.
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def get_meta(self, key):
+        with self.lock:
+            row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else None
+
+    def set_meta(self, key, value):
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def reset(self, email):
+        # Another account signed in on this device: forget the old one's data
+        with self.lock, self.conn:
+            for table in ('meta', 'budgets', 'transactions', 'outbox', 'rejected'):
+                self.conn.execute(f'DELETE FROM {table}')
+            self.conn.execute("INSERT INTO meta (key, value) VALUES ('email', ?)", (email,))
+
+    def remember_password(self, password):
+        # After a successful online login, so the same password can unlock
+        # the cache offline. Only a salted PBKDF2 hash is kept.
+        salt = os.urandom(16)
+        with self.lock, self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                                  [('password_salt', salt.hex()), ('password_verifier', password_verifier(password, salt))])
+
+    def check_password(self, email, password):
+        # Offline login: the account last signed in here, with its password
+        salt = self.get_meta('password_salt')
+        verifier = self.get_meta('password_verifier')
+        if self.get_meta('email') != email or not salt or not verifier:
+            return False
+        return hmac.compare_digest(password_verifier(password, bytes.fromhex(salt)), verifier)
+
+    def budgets(self):
+        # Synced budgets, then ones created offline and not uploaded yet
+        with self.lock:
+            rows = self.conn.execute('SELECT * FROM budgets ORDER BY rowid').fetchall()
+            pending = self.conn.execute("SELECT payload FROM outbox WHERE kind = 'create_budget' ORDER BY id")
+            pending = [json.loads(row['payload']) for row in pending]
+        budgets = [dict(row, pending=False) for row in rows]
+        for payload in pending:
+            amount = float(payload['initial_amount'])
+            budgets.append({'id': payload['local_id'], 'name': payload['name'], 'budget': amount,
+                            'balance': amount, 'role': 'owner', 'pending': True})
+        return budgets
+
+    def transactions(self, budget_id):
+        # Newest first; pending ones (not uploaded yet) on top
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT * FROM transactions WHERE budget_id = ? ORDER BY date DESC, seq DESC',
+                (budget_id,)).fetchall()
+            pending = self.conn.execute("SELECT payload FROM outbox WHERE kind = 'add_transaction' ORDER BY id DESC")
+            pending = [json.loads(row['payload']) for row in pending]
+        queued = [dict(payload, pending=True) for payload in pending if payload['budget_id'] == budget_id]
+        return queued + [dict(row, pending=False) for row in rows]
+
+    def apply_sync(self, response):
+        # One /api/sync response, applied atomically along with its token
+        with self.lock, self.conn:
+            for budget_id in response['removed']:
+                self.conn.execute('DELETE FROM budgets WHERE id = ?', (budget_id,))
+                self.conn.execute('DELETE FROM transactions WHERE budget_id = ?', (budget_id,))
+            self.conn.executemany(
+                """INSERT OR REPLACE INTO budgets (id, name, budget, balance, role, version, last_modified)
+                   VALUES (:id, :name, :budget, :balance, :role, :version, :last_modified)""",
+                response['budgets'])
+            self.conn.executemany(
+                """INSERT OR REPLACE INTO transactions (budget_id, seq, date, type, amount, description, added_by)
+                   VALUES (:budget_id, :seq, :date, :type, :amount, :description, :added_by)""",
+                response['transactions'])
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('sync_token', ?)",
+                              (response['token'],))
+
+    def queue(self, kind, payload):
+        # Each entry gets its own op id; the server applies an id once, so
+        # re-sending a page whose answer was lost doesn't write it twice
+        payload = dict(payload, op_id=uuid.uuid4().hex)
+        with self.lock, self.conn:
+            self.conn.execute('INSERT INTO outbox (kind, payload) VALUES (?, ?)', (kind, json.dumps(payload)))
+
+    def queue_budget(self, name, initial_amount):
+        local_id = LOCAL_PREFIX + uuid.uuid4().hex
+        self.queue('create_budget', {'local_id': local_id, 'name': name, 'initial_amount': initial_amount})
+        return local_id
+
+    def queue_transaction(self, budget_id, amount, description, transaction_type, date):
+        self.queue('add_transaction', {'budget_id': budget_id, 'amount': amount, 'description': description,
+                                       'type': transaction_type, 'date': date})
+
+    def pending(self, limit=50):
+        # [(outbox id, kind, payload)] oldest first
+        with self.lock:
+            rows = self.conn.execute('SELECT * FROM outbox ORDER BY id LIMIT ?', (limit,)).fetchall()
+        return [(row['id'], row['kind'], json.loads(row['payload'])) for row in rows]
+
+    def pending_count(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+    def ack(self, outbox_ids, rejected=()):
+        # Drops answered entries from the outbox. rejected is [(outbox id,
+        # kind, payload, reason)] for the ones the server refused; they are
+        # kept in rejected() until the user dismisses them.
+        with self.lock, self.conn:
+            self.conn.executemany('INSERT INTO rejected (kind, payload, reason) VALUES (?, ?, ?)',
+                                  [(kind, json.dumps(payload), reason) for _, kind, payload, reason in rejected])
+            self.conn.executemany('DELETE FROM outbox WHERE id = ?', [(outbox_id,) for outbox_id in outbox_ids])
+
+    def rejected(self):
+        # [(kind, payload, reason)] oldest first
+        with self.lock:
+            rows = self.conn.execute('SELECT * FROM rejected ORDER BY id').fetchall()
+        return [(row['kind'], json.loads(row['payload']), row['reason']) for row in rows]
+
+    def dismiss_rejected(self):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM rejected')
+
+    def remap_budget(self, local_id, budget_id):
+        # A budget created offline now has its server id; queued
+        # transactions for it must use that id when they are sent
+        with self.lock, self.conn:
+            rows = self.conn.execute("SELECT id, payload FROM outbox WHERE kind = 'add_transaction'").fetchall()
+            for row in rows:
+                payload = json.loads(row['payload'])
+                if payload['budget_id'] == local_id:
+                    payload['budget_id'] = budget_id
+                    self.conn.execute('UPDATE outbox SET payload = ? WHERE id = ?', (json.dumps(payload), row['id']))
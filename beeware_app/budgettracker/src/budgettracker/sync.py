@@ -0,0 +1,171 @@
+"""
+talking to the budget server: login, delta sync and uploading the outbox
+"""
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from budgettracker.localstore import LOCAL_PREFIX
+
+# The server can't be reached at all
+OFFLINE_ERRORS = (requests.ConnectionError, requests.Timeout)
+
+AUTH_REQUIRED = "Authentication required!"
+
+
+class SessionExpired(Exception):
+    pass
+
+
+class ServerError(Exception):
+    # The server answered with an error status. 5xx, 408 and 429 are worth
+    # retrying later; any other 4xx means the request itself was refused.
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+    @property
+    def retryable(self):
+        return self.status >= 500 or self.status in (408, 429)
+
+
+def check_response(response):
+    if response.status_code == 401:
+        raise SessionExpired()
+    if response.status_code >= 400:
+        try:
+            message = response.json().get('message')
+        except ValueError:
+            message = None
+        raise ServerError(response.status_code, message or f"Server error {response.status_code}")
+
+
+class SyncClient:
+    # One pooled requests.Session for the whole app, so every call after the
+    # first reuses the open connection (and carries the login cookie).
+    def __init__(self, base_url, store, timeout=10):
+        self.base_url = base_url.rstrip('/')
+        self.store = store
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=1))
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=1))
+        self.online = False
+
+    def close(self):
+        self.session.close()
+
+    def _post(self, path, data=None, json=None):
+        response = self.session.post(self.base_url + path, data=data, json=json, timeout=self.timeout)
+        check_response(response)
+        result = response.json()
+        if result.get('message') == AUTH_REQUIRED:
+            raise SessionExpired()
+        return result
+
+    def login(self, email, password):
+        # True/False for the server's answer; raises an OFFLINE_ERRORS
+        # exception when it can't be reached and ServerError when it fails
+        result = self._post('/api/login', {'email': email, 'password': password})
+        self.online = True
+        if result.get('success'):
+            if self.store.get_meta('email') != email:
+                self.store.reset(email)
+            self.store.remember_password(password)
+        return bool(result.get('success'))
+
+    def sync(self):
+        # Upload queued writes, then pull the delta; returns True if
+        # anything changed. Offline, it leaves everything queued for later.
+        # Raises SessionExpired if the server wants a new login.
+        try:
+            uploaded = self.flush_outbox()
+            changed = self.pull()
+        except OFFLINE_ERRORS:
+            self.online = False
+            return False
+        except ServerError:
+            # Only retryable failures get here; nothing was lost
+            self.online = False
+            return False
+        self.online = True
+        return bool(uploaded or changed)
+
+    def pull(self):
+        changed = False
+        while True:
+            token = self.store.get_meta('sync_token')
+            # In the body: the token grows with the number of budgets
+            response = self.session.post(self.base_url + '/api/sync', json={'since': token or None},
+                                         timeout=self.timeout)
+            if response.status_code == 400 and token:
+                # The server no longer understands our token: start over
+                self.store.set_meta('sync_token', '')
+                continue
+            check_response(response)
+            delta = response.json()
+            self.store.apply_sync(delta)
+            changed = changed or bool(delta['budgets'] or delta['removed'])
+            if not delta['more']:
+                return changed
+
+    def flush_outbox(self, batch=100):
+        # Sends queued writes oldest first, a whole page of them per
+        # /api/batch call, and drops each page once the server has answered
+        # it. Entries the server refused move to the store's rejected list,
+        # where the user can see them. A connection error or a retryable
+        # server error leaves the page queued for next time; each operation
+        # carries its entry's op id, so the server skips any it already applied.
+        sent = 0
+        while True:
+            entries = self.store.pending(batch)
+            if not entries:
+                return sent
+            operations, sent_entries, orphans = self._operations(entries)
+            rejected = [(*entry, "Its budget was not created") for entry in orphans]
+            if operations:
+                try:
+                    result = self._post('/api/batch', json={'operations': operations})
+                except ServerError as error:
+                    if error.retryable:
+                        raise
+                    # The whole request was refused; retrying won't change that
+                    rejected += [(*entry, error.message) for entry in sent_entries]
+                else:
+                    for entry, outcome in zip(sent_entries, result['results']):
+                        outbox_id, kind, payload = entry
+                        if not outcome['success']:
+                            rejected.append((*entry, outcome.get('message') or "Refused by the server"))
+                        elif kind == 'create_budget':
+                            self.store.remap_budget(payload['local_id'], outcome['budget_id'])
+            self.store.ack([outbox_id for outbox_id, kind, payload in entries], rejected)
+            sent += len(entries)
+
+    def _operations(self, entries):
+        # Outbox entries as /api/batch operations, the entries they came
+        # from, and the entries that can't be sent: transactions for a
+        # budget created offline that the server refused. Transactions for
+        # a budget created earlier in the same page refer to it as "$<index>".
+        operations = []
+        sent_entries = []
+        orphans = []
+        created = {}
+        for entry in entries:
+            outbox_id, kind, payload = entry
+            if kind == 'create_budget':
+                created[payload['local_id']] = f'${len(operations)}'
+                operations.append({'op': 'create_budget', 'op_id': payload.get('op_id'), 'name': payload['name'],
+                                   'initial_amount': payload['initial_amount']})
+                sent_entries.append(entry)
+            elif kind == 'add_transaction':
+                budget_id = payload['budget_id']
+                if budget_id.startswith(LOCAL_PREFIX):
+                    if budget_id not in created:
+                        orphans.append(entry)
+                        continue
+                    budget_id = created[budget_id]
+                operations.append({'op': 'add_transaction', 'op_id': payload.get('op_id'), 'budget_id': budget_id,
+                                   **{key: payload[key] for key in ('amount', 'description', 'type', 'date')}})
+                sent_entries.append(entry)
+        return operations, sent_entries, orphans
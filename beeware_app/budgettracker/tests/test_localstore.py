@@ -0,0 +1,86 @@
+from budgettracker.localstore import LocalStore
+
+
+def make_store(tmp_path):
+    return LocalStore(str(tmp_path / 'budgets.db'))
+
+
+def sync_response(budgets=(), transactions=(), removed=(), token='t1'):
+    return {'budgets': list(budgets), 'transactions': list(transactions), 'removed': list(removed),
+            'token': token, 'more': False}
+
+
+def test_apply_sync_stores_budgets_transactions_and_token(tmp_path):
+    store = make_store(tmp_path)
+    store.apply_sync(sync_response(
+        [{'id': 'b1', 'name': 'Home', 'budget': 100.0, 'balance': 90.0, 'role': 'owner', 'version': 2,
+          'last_modified': '2025-01-02 10:00'}],
+        [{'budget_id': 'b1', 'seq': 0, 'date': '2025-01-02 10:00', 'type': 'expense', 'amount': 10.0,
+          'description': 'Lunch', 'added_by': 'alice'}]))
+
+    assert [(b['id'], b['balance'], b['pending']) for b in store.budgets()] == [('b1', 90.0, False)]
+    assert [t['description'] for t in store.transactions('b1')] == ['Lunch']
+    assert store.get_meta('sync_token') == 't1'
+
+    # Replaying the same delta changes nothing; removed budgets disappear
+    store.apply_sync(sync_response(transactions=[dict(store.transactions('b1')[0], budget_id='b1')], token='t2'))
+    assert len(store.transactions('b1')) == 1
+    store.apply_sync(sync_response(removed=['b1'], token='t3'))
+    assert store.budgets() == [] and store.transactions('b1') == []
+
+
+def test_offline_writes_are_pending_until_acked(tmp_path):
+    store = make_store(tmp_path)
+    local_id = store.queue_budget('Trip', 50.0)
+    store.queue_transaction(local_id, '12.5', 'Fuel', 'expense', '2025-01-03 09:00')
+
+    budgets = store.budgets()
+    assert [(b['id'], b['pending']) for b in budgets] == [(local_id, True)]
+    assert [t['description'] for t in store.transactions(local_id)] == ['Fuel']
+
+    # Once the server has created the budget, queued transactions follow its new id
+    entries = store.pending()
+    assert [kind for _, kind, _ in entries] == ['create_budget', 'add_transaction']
+    store.remap_budget(local_id, 'server-1')
+    store.ack([entries[0][0]])
+    assert store.pending()[0][2]['budget_id'] == 'server-1'
+    assert store.pending_count() == 1
+
+
+def test_reset_forgets_the_previous_account(tmp_path):
+    store = make_store(tmp_path)
+    store.queue_budget('Old', 1.0)
+    store.set_meta('sync_token', 'old')
+    store.reset('new@example.com')
+    assert store.budgets() == [] and store.pending_count() == 0
+    assert store.get_meta('sync_token') is None
+    assert store.get_meta('email') == 'new@example.com'
+
+
+def test_rejected_writes_are_kept_until_dismissed(tmp_path):
+    store = make_store(tmp_path)
+    store.queue_transaction('b1', '5', 'Snacks', 'expense', '2025-01-03 09:00')
+    store.queue_transaction('b1', '7', 'Bus', 'expense', '2025-01-03 10:00')
+    first, second = store.pending()
+
+    store.ack([first[0], second[0]], [(*second, 'Invalid amount!')])
+    assert store.pending_count() == 0
+    assert store.rejected() == [('add_transaction', second[2], 'Invalid amount!')]
+    store.dismiss_rejected()
+    assert store.rejected() == []
+
+
+def test_offline_password_check(tmp_path):
+    store = make_store(tmp_path)
+    store.reset('a@example.com')
+    # Nothing remembered yet: no offline access
+    assert not store.check_password('a@example.com', 'secret1')
+
+    store.remember_password('secret1')
+    assert store.get_meta('password_verifier') != 'secret1'
+    assert store.check_password('a@example.com', 'secret1')
+    assert not store.check_password('a@example.com', 'wrong')
+    assert not store.check_password('b@example.com', 'secret1')
+
+    store.reset('b@example.com')
+    assert not store.check_password('b@example.com', 'secret1')
@@ -0,0 +1,131 @@
+# The JSON backend before and after `manage.py archive`: the same
+# several-year history, then again with everything older than --keep-days
+# moved into monthly segment files. Each run is a fresh interpreter that
+# loads every record (BUDGET_LAZY_LOAD=0), so RSS is the whole dataset's;
+# it then rewrites the snapshot, serves the newest page of one budget and
+# pages back into its oldest month. Linux only (RSS comes from /proc).
+#
+#   python -m benchmarks.archive --transactions 1000000 --years 5
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from storage import JsonStorage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+END = datetime(2025, 12, 31, 23, 0)
+
+# Runs inside the child; prints one JSON line of timings
+CHILD = '''
+import json, sys, time
+sys.path.insert(0, %r)
+from storage import JsonStorage
+start = time.perf_counter()
+storage = JsonStorage(lazy=False)
+loaded = time.perf_counter()
+with open('/proc/self/status') as f:
+    rss = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+storage.save_data()
+saved = time.perf_counter()
+storage.recent_transactions(%r, 20)
+recent = time.perf_counter()
+transactions = list(storage.iter_transactions(%r, date_to=%r))
+oldest = time.perf_counter()
+assert transactions
+print(json.dumps({'load': loaded - start, 'rss_mb': rss / 1024, 'save': saved - loaded,
+                  'recent': recent - saved, 'oldest_month': oldest - recent}))
+'''
+
+
+def write_dataset(workdir, transactions, per_budget, years):
+    budgets, users = {}, {}
+    per_budget = min(per_budget, transactions)
+    step = timedelta(days=365 * years) / per_budget
+    start = END - step * per_budget
+    for b in range(max(1, transactions // per_budget)):
+        user_id, budget_id = f'user-{b}', f'budget-{b}'
+        users[user_id] = {'email': f'user{b}@example.com', 'username': f'user{b}', 'password_hash': '',
+                          'budgets': [budget_id], 'shared_budgets': [], 'created_at': start.strftime('%Y-%m-%d %H:%M')}
+        budgets[budget_id] = {
+            'id': budget_id, 'name': f'Budget {b}', 'owner': user_id, 'collaborators': [], 'budget': 1000.0,
+            'created_at': start.strftime('%Y-%m-%d %H:%M'),
+            'transactions': [{'date': (start + step * t).strftime('%Y-%m-%d %H:%M'),
+                              'type': 'income' if t % 5 == 0 else 'expense', 'amount': float(t % 90 + 1),
+                              'description': f'transaction {t}', 'added_by': f'user{b}'}
+                             for t in range(per_budget)]}
+    with open(os.path.join(workdir, 'budgets_data.json'), 'w') as f:
+        f.write(json.dumps(budgets, separators=(',', ':')))
+    with open(os.path.join(workdir, 'users_data.json'), 'w') as f:
+        f.write(json.dumps(users, separators=(',', ':')))
+    return start
+
+
+def in_workdir(workdir, function, *args):
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        return function(*args)
+    finally:
+        os.chdir(cwd)
+
+
+def archive(before):
+    storage = JsonStorage()
+    start = time.perf_counter()
+    budgets, transactions = storage.archive_transactions(before)
+    elapsed = time.perf_counter() - start
+    storage.close()
+    return transactions, elapsed
+
+
+def run_child(workdir, first_month_end):
+    env = dict(os.environ, BUDGET_STORAGE='json', BUDGET_LAZY_LOAD='0')
+    output = subprocess.run([sys.executable, '-c', CHILD % (ROOT, 'budget-0', 'budget-0', first_month_end)],
+                            cwd=workdir, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def disk_mb(workdir):
+    snapshot = os.path.getsize(os.path.join(workdir, 'budgets_data.json'))
+    segments = 0
+    for folder, _, files in os.walk(os.path.join(workdir, 'budgets_archive')):
+        segments += sum(os.path.getsize(os.path.join(folder, name)) for name in files)
+    return snapshot / 1e6, segments / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--transactions', type=int, default=1000000)
+    parser.add_argument('--per-budget', type=int, default=2000)
+    parser.add_argument('--years', type=int, default=5, help="history length, ending at %s" % END.date())
+    parser.add_argument('--keep-days', type=int, default=365, help="archive transactions older than this")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per state; the fastest is reported")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    start = write_dataset(workdir, args.transactions, args.per_budget, args.years)
+    # One open writes the snapshot back out with its aggregates and rollups
+    in_workdir(workdir, lambda: JsonStorage().close())
+    first_month_end = (start.replace(day=1) + timedelta(days=32)).replace(day=1).strftime('%Y-%m-%d')
+
+    print(f"{'state':>9} {'load (s)':>9} {'RSS MB':>7} {'save (s)':>9} {'recent (s)':>11} "
+          f"{'oldest month (s)':>17} {'snapshot MB':>12} {'segments MB':>12}")
+    for state in ('before', 'archived'):
+        if state == 'archived':
+            before = (END - timedelta(days=args.keep_days)).strftime('%Y-%m-%d')
+            moved, elapsed = in_workdir(workdir, archive, before)
+            print(f"archived {moved} of {args.transactions} transactions (before {before}) in {elapsed:.2f}s")
+        runs = [run_child(workdir, first_month_end) for _ in range(args.repeat)]
+        best = min(runs, key=lambda run: run['load'] + run['save'])
+        snapshot, segments = disk_mb(workdir)
+        print(f"{state:>9} {best['load']:9.3f} {best['rss_mb']:7.1f} {best['save']:9.3f} {best['recent']:11.4f} "
+              f"{best['oldest_month']:17.4f} {snapshot:12.1f} {segments:12.1f}")
+
+
+if __name__ == '__main__':
+    main()
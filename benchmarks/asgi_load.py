@@ -0,0 +1,246 @@
+# The benchmarks.load mix served two ways from one process: the Flask (WSGI)
+# app with a thread per connection, and asgi_app with a coroutine per
+# connection on one event loop. Both also hold --streams idle budget event
+# streams open for the whole run, the way open dashboards do. Reports p50/p99
+# per request type and mode, and the threads each mode needed.
+#
+# Requests are made in-process (the Flask test client, and ASGI calls on
+# the loop), so the numbers compare the serving models, not HTTP servers.
+#
+#   python -m benchmarks.asgi_load --backend json --concurrency 64 --streams 200 --json asgi.json
+import argparse
+import asyncio
+import json
+import random
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+from benchmarks.datagen import PASSWORD, generate, open_storage
+from benchmarks.load import MIX, request_for
+from benchmarks.report import load_app, print_results, summarize, write_report
+
+
+class AsgiClient:
+    # Just enough of an ASGI server to call the app directly, keeping the
+    # session cookie between requests
+    def __init__(self, app):
+        self.app = app
+        self.cookie = None
+
+    def scope(self, method, path, headers):
+        path, _, query = path.partition('?')
+        if self.cookie:
+            headers = headers + [(b'cookie', self.cookie.encode('latin-1'))]
+        return {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+                'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+                'root_path': '', 'headers': headers, 'client': ('127.0.0.1', 0), 'server': ('bench', 80)}
+
+    async def request(self, method, path, data=None):
+        headers = [(b'host', b'bench')]
+        body = b''
+        if data is not None:
+            body = urlencode(data).encode()
+            headers.append((b'content-type', b'application/x-www-form-urlencoded'))
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            return {'type': 'http.disconnect'}
+
+        response = {'status': None, 'body': b''}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                for name, value in message['headers']:
+                    if name == b'set-cookie':
+                        self.cookie = value.decode('latin-1').split(';', 1)[0]
+            else:
+                response['body'] += message.get('body', b'')
+
+        await self.app(self.scope(method, path, headers), receive, send)
+        return response
+
+    async def stream(self, path, stop):
+        # Holds an event stream open until stop is set; returns the chunks seen
+        disconnect = asyncio.Event()
+        chunks = []
+        messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.body' and message.get('body'):
+                chunks.append(message['body'])
+
+        task = asyncio.ensure_future(self.app(self.scope('GET', path, [(b'host', b'bench')]), receive, send))
+        await stop.wait()
+        disconnect.set()
+        await task
+        return len(chunks)
+
+
+def run_wsgi(flask_app, users, concurrency, requests, streams, seed):
+    app = flask_app.app
+    rng = random.Random(seed)
+    clients = []
+    for index in range(concurrency):
+        client = app.test_client()
+        response = client.post('/api/login', data={'email': f'user{rng.randrange(users)}@example.com',
+                                                   'password': PASSWORD})
+        assert response.get_json()['success'], response.get_json()
+        budget_ids = [budget['id'] for budget in client.get('/api/budgets').get_json()['budgets']]
+        clients.append((client, budget_ids))
+
+    # One thread per open stream, blocked waiting for events, as under a
+    # threaded WSGI server
+    stop = threading.Event()
+
+    def hold_stream(client, budget_id):
+        response = client.get(f'/api/budget/{budget_id}/events', buffered=False)
+        chunks = iter(response.response)
+        while not stop.is_set():
+            next(chunks)
+        response.close()
+
+    stream_threads = []
+    for i in range(streams):
+        client, budget_ids = clients[i % concurrency]
+        stream_threads.append(threading.Thread(target=hold_stream, args=(client, budget_ids[0]), daemon=True))
+    for thread in stream_threads:
+        thread.start()
+
+    names = [name for name, weight in MIX]
+    weights = [weight for name, weight in MIX]
+    samples = {name: [] for name in names}
+    errors = []
+    barrier = threading.Barrier(concurrency + 1)
+
+    def worker(index):
+        client, budget_ids = clients[index]
+        rng = random.Random(seed * 1000 + index)
+        mine = {name: [] for name in names}
+        failed = 0
+        barrier.wait()
+        for _ in range(requests):
+            name = rng.choices(names, weights)[0]
+            method, path, data = request_for(name, rng.choice(budget_ids), rng)
+            start = time.perf_counter()
+            response = client.open(path, method=method, data=data)
+            mine[name].append(time.perf_counter() - start)
+            failed += response.status_code >= 400
+        for name, values in mine.items():
+            samples[name].extend(values)
+        errors.append(failed)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    peak_threads = threading.active_count()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    # A stream thread notices stop at its next heartbeat; they are daemons
+    return samples, elapsed, sum(errors), peak_threads
+
+
+async def run_asgi(asgi_app, users, concurrency, requests, streams, seed):
+    rng = random.Random(seed)
+    clients = []
+    for index in range(concurrency):
+        client = AsgiClient(asgi_app.app)
+        await client.request('POST', '/api/login', {'email': f'user{rng.randrange(users)}@example.com',
+                                                    'password': PASSWORD})
+        response = await client.request('GET', '/api/budgets')
+        budget_ids = [budget['id'] for budget in json.loads(response['body'])['budgets']]
+        clients.append((client, budget_ids))
+
+    stop = asyncio.Event()
+    holders = [asyncio.ensure_future(clients[i % concurrency][0].stream(
+        f'/api/budget/{clients[i % concurrency][1][0]}/events', stop)) for i in range(streams)]
+    await asyncio.sleep(0)
+
+    names = [name for name, weight in MIX]
+    weights = [weight for name, weight in MIX]
+    samples = {name: [] for name in names}
+    errors = 0
+
+    async def worker(index):
+        nonlocal errors
+        client, budget_ids = clients[index]
+        rng = random.Random(seed * 1000 + index)
+        for _ in range(requests):
+            name = rng.choices(names, weights)[0]
+            method, path, data = request_for(name, rng.choice(budget_ids), rng)
+            start = time.perf_counter()
+            response = await client.request(method, path, data)
+            samples[name].append(time.perf_counter() - start)
+            errors += response['status'] >= 400
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    peak_threads = threading.active_count()
+    stop.set()
+    await asyncio.gather(*holders)
+    return samples, elapsed, errors, peak_threads
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backend', choices=('json', 'sqlite', 'sharded'), default='json')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--budgets', type=int, default=2000)
+    parser.add_argument('--transactions', type=int, default=200000)
+    parser.add_argument('--collaborators', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=64, help="connections making requests")
+    parser.add_argument('--requests', type=int, default=100, help="per connection")
+    parser.add_argument('--streams', type=int, default=200, help="idle event streams held open")
+    parser.add_argument('--rounds', type=int, default=4, help="bcrypt cost for the logins")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="write the report to this file ('-' for stdout)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    storage = open_storage(args.backend, workdir)
+    generate(storage, args.users, args.budgets, args.transactions, args.collaborators, args.seed, args.rounds)
+    storage.close()
+    flask_app = load_app(workdir, args.backend, args.rounds)
+    # Short heartbeats so the WSGI stream threads notice the end of the run
+    flask_app.EVENT_HEARTBEAT_SECONDS = 1
+    import asgi_app
+
+    results = {}
+    threads = {}
+    for mode in ('wsgi', 'asgi'):
+        if mode == 'wsgi':
+            samples, elapsed, errors, threads[mode] = run_wsgi(flask_app, args.users, args.concurrency,
+                                                               args.requests, args.streams, args.seed)
+        else:
+            samples, elapsed, errors, threads[mode] = asyncio.run(run_asgi(
+                asgi_app, args.users, args.concurrency, args.requests, args.streams, args.seed))
+        for name, values in samples.items():
+            results[f'{mode} {name}'] = summarize(values, elapsed)
+        results[f'{mode} all'] = summarize([value for values in samples.values() for value in values], elapsed)
+        results[f'{mode} all'].update(errors=errors, threads=threads[mode])
+        print(f"{mode}: {args.concurrency} connections x {args.requests} requests with {args.streams} open "
+              f"streams in {elapsed:.2f}s, {errors} errors, {threads[mode]} threads")
+    flask_app.budget_manager.close()
+
+    print_results(results)
+    if args.json:
+        write_report(args.json, 'asgi_load', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
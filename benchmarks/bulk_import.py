@@ -0,0 +1,62 @@
+# Bulk import of a bank-export-sized CSV versus one add_transaction per row.
+#
+#   python -m benchmarks.bulk_import --rows 100000
+import argparse
+import io
+import os
+import tempfile
+import time
+
+from budgets import BudgetManager
+from hashing import PasswordHasher
+from sqlite_storage import SQLiteStorage
+from storage import JsonStorage
+
+
+def make_csv(rows):
+    lines = ['date,amount,description,type']
+    for i in range(rows):
+        lines.append(f'2024-{i % 12 + 1:02d}-{i % 28 + 1:02d} 12:00,{i % 500 + 1}.25,row {i},'
+                     f'{"income" if i % 4 == 0 else "expense"}')
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def make_manager(kind, workdir):
+    if kind == 'json':
+        storage = JsonStorage(*(os.path.join(workdir, name) for name in
+                                ('budgets.json', 'users.json', 'journal.log')))
+    else:
+        storage = SQLiteStorage(os.path.join(workdir, 'budgets.db'))
+    manager = BudgetManager(storage, PasswordHasher(workers=0, rounds=4))
+    user_id = 'bench-user'
+    storage.create_user(user_id, {'email': 'bench@example.com', 'username': 'bench', 'password_hash': '',
+                                  'budgets': [], 'shared_budgets': [], 'created_at': '2025-01-01 00:00'})
+    return manager, user_id, manager.create_budget(user_id, 'bench')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--single-rows', type=int, default=2000,
+                        help="rows to time through add_transaction for the per-row baseline")
+    args = parser.parse_args()
+    data = make_csv(args.rows)
+
+    print(f"{'backend':>8} {'bulk rows/s':>12} {'bulk total (s)':>15} {'single rows/s':>14}")
+    for kind in ('json', 'sqlite'):
+        manager, user_id, budget_id = make_manager(kind, tempfile.mkdtemp())
+        start = time.perf_counter()
+        result = manager.import_transactions(budget_id, user_id, io.BytesIO(data), 'csv')
+        bulk = time.perf_counter() - start
+        assert result['imported'] == args.rows, result
+
+        start = time.perf_counter()
+        for i in range(args.single_rows):
+            manager.add_transaction(budget_id, user_id, '12.50', f'single {i}', 'expense')
+        single = time.perf_counter() - start
+        print(f'{kind:>8} {args.rows / bulk:12.0f} {bulk:15.2f} {args.single_rows / single:14.0f}')
+        manager.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+# Side by side of two JSON reports from the same benchmark, e.g. before and
+# after a change.
+#
+#   python -m benchmarks.compare before.json after.json
+import argparse
+import json
+
+METRICS = (('p50_ms', 'lower'), ('p99_ms', 'lower'), ('ops_per_sec', 'higher'))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('before')
+    parser.add_argument('after')
+    args = parser.parse_args()
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    if before['benchmark'] != after['benchmark']:
+        parser.error(f"{args.before} is a {before['benchmark']} report, {args.after} a {after['benchmark']} one")
+    changed = sorted(key for key in set(before['params']) | set(after['params'])
+                     if key != 'json' and before['params'].get(key) != after['params'].get(key))
+    if changed:
+        print(f"Note: parameters differ: {', '.join(changed)}")
+
+    print(f"{before['environment'].get('commit')} -> {after['environment'].get('commit')}")
+    print(f"{'':>34} {'before':>10} {'after':>10} {'change':>8}")
+    for name in before['results']:
+        if name not in after['results']:
+            continue
+        for metric, better in METRICS:
+            old, new = before['results'][name][metric], after['results'][name][metric]
+            change = (new - old) / old * 100 if old else 0.0
+            worse = change > 0 if better == 'lower' else change < 0
+            flag = ' !' if worse and abs(change) >= 10 else ''
+            print(f"{name + ' ' + metric:>34} {old:10.3f} {new:10.3f} {change:+7.1f}%{flag}")
+
+
+if __name__ == '__main__':
+    main()
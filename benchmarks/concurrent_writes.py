@@ -0,0 +1,129 @@
+# Stress test: many threads adding transactions to many budgets at once,
+# with a small compaction threshold so snapshots happen under load. Checks
+# that every write is in memory and survives a reload, then compares
+# writers spread over many budgets with all of them on one budget.
+#
+#   python -m benchmarks.concurrent_writes --threads 16 --budgets 64 --writes 2000
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from budgets import BudgetManager
+from hashing import PasswordHasher
+from sharded_storage import ShardedStorage
+from sqlite_storage import SQLiteStorage
+from storage import JsonStorage
+
+
+def open_storage(kind, workdir, compact_bytes):
+    if kind == 'json':
+        return JsonStorage(*(os.path.join(workdir, name) for name in ('budgets.json', 'users.json', 'journal.log')),
+                           compact_min_bytes=compact_bytes)
+    if kind == 'sharded':
+        return ShardedStorage(os.path.join(workdir, 'shards'))
+    return SQLiteStorage(os.path.join(workdir, 'budgets.db'))
+
+
+def hammer(manager, user_id, budget_ids, threads, writes):
+    # Every thread adds `writes` transactions to randomly chosen budgets and
+    # tallies what it wrote; returns the merged tallies and the elapsed time
+    expected = {budget_id: [0, 0.0] for budget_id in budget_ids}
+    tally_lock = threading.Lock()
+    failures = []
+    barrier = threading.Barrier(threads)
+
+    def worker(index):
+        rng = random.Random(index)
+        mine = {}
+        barrier.wait()
+        for i in range(writes):
+            budget_id = rng.choice(budget_ids)
+            amount = rng.randint(1, 100)
+            result = manager.add_transaction(budget_id, user_id, str(amount), f't{index}-{i}', 'income')
+            if not result['success']:
+                failures.append(result['message'])
+                continue
+            totals = mine.setdefault(budget_id, [0, 0.0])
+            totals[0] += 1
+            totals[1] += amount
+        with tally_lock:
+            for budget_id, (count, total) in mine.items():
+                expected[budget_id][0] += count
+                expected[budget_id][1] += total
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if failures:
+        raise AssertionError(f"{len(failures)} writes failed, e.g. {failures[0]}")
+    return expected, elapsed
+
+
+def lost_updates(storage, expected):
+    # Budgets whose stored count, total or history disagree with the tallies
+    lost = []
+    for budget_id, (count, total) in expected.items():
+        budget = storage.get_budget(budget_id)
+        stored = sum(1 for _ in storage.iter_transactions(budget_id))
+        if budget['transaction_count'] != count or stored != count or abs(budget['income_total'] - total) > 1e-6:
+            lost.append((budget_id, count, budget['transaction_count'], stored))
+    return lost
+
+
+def run(kind, threads, budgets, writes, compact_bytes):
+    workdir = tempfile.mkdtemp()
+    storage = open_storage(kind, workdir, compact_bytes)
+    manager = BudgetManager(storage, PasswordHasher(workers=0, rounds=4))
+    user_id = 'stress-user'
+    storage.create_user(user_id, {'email': 'stress@example.com', 'username': 'stress', 'password_hash': '',
+                                  'budgets': [], 'shared_budgets': [], 'created_at': '2025-01-01 00:00'})
+    spread = [manager.create_budget(user_id, f'budget {i}') for i in range(budgets)]
+    single = [manager.create_budget(user_id, 'hot budget')]
+
+    rows = []
+    for label, budget_ids in (('spread', spread), ('one budget', single)):
+        expected, elapsed = hammer(manager, user_id, budget_ids, threads, writes)
+        rows.append((label, threads * writes / elapsed, lost_updates(storage, expected), expected))
+
+    # Everything must also come back from disk
+    manager.close()
+    storage = open_storage(kind, workdir, compact_bytes)
+    reloaded = lost_updates(storage, {k: v for row in rows for k, v in row[3].items()})
+    storage.close()
+    return rows, reloaded
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--budgets', type=int, default=64)
+    parser.add_argument('--writes', type=int, default=2000, help="transactions per thread")
+    parser.add_argument('--compact-bytes', type=int, default=256 * 1024,
+                        help="JSON journal size that triggers a snapshot")
+    parser.add_argument('--backend', choices=('json', 'sqlite', 'sharded', 'all'), default='all')
+    args = parser.parse_args()
+
+    ok = True
+    print(f"{'backend':>8} {'writers on':>11} {'writes/s':>10} {'lost':>6}")
+    for kind in (('json', 'sqlite', 'sharded') if args.backend == 'all' else (args.backend,)):
+        rows, reloaded = run(kind, args.threads, args.budgets, args.writes, args.compact_bytes)
+        for label, rate, lost, _ in rows:
+            print(f'{kind:>8} {label:>11} {rate:10.0f} {len(lost):6d}')
+            ok = ok and not lost
+        print(f'{kind:>8} {"reload":>11} {"":>10} {len(reloaded):6d}')
+        ok = ok and not reloaded
+    if not ok:
+        print("Lost updates detected")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
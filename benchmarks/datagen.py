@@ -0,0 +1,108 @@
+# Synthetic, seeded dataset for the benchmarks: N users, M budgets with
+# owners spread round-robin over the users, K transactions spread over the
+# budgets, and a fixed number of collaborators per budget. Written through
+# the storage API, so any backend can be filled.
+#
+#   python -m benchmarks.datagen --users 1000 --budgets 2000 --transactions 200000 \
+#       --collaborators 3 --backend json --out /tmp/budgets
+#
+# Every user's password is PASSWORD; run the app from --out to use the data.
+import argparse
+import os
+import random
+from datetime import datetime, timedelta
+
+import bcrypt
+
+from storage import JsonStorage, rebuild_aggregates
+
+PASSWORD = 'benchmark-password'
+TRANSACTION_CHUNK = 1000
+DESCRIPTIONS = ('Groceries', 'Rent', 'Salary', 'Coffee', 'Fuel', 'Electricity', 'Dinner out', 'Books',
+                'Train ticket', 'Phone bill')
+
+
+def open_storage(backend, directory):
+    # Fresh storage under directory, using the file names the app expects
+    os.makedirs(directory, exist_ok=True)
+    if backend == 'json':
+        return JsonStorage(*(os.path.join(directory, name)
+                             for name in ('budgets_data.json', 'users_data.json', 'budgets_journal.log')))
+    if backend == 'sqlite':
+        from sqlite_storage import SQLiteStorage
+        return SQLiteStorage(os.path.join(directory, 'budgets.db'))
+    if backend == 'sharded':
+        from sharded_storage import ShardedStorage
+        return ShardedStorage(os.path.join(directory, 'budgets_shards'))
+    raise ValueError(f"Unknown backend: {backend}")
+
+
+def user_record(index, password_hash):
+    return {'email': f'user{index}@example.com', 'username': f'user{index}', 'password_hash': password_hash,
+            'budgets': [], 'shared_budgets': [], 'created_at': '2024-01-01 00:00'}
+
+
+def generate(storage, users, budgets, transactions, collaborators=0, seed=0, rounds=4):
+    # Returns {'users': [user_id], 'budgets': [budget_id]}; the same
+    # arguments always produce the same data
+    rng = random.Random(seed)
+    password_hash = bcrypt.hashpw(PASSWORD.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+    user_ids = [f'user-{i}' for i in range(users)]
+    usernames = {user_id: f'user{i}' for i, user_id in enumerate(user_ids)}
+    budget_ids = [f'budget-{i}' for i in range(budgets)]
+    start = datetime(2024, 1, 1)
+
+    with storage.batch():
+        for index, user_id in enumerate(user_ids):
+            storage.create_user(user_id, user_record(index, password_hash))
+
+        for index, budget_id in enumerate(budget_ids):
+            owner = user_ids[index % users]
+            budget = {'id': budget_id, 'name': f'Budget {index}', 'owner': owner, 'collaborators': [],
+                      'budget': float(rng.randrange(500, 5000)), 'transactions': [],
+                      'created_at': '2024-01-01 00:00'}
+            rebuild_aggregates(budget)
+            storage.create_budget(budget)
+            others = [user_id for user_id in rng.sample(user_ids, min(users, collaborators + 1)) if user_id != owner]
+            for collaborator in others[:collaborators]:
+                storage.add_collaborator(budget_id, collaborator)
+
+        # K transactions dealt out evenly, each budget's in date order
+        for index, budget_id in enumerate(budget_ids):
+            count = transactions // budgets + (1 if index < transactions % budgets else 0)
+            members = [user_ids[index % users]] + storage.get_budget(budget_id)['collaborators']
+            names = [usernames[member] for member in members]
+            minutes = sorted(rng.randrange(365 * 24 * 60) for _ in range(count))
+            rows = [{'date': (start + timedelta(minutes=minute)).strftime("%Y-%m-%d %H:%M"),
+                     'type': 'income' if rng.random() < 0.2 else 'expense',
+                     'amount': round(rng.uniform(1, 250), 2),
+                     'description': rng.choice(DESCRIPTIONS),
+                     'added_by': rng.choice(names)}
+                    for minute in minutes]
+            for chunk_start in range(0, len(rows), TRANSACTION_CHUNK):
+                storage.add_transactions(budget_id, rows[chunk_start:chunk_start + TRANSACTION_CHUNK])
+    return {'users': user_ids, 'budgets': budget_ids}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--budgets', type=int, default=2000)
+    parser.add_argument('--transactions', type=int, default=200000, help="total, across all budgets")
+    parser.add_argument('--collaborators', type=int, default=2, help="collaborators per budget")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', choices=('json', 'sqlite', 'sharded'), default='json')
+    parser.add_argument('--out', required=True, help="directory to write the data into")
+    args = parser.parse_args()
+
+    storage = open_storage(args.backend, args.out)
+    generate(storage, args.users, args.budgets, args.transactions, args.collaborators, args.seed)
+    if args.backend == 'json':
+        storage.save_data()
+    storage.close()
+    print(f"Wrote {args.users} users, {args.budgets} budgets and {args.transactions} transactions "
+          f"to {args.out} ({args.backend})")
+
+
+if __name__ == '__main__':
+    main()
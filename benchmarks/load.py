@@ -0,0 +1,121 @@
+# Load scenario through the Flask test client: logged-in users on worker
+# threads replaying a mix of page views, API reads and writes against a
+# generated dataset. Reports p50/p99 per request type and overall
+# throughput; --json writes a report for benchmarks.compare.
+#
+#   python -m benchmarks.load --backend json --threads 8 --requests 500 --json load.json
+import argparse
+import random
+import tempfile
+import threading
+import time
+
+from benchmarks.datagen import PASSWORD, generate, open_storage
+from benchmarks.report import load_app, print_results, summarize, write_report
+
+# (name, weight); weights are relative
+MIX = (
+    ('GET /', 10),
+    ('GET /api/budgets', 25),
+    ('GET /api/budget/data', 25),
+    ('GET /api/budget/transactions', 15),
+    ('GET /api/budget/analytics', 5),
+    ('POST /api/budget/add_transaction', 20),
+)
+
+
+def request_for(name, budget_id, rng):
+    # (method, path, form data) for one request of the mix
+    if name == 'GET /':
+        return 'GET', '/', None
+    if name == 'GET /api/budgets':
+        return 'GET', '/api/budgets', None
+    if name == 'GET /api/budget/data':
+        return 'GET', f'/api/budget/{budget_id}/data', None
+    if name == 'GET /api/budget/transactions':
+        return 'GET', f'/api/budget/{budget_id}/transactions?limit=20', None
+    if name == 'GET /api/budget/analytics':
+        return 'GET', f'/api/budget/{budget_id}/analytics?granularity=month', None
+    return 'POST', f'/api/budget/{budget_id}/add_transaction', {
+        'amount': str(rng.randint(1, 200)), 'description': 'load test', 'type': rng.choice(('income', 'expense'))}
+
+
+def send(client, name, budget_id, rng):
+    method, path, data = request_for(name, budget_id, rng)
+    return client.open(path, method=method, data=data)
+
+
+def worker(app, index, users, requests, seed, samples, errors, barrier):
+    rng = random.Random(seed * 1000 + index)
+    client = app.test_client()
+    user = rng.randrange(users)
+    response = client.post('/api/login', data={'email': f'user{user}@example.com', 'password': PASSWORD})
+    assert response.get_json()['success'], response.get_json()
+    budget_ids = [budget['id'] for budget in client.get('/api/budgets').get_json()['budgets']]
+    names = [name for name, weight in MIX]
+    weights = [weight for name, weight in MIX]
+
+    mine = {name: [] for name in names}
+    failed = 0
+    barrier.wait()
+    for _ in range(requests):
+        name = rng.choices(names, weights)[0]
+        start = time.perf_counter()
+        response = send(client, name, rng.choice(budget_ids), rng)
+        mine[name].append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            failed += 1
+    for name, values in mine.items():
+        samples[name].extend(values)
+    errors.append(failed)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backend', choices=('json', 'sqlite', 'sharded'), default='json')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--budgets', type=int, default=2000)
+    parser.add_argument('--transactions', type=int, default=200000)
+    parser.add_argument('--collaborators', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=500, help="per thread")
+    parser.add_argument('--rounds', type=int, default=4, help="bcrypt cost for the logins")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="write the report to this file ('-' for stdout)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    storage = open_storage(args.backend, workdir)
+    generate(storage, args.users, args.budgets, args.transactions, args.collaborators, args.seed, args.rounds)
+    storage.close()
+    flask_app = load_app(workdir, args.backend, args.rounds)
+
+    samples = {name: [] for name, weight in MIX}
+    errors = []
+    # Logins happen before the barrier, so they are not part of the timing
+    barrier = threading.Barrier(args.threads + 1)
+    threads = [threading.Thread(target=worker, args=(flask_app.app, i, args.users, args.requests, args.seed,
+                                                     samples, errors, barrier))
+               for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    flask_app.budget_manager.close()
+
+    results = {name: summarize(values, elapsed) for name, values in samples.items()}
+    results['all'] = summarize([value for values in samples.values() for value in values], elapsed)
+    results['all']['errors'] = sum(errors)
+
+    print(f"{args.backend}: {args.threads} threads x {args.requests} requests in {elapsed:.2f}s, "
+          f"{sum(errors)} errors")
+    print_results(results)
+    if args.json:
+        write_report(args.json, 'load', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
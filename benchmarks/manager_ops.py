@@ -0,0 +1,82 @@
+# Micro-benchmarks of single BudgetManager calls against a generated
+# dataset, one call at a time, with per-call p50/p99.
+#
+#   python -m benchmarks.manager_ops --backend json --users 1000 --budgets 2000 \
+#       --transactions 200000 --collaborators 3 --json manager.json
+import argparse
+import random
+import tempfile
+import time
+
+from benchmarks.datagen import PASSWORD, generate, open_storage
+from benchmarks.report import load_app, print_results, summarize, write_report
+
+
+def run(label, calls, iterations):
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        calls(i)
+        samples.append(time.perf_counter() - start)
+    return label, summarize(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backend', choices=('json', 'sqlite', 'sharded'), default='json')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--budgets', type=int, default=2000)
+    parser.add_argument('--transactions', type=int, default=200000)
+    parser.add_argument('--collaborators', type=int, default=2)
+    parser.add_argument('--iterations', type=int, default=1000, help="calls per operation")
+    parser.add_argument('--rounds', type=int, default=4, help="bcrypt cost for register/authenticate")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="write the report to this file ('-' for stdout)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    storage = open_storage(args.backend, workdir)
+    dataset = generate(storage, args.users, args.budgets, args.transactions, args.collaborators, args.seed,
+                       args.rounds)
+    storage.close()
+
+    manager = load_app(workdir, args.backend, args.rounds).budget_manager
+    rng = random.Random(args.seed)
+    budgets = [(budget_id, manager.storage.get_budget(budget_id)['owner']) for budget_id in dataset['budgets']]
+    users = dataset['users']
+
+    def add_transaction(i):
+        budget_id, owner = rng.choice(budgets)
+        manager.add_transaction(budget_id, owner, str(rng.randint(1, 200)), f'bench {i}',
+                                rng.choice(('income', 'expense')))
+
+    def apply_batch(i):
+        # Ten writes to one budget, as a syncing client would send them
+        budget_id, owner = rng.choice(budgets)
+        manager.apply_batch(owner, [{'op': 'add_transaction', 'budget_id': budget_id,
+                                     'amount': str(rng.randint(1, 200)), 'description': f'bench {i}',
+                                     'type': rng.choice(('income', 'expense'))} for _ in range(10)])
+
+    operations = (
+        ('register_user', lambda i: manager.register_user(f'new{i}@example.com', f'new{i}', PASSWORD)),
+        ('authenticate_user',
+         lambda i: manager.authenticate_user(f"user{rng.randrange(args.users)}@example.com", PASSWORD)),
+        ('add_transaction', add_transaction),
+        ('apply_batch x10', apply_batch),
+        ('calculate_balance', lambda i: manager.calculate_balance(rng.choice(budgets)[0])),
+        ('get_user_budgets', lambda i: manager.get_user_budgets(rng.choice(users))),
+        ('get_user_budget_summaries', lambda i: manager.get_user_budget_summaries(rng.choice(users))),
+        ('get_budget_data', lambda i: manager.get_budget_data(*rng.choice(budgets))),
+    )
+    results = dict(run(label, calls, args.iterations) for label, calls in operations)
+    manager.close()
+
+    print(f"{args.backend}: {args.users} users, {args.budgets} budgets, {args.transactions} transactions, "
+          f"{args.collaborators} collaborators per budget")
+    print_results(results)
+    if args.json:
+        write_report(args.json, 'manager_ops', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+# Resolving the owner and collaborators of a budget view on SQLite: one
+# get_user() per person versus one batched get_user_profiles() call, and
+# the ProfileResolver cache in front of it.
+#
+#   python -m benchmarks.profile_lookup --collaborators 50
+import argparse
+import os
+import tempfile
+import time
+
+from profiles import ProfileResolver
+from sqlite_storage import SQLiteStorage
+
+
+def time_per_call(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--collaborators', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=500)
+    args = parser.parse_args()
+
+    storage = SQLiteStorage(os.path.join(tempfile.mkdtemp(), 'budgets.db'))
+    user_ids = [f'user-{i}' for i in range(args.collaborators + 1)]
+    for i, user_id in enumerate(user_ids):
+        storage.create_user(user_id, {'email': f'user{i}@example.com', 'username': f'user{i}', 'password_hash': '',
+                                      'budgets': [], 'shared_budgets': [], 'created_at': '2024-01-01 00:00'})
+    resolver = ProfileResolver(storage, ttl=3600)
+
+    rows = (('get_user each', lambda: [storage.get_user(user_id)['username'] for user_id in user_ids]),
+            ('batched', lambda: storage.get_user_profiles(user_ids)),
+            ('resolver (warm)', lambda: resolver.resolve(user_ids)))
+    print(f"{len(user_ids)} users per view")
+    print(f"{'lookup':>16} {'ms/view':>8}")
+    for label, fn in rows:
+        print(f'{label:>16} {time_per_call(fn, args.repeat) * 1000:8.3f}')
+    storage.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# Shared pieces of the benchmark suite: latency summaries, the JSON report
+# format read by benchmarks.compare, and loading the Flask app over a
+# generated dataset.
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(ordered, q):
+    # Nearest-rank percentile of an already sorted list
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))]
+
+
+def summarize(samples, elapsed=None):
+    # samples are seconds per call; elapsed is the wall time they ran in,
+    # when calls overlapped (otherwise their sum is used)
+    ordered = sorted(samples)
+    total = elapsed if elapsed is not None else sum(ordered)
+    return {
+        'count': len(ordered),
+        'mean_ms': sum(ordered) / len(ordered) * 1000 if ordered else 0.0,
+        'p50_ms': percentile(ordered, 0.5) * 1000,
+        'p99_ms': percentile(ordered, 0.99) * 1000,
+        'max_ms': ordered[-1] * 1000 if ordered else 0.0,
+        'ops_per_sec': len(ordered) / total if total else 0.0
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def print_results(results):
+    print(f"{'':>38} {'count':>7} {'p50 ms':>9} {'p99 ms':>9} {'ops/s':>10}")
+    for name, row in results.items():
+        print(f"{name:>38} {row['count']:7d} {row['p50_ms']:9.3f} {row['p99_ms']:9.3f} {row['ops_per_sec']:10.1f}")
+
+
+def write_report(path, benchmark, params, results):
+    # path '-' writes to stdout
+    report = {'benchmark': benchmark, 'params': params, 'environment': environment(), 'results': results}
+    text = json.dumps(report, indent=2)
+    if path == '-':
+        print(text)
+    else:
+        with open(path, 'w') as f:
+            f.write(text + '\n')
+
+
+def offline_email_is_valid(email):
+    # Syntax only; the app's check also asks DNS, which a benchmark must not
+    from email_validator import validate_email, EmailNotValidError
+    try:
+        validate_email(email, check_deliverability=False)
+    except EmailNotValidError:
+        return False
+    return True
+
+
+def load_app(directory, backend, rounds):
+    # flask_app builds its BudgetManager on import from the current
+    # directory and the environment, so point both at the dataset first
+    os.chdir(directory)
+    os.environ['BUDGET_STORAGE'] = backend
+    os.environ['BCRYPT_ROUNDS'] = str(rounds)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    budgets = importlib.import_module('budgets')
+    budgets.email_is_valid = offline_email_is_valid
+    return importlib.import_module('flask_app')
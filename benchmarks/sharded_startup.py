@@ -0,0 +1,80 @@
+# Startup time and memory to serve one user's dashboard: the two-file JSON
+# layout versus the sharded one-file-per-budget layout.
+#
+#   python -m benchmarks.sharded_startup --users 2000 --transactions 200
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from sharded_storage import ShardedStorage
+from storage import JsonStorage, upgrade_budget
+
+
+def make_dataset(users, transactions):
+    user_records, budget_records = {}, {}
+    for u in range(users):
+        user_id, budget_id = f'user-{u}', f'budget-{u}'
+        user_records[user_id] = {'email': f'user{u}@example.com', 'username': f'user{u}', 'password_hash': '',
+                                 'budgets': [budget_id], 'shared_budgets': [], 'created_at': '2024-01-01 00:00'}
+        budget = {'id': budget_id, 'name': f'Budget {u}', 'owner': user_id, 'collaborators': [], 'budget': 1000.0,
+                  'created_at': '2024-01-01 00:00',
+                  'transactions': [{'date': f'2024-{t % 12 + 1:02d}-{t % 28 + 1:02d} 12:00',
+                                    'type': 'income' if t % 5 == 0 else 'expense', 'amount': float(t % 90 + 1),
+                                    'description': f'transaction {t}', 'added_by': f'user{u}'}
+                                   for t in range(transactions)]}
+        budget['transactions'].sort(key=lambda t: t['date'])
+        upgrade_budget(budget)
+        budget_records[budget_id] = budget
+    return user_records, budget_records
+
+
+def measure(open_storage, user_id):
+    # Seconds and peak traced MB to open the store and read one dashboard
+    tracemalloc.start()
+    start = time.perf_counter()
+    storage = open_storage()
+    for budget, role in storage.user_budgets(user_id):
+        storage.recent_transactions(budget['id'], 20)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    storage.close()
+    return elapsed, peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--transactions', type=int, default=200, help="transactions per budget")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    data_file, users_file, journal_file = (os.path.join(workdir, name)
+                                           for name in ('budgets.json', 'users.json', 'journal.log'))
+    users, budgets = make_dataset(args.users, args.transactions)
+    with open(data_file, 'w') as f:
+        f.write(json.dumps(budgets, separators=(',', ':')))
+    with open(users_file, 'w') as f:
+        f.write(json.dumps(users, separators=(',', ':')))
+
+    source = JsonStorage(data_file, users_file, journal_file)
+    ShardedStorage(os.path.join(workdir, 'shards')).import_json(source)
+    source.close()
+    del users, budgets, source
+
+    user_id = f'user-{args.users // 2}'
+    print(f"{args.users} budgets x {args.transactions} transactions, "
+          f"{os.path.getsize(data_file) / 1024 / 1024:.1f} MB of budget JSON")
+    print(f"{'layout':>8} {'open + dashboard (s)':>21} {'peak MB':>8}")
+    for label, open_storage in (
+            ('json', lambda: JsonStorage(data_file, users_file, journal_file)),
+            ('sharded', lambda: ShardedStorage(os.path.join(workdir, 'shards')))):
+        elapsed, peak = measure(open_storage, user_id)
+        print(f'{label:>8} {elapsed:21.3f} {peak:8.1f}')
+
+
+if __name__ == '__main__':
+    main()
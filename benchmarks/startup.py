@@ -0,0 +1,93 @@
+# Process startup with the JSON backend: eager (BUDGET_LAZY_LOAD=0, every
+# record parsed) versus lazy (snapshots memory-mapped, records parsed on
+# first use). Each run is a fresh interpreter that imports flask_app and
+# then serves one budget page, so import time is part of the figure.
+# Linux only (RSS comes from /proc).
+#
+#   python -m benchmarks.startup --sizes 10000 100000 1000000
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from storage import JsonStorage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs inside the child; prints one JSON line of timings
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, %r)
+import flask_app
+imported = time.perf_counter()
+client = flask_app.app.test_client()
+with client.session_transaction() as session:
+    session['user_id'] = %r
+response = client.get('/api/budget/%s/data')
+assert response.status_code == 200, response.status_code
+served = time.perf_counter()
+# Current RSS rather than ru_maxrss, which counts the parent's pages from before exec
+with open('/proc/self/status') as f:
+    rss = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+print(json.dumps({'import': imported - start, 'first_request': served - imported, 'rss_mb': rss / 1024}))
+'''
+
+
+def write_dataset(workdir, transactions, per_budget):
+    budgets, users = {}, {}
+    for b in range(max(1, transactions // per_budget)):
+        user_id, budget_id = f'user-{b}', f'budget-{b}'
+        users[user_id] = {'email': f'user{b}@example.com', 'username': f'user{b}', 'password_hash': '',
+                          'budgets': [budget_id], 'shared_budgets': [], 'created_at': '2024-01-01 00:00'}
+        budgets[budget_id] = {
+            'id': budget_id, 'name': f'Budget {b}', 'owner': user_id, 'collaborators': [], 'budget': 1000.0,
+            'created_at': '2024-01-01 00:00',
+            'transactions': [{'date': f'2024-{t * 12 // per_budget + 1:02d}-{t % 28 + 1:02d} {t % 24:02d}:00',
+                              'type': 'income' if t % 5 == 0 else 'expense', 'amount': float(t % 90 + 1),
+                              'description': f'transaction {t}', 'added_by': f'user{b}'}
+                             for t in range(min(per_budget, transactions))]}
+    with open(os.path.join(workdir, 'budgets_data.json'), 'w') as f:
+        f.write(json.dumps(budgets, separators=(',', ':')))
+    with open(os.path.join(workdir, 'users_data.json'), 'w') as f:
+        f.write(json.dumps(users, separators=(',', ':')))
+    # One lazy open writes the snapshots back out with their .idx files
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        JsonStorage(lazy=True).close()
+    finally:
+        os.chdir(cwd)
+    return len(budgets) // 2
+
+
+def run_child(workdir, budget, lazy):
+    env = dict(os.environ, BUDGET_STORAGE='json', BUDGET_LAZY_LOAD='1' if lazy else '0')
+    output = subprocess.run([sys.executable, '-c', CHILD % (ROOT, f'user-{budget}', f'budget-{budget}')],
+                            cwd=workdir, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help="total transactions")
+    parser.add_argument('--per-budget', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=3, help="runs per mode; the fastest is reported")
+    args = parser.parse_args()
+
+    print(f"{'transactions':>12} {'mode':>6} {'import (s)':>11} {'first request (s)':>18} {'RSS MB':>7}")
+    for size in args.sizes:
+        workdir = tempfile.mkdtemp()
+        budget = write_dataset(workdir, size, args.per_budget)
+        for label, lazy in (('eager', False), ('lazy', True)):
+            runs = [run_child(workdir, budget, lazy) for _ in range(args.repeat)]
+            best = min(runs, key=lambda run: run['import'] + run['first_request'])
+            print(f"{size:12d} {label:>6} {best['import']:11.3f} {best['first_request']:18.3f} "
+                  f"{best['rss_mb']:7.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# Resident bytes per transaction as loaded from a snapshot: a list of dicts
+# versus the columnar TransactionStore, plus the cost of a full scan of the
+# amounts in each.
+#
+#   python -m benchmarks.transaction_memory --transactions 1000000
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+
+from transactions import TransactionStore
+
+
+def make_json(count):
+    users = ['alice', 'bob', 'carol', 'dave']
+    return json.dumps([{'date': f'2024-{i % 12 + 1:02d}-{i % 28 + 1:02d} {i % 24:02d}:{i % 60:02d}',
+                        'type': 'income' if i % 5 == 0 else 'expense', 'amount': float(i % 900 + 1) / 4,
+                        'description': f'Groceries {i}', 'added_by': users[i % len(users)]}
+                       for i in range(count)])
+
+
+def retained(build):
+    # (object, bytes still allocated once build() has returned it)
+    gc.collect()
+    tracemalloc.start()
+    value = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return value, size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--transactions', type=int, default=1000000)
+    args = parser.parse_args()
+    text = make_json(args.transactions)
+
+    dicts, dict_bytes = retained(lambda: json.loads(text))
+    store, store_bytes = retained(lambda: TransactionStore(json.loads(text)))
+
+    start = time.perf_counter()
+    dict_total = sum(t['amount'] for t in dicts if t['type'] == 'income')
+    dict_scan = time.perf_counter() - start
+    start = time.perf_counter()
+    income = store.type_table.codes['income']
+    store_total = sum(amount for amount, code in zip(store.amounts, store.types) if code == income)
+    store_scan = time.perf_counter() - start
+    assert abs(dict_total - store_total) < 1e-6
+
+    print(f"{args.transactions} transactions")
+    print(f"{'layout':>18} {'bytes/txn':>10} {'income scan (ms)':>17}")
+    print(f"{'list of dicts':>18} {dict_bytes / args.transactions:10.0f} {dict_scan * 1000:17.1f}")
+    print(f"{'TransactionStore':>18} {store_bytes / args.transactions:10.0f} {store_scan * 1000:17.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# Login/signup email lookup cost as the user table grows.
+#
+#   python -m benchmarks.user_lookup --sizes 1000 10000 100000 1000000
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from storage import JsonStorage
+
+
+def make_users(count):
+    return {
+        f'user-{i}': {
+            'email': f'user{i}@example.com',
+            'username': f'user{i}',
+            'password_hash': '',
+            'budgets': [],
+            'shared_budgets': [],
+            'created_at': '2025-01-01 00:00'
+        }
+        for i in range(count)
+    }
+
+
+def linear_lookup(users, email):
+    # What register/authenticate/invite did before the indexes
+    for user_id, user_data in users.items():
+        if user_data.get('email', '').lower() == email.lower():
+            return user_id
+    return None
+
+
+def time_per_call(func, emails):
+    start = time.perf_counter()
+    for email in emails:
+        func(email)
+    return (time.perf_counter() - start) / len(emails)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--linear-max', type=int, default=100000,
+                        help="skip the linear-scan baseline above this many users")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    print(f"{'users':>10} {'indexed (us)':>14} {'linear (us)':>14}")
+    for size in args.sizes:
+        storage = JsonStorage(*(os.path.join(workdir, f'{size}-{name}') for name in
+                                ('budgets.json', 'users.json', 'journal.log')))
+        storage.users.update(make_users(size))
+        storage.build_indexes()
+        emails = [f'USER{random.randrange(size)}@example.com' for _ in range(args.lookups)]
+
+        indexed = time_per_call(storage.find_user_by_email, emails)
+        linear = ''
+        if size <= args.linear_max:
+            sample = emails[:max(1, args.lookups * 1000 // size)]
+            linear = f'{time_per_call(lambda e: linear_lookup(storage.users, e), sample) * 1e6:14.2f}'
+        print(f'{size:>10} {indexed * 1e6:14.2f} {linear:>14}')
+        storage.close()
+
+
+if __name__ == '__main__':
+    main()
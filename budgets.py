@@ -0,0 +1,786 @@
+import base64
+import codecs
+import csv
+import functools
+import hashlib
+import io
+import json
+import math
+import tempfile
+import uuid
+import zlib
+from datetime import date, datetime
+
+from cache import LRUCache
+from events import make_event_hub
+from hashing import HasherBusy, PasswordHasher
+from locks import LockTable
+from metrics import REGISTRY
+from profiles import ProfileResolver
+from storage import ROLLUP_GRANULARITIES, UserExists, make_storage, rebuild_aggregates, rollup_buckets
+
+IMPORT_CHUNK_ROWS = 1000
+# Uploads are copied aside while their encoding is checked: in memory up to
+# this size, then in a temporary file
+IMPORT_SPOOL_BYTES = 8 * 1024 * 1024
+# Transactions per /api/sync response; clients call again while 'more' is set
+SYNC_BATCH_TRANSACTIONS = 1000
+# Largest sync token, once decompressed, that /api/sync will read
+MAX_SYNC_TOKEN_BYTES = 1024 * 1024
+# What /api/batch accepts, and how many per request
+BATCH_OPERATIONS = ('create_budget', 'set_budget', 'add_transaction', 'invite')
+# Operation fields that must be strings when present
+BATCH_TEXT_FIELDS = ('name', 'email', 'description', 'type', 'date', 'op_id')
+MAX_BATCH_OPERATIONS = 500
+# Client op ids remembered per process, so a re-sent batch isn't applied twice
+APPLIED_OP_IDS = 100000
+MAX_IMPORT_ERRORS = 100
+IMPORT_DATE_FORMATS = ("%Y/%m/%d", "%Y/%m/%d %H:%M", "%Y/%m/%d %H:%M:%S")
+
+class InvalidUpload(ValueError):
+    pass
+
+def spool_upload(stream):
+    # Copies the upload aside, checking it is UTF-8 on the way, so a bad byte
+    # anywhere is refused before any row is written. Returns the copy,
+    # rewound.
+    spool = io.BytesIO()
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for block in iter(lambda: stream.read(64 * 1024), b''):
+            decoder.decode(block)
+            if isinstance(spool, io.BytesIO) and spool.tell() + len(block) > IMPORT_SPOOL_BYTES:
+                on_disk = tempfile.TemporaryFile()
+                on_disk.write(spool.getbuffer())
+                spool = on_disk
+            spool.write(block)
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        spool.close()
+        raise InvalidUpload("The file must be UTF-8 text!")
+    spool.seek(0)
+    return spool
+
+def parse_transaction_date(value):
+    # Normalize to the "YYYY-MM-DD HH:MM" strings add_transaction stores.
+    # ISO dates take the fast path; slash-separated ones fall back to strptime.
+    value = str(value).strip()
+    try:
+        return datetime.fromisoformat(value).strftime("%Y-%m-%d %H:%M")
+    except ValueError:
+        pass
+    for date_format in IMPORT_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).strftime("%Y-%m-%d %H:%M")
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognized date: {value}")
+
+def iter_import_rows(text, file_format):
+    # Yields (row_number, row, error) one line at a time with lowercased keys
+    if file_format == 'csv':
+        reader = csv.DictReader(text)
+        for row_number, row in enumerate(reader, start=1):
+            yield row_number, {str(k).strip().lower(): v for k, v in row.items() if k is not None}, None
+        return
+    for row_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield row_number, None, "Invalid JSON!"
+            continue
+        if not isinstance(row, dict):
+            yield row_number, None, "Each line must be a JSON object!"
+            continue
+        yield row_number, {str(k).lower(): v for k, v in row.items()}, None
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    date, seq = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    if not isinstance(date, str) or not isinstance(seq, int):
+        raise ValueError("Invalid cursor")
+    return date, seq
+
+def encode_sync_token(versions):
+    # {budget_id: [version, transaction count]} the client has seen, packed
+    # small enough for a query string
+    packed = zlib.compress(json.dumps(versions, separators=(',', ':')).encode('utf-8'))
+    return base64.urlsafe_b64encode(packed).decode('ascii')
+
+def is_count(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+def decode_sync_token(token):
+    # Tokens come from the client, so the decompressed size is capped and
+    # every entry must be [version or null, count] with non-negative ints
+    try:
+        inflater = zlib.decompressobj()
+        data = inflater.decompress(base64.urlsafe_b64decode(token.encode('ascii')), MAX_SYNC_TOKEN_BYTES)
+        if inflater.unconsumed_tail or not inflater.eof:
+            raise ValueError("Sync token too large")
+        versions = json.loads(data)
+    except (ValueError, zlib.error):
+        raise ValueError("Invalid sync token")
+    if not isinstance(versions, dict) or not all(
+            isinstance(seen, list) and len(seen) == 2 and (seen[0] is None or is_count(seen[0])) and is_count(seen[1])
+            for seen in versions.values()):
+        raise ValueError("Invalid sync token")
+    return versions
+
+def parse_last_modified(values):
+    # Latest of the stored "%Y-%m-%d %H:%M" stamps, for the Last-Modified header
+    stamps = [value for value in values if value]
+    if not stamps:
+        return None
+    try:
+        return datetime.strptime(max(stamps)[:16], "%Y-%m-%d %H:%M")
+    except ValueError:
+        return None
+
+def email_is_valid(email):
+    # email_validator (and dnspython under it) is slow to import, so it is
+    # loaded by the first registration rather than at startup
+    from email_validator import validate_email, EmailNotValidError
+    try:
+        validate_email(email)
+    except EmailNotValidError:
+        return False
+    return True
+
+def timed_operation(method):
+    # Records each call of a BudgetManager method in budget_operation_seconds
+    histogram = REGISTRY.histogram('budget_operation_seconds', "BudgetManager call latency",
+                                   operation=method.__name__)
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        with histogram.timer():
+            return method(*args, **kwargs)
+    return wrapper
+
+class BudgetManager:
+    def __init__(self, storage=None, hasher=None, events=None):
+        self.storage = storage if storage is not None else make_storage()
+        self.hasher = hasher if hasher is not None else PasswordHasher()
+        self.events = events if events is not None else make_event_hub()
+        # Held around check-then-write sequences (e.g. "is this email free?"
+        # followed by the insert); storage does its own locking per write
+        self.locks = LockTable()
+        # Usernames/emails for display, batched and cached
+        self.profiles = ProfileResolver(self.storage)
+        # (user_id, op_id) -> result of batch operations already applied
+        self.applied_ops = LRUCache(APPLIED_OP_IDS)
+
+    def close(self):
+        self.events.close()
+        self.hasher.close()
+        self.storage.close()
+
+    def publish(self, budget_id, event_type, **fields):
+        # Tell live subscribers of the budget what changed, stamped with the
+        # version it produced
+        budget = self.storage.get_budget(budget_id)
+        event = {'type': event_type, 'version': budget['version'], 'budget': budget['budget'],
+                 'balance': budget['balance']}
+        event.update(fields)
+        self.events.publish(budget_id, event)
+
+    @timed_operation
+    def register_user(self, email, username, password):
+        # Validate email
+        if not email_is_valid(email):
+            return {"success": False, "message": "Invalid email address!"}
+
+        # Only registrations for the same email or username wait on each other
+        with self.locks.hold(('email', email.lower()), ('username', username.lower())):
+            # Check if email already exists
+            if self.storage.find_user_by_email(email)[0]:
+                return {"success": False, "message": "Email already registered!"}
+            if self.storage.find_user_by_username(username)[0]:
+                return {"success": False, "message": "Username already taken!"}
+
+            # Hash password
+            password_hash = self.hasher.hash_password(password)
+
+            user_id = str(uuid.uuid4())
+            try:
+                self.storage.create_user(user_id, {
+                    'email': email.lower(),
+                    'username': username,
+                    'password_hash': password_hash,
+                    'budgets': [],
+                    'shared_budgets': [],
+                    'created_at': datetime.now().strftime("%Y-%m-%d %H:%M")
+                })
+            except UserExists as taken:
+                if taken.args[0] == 'email':
+                    return {"success": False, "message": "Email already registered!"}
+                return {"success": False, "message": "Username already taken!"}
+        return {"success": True, "message": "Account created successfully!", "user_id": user_id}
+
+    @timed_operation
+    def authenticate_user(self, email, password):
+        user_id, user_data = self.storage.find_user_by_email(email)
+        if not user_id:
+            return {"success": False, "message": "Email not found!"}
+        if not self.hasher.check_password(password, user_data['password_hash']):
+            return {"success": False, "message": "Invalid password!"}
+
+        # Bring the stored hash up to the configured work factor
+        if self.hasher.needs_rehash(user_data['password_hash']):
+            try:
+                self.storage.set_password_hash(user_id, self.hasher.hash_password(password))
+            except HasherBusy:
+                pass
+        return {"success": True, "user_id": user_id, "username": user_data['username']}
+
+    def get_user_by_id(self, user_id):
+        return self.storage.get_user(user_id)
+
+    @timed_operation
+    def create_budget(self, user_id, budget_name, initial_amount=0.0):
+        budget = self.new_budget(user_id, budget_name, initial_amount)
+        self.storage.create_budget(budget)
+        return budget['id']
+
+    def new_budget(self, user_id, budget_name, initial_amount):
+        budget = {
+            'id': str(uuid.uuid4()),
+            'name': budget_name,
+            'owner': user_id,
+            'collaborators': [],
+            'budget': float(initial_amount),
+            'transactions': [],
+            'created_at': datetime.now().strftime("%Y-%m-%d %H:%M")
+        }
+        rebuild_aggregates(budget)
+        return budget
+
+    @timed_operation
+    def get_user_budgets(self, user_id):
+        user_budgets = []
+        for budget, role in self.storage.user_budgets(user_id):
+            budget = budget.copy()
+            budget['role'] = role
+            user_budgets.append(budget)
+
+        # Owner and collaborator names for every budget in one lookup
+        profiles = self.profiles.resolve({uid for budget in user_budgets
+                                          for uid in [budget['owner']] + budget['collaborators']})
+        for budget in user_budgets:
+            budget['owner_name'] = profiles.get(budget['owner'], {}).get('username', 'Unknown')
+            budget['collaborator_names'] = [profiles.get(cid, {}).get('username', 'Unknown')
+                                            for cid in budget['collaborators']]
+        return user_budgets
+
+    @timed_operation
+    def get_user_budget_summaries(self, user_id):
+        # What the dashboard and /api/budgets show: storage.budget_summaries
+        # plus display names, without touching any transactions
+        summaries = self.storage.budget_summaries(user_id)
+        profiles = self.profiles.resolve({uid for summary in summaries
+                                          for uid in [summary['owner']] + summary['collaborators']})
+        for summary in summaries:
+            summary['owner_name'] = profiles.get(summary['owner'], {}).get('username', 'Unknown')
+            summary['collaborator_names'] = [profiles.get(cid, {}).get('username', 'Unknown')
+                                             for cid in summary['collaborators']]
+        return summaries
+
+    def get_budget(self, budget_id, user_id):
+        budget = self.storage.get_budget(budget_id)
+        if not budget:
+            return None
+        
+        # Check if user has access to this budget
+        if budget['owner'] == user_id or user_id in budget['collaborators']:
+            return budget
+        return None
+
+    @timed_operation
+    def set_budget(self, budget_id, user_id, amount):
+        budget = self.get_budget(budget_id, user_id)
+        if not budget:
+            return {"success": False, "message": "Budget not found or access denied!"}
+        
+        try:
+            budget_amount = float(amount)
+            if budget_amount < 0:
+                return {"success": False, "message": "Budget cannot be negative!"}
+
+            self.storage.set_budget_amount(budget_id, budget_amount)
+            self.publish(budget_id, 'budget-set')
+            return {"success": True, "message": f"Budget set to ${budget_amount:.2f}"}
+        except ValueError:
+            return {"success": False, "message": "Please enter a valid number!"}
+
+    @timed_operation
+    def add_transaction(self, budget_id, user_id, amount, description, transaction_type, date=None):
+        budget = self.get_budget(budget_id, user_id)
+        if not budget:
+            return {"success": False, "message": "Budget not found or access denied!"}
+        
+        # date is optional; clients replaying offline writes send the original one
+        username = self.profiles.username(user_id)
+        transaction, error = self.build_transaction(amount, description, transaction_type, username, date)
+        if error:
+            return {"success": False, "message": error}
+
+        self.storage.add_transaction(budget_id, transaction)
+        self.publish(budget_id, 'transaction-added', transaction=transaction)
+        return {"success": True, "message": "Transaction added successfully!"}
+
+    def build_transaction(self, amount, description, transaction_type, added_by, date=None):
+        # Validation shared by add_transaction, batches and bulk imports.
+        # Returns (transaction, None) or (None, error message).
+        if description is not None and not isinstance(description, str):
+            return None, "Description must be text!"
+        if date is not None and not isinstance(date, str):
+            return None, "Please enter a valid date!"
+
+        try:
+            if isinstance(amount, bool):
+                raise TypeError(amount)
+            amount = float(amount)
+        except (TypeError, ValueError):
+            return None, "Please enter a valid amount!"
+        if not math.isfinite(amount):
+            return None, "Please enter a valid amount!"
+
+        if amount <= 0:
+            return None, "Amount must be positive!"
+
+        if isinstance(transaction_type, str):
+            transaction_type = transaction_type.strip().lower()
+        if transaction_type not in ('income', 'expense'):
+            return None, "Transaction type must be income or expense!"
+
+        description = (description or '').strip()
+        if not description:
+            description = "No description"
+
+        if date:
+            try:
+                date = parse_transaction_date(date)
+            except ValueError:
+                return None, "Please enter a valid date!"
+
+        return {
+            'date': date or datetime.now().strftime("%Y-%m-%d %H:%M"),
+            'type': transaction_type,
+            'amount': amount,
+            'description': description,
+            'added_by': added_by
+        }, None
+
+    @timed_operation
+    def import_transactions(self, budget_id, user_id, stream, file_format):
+        # Streams CSV or NDJSON rows from a binary file object. Valid rows are
+        # written in chunks inside one storage batch, so the whole import is
+        # persisted once; invalid rows are reported and skipped. Raises
+        # InvalidUpload, having written nothing, if the file isn't UTF-8.
+        budget = self.get_budget(budget_id, user_id)
+        if not budget:
+            return {"success": False, "message": "Budget not found or access denied!"}
+        if file_format not in ('csv', 'ndjson'):
+            return {"success": False, "message": "Format must be csv or ndjson!"}
+
+        username = self.profiles.username(user_id)
+        upload = spool_upload(stream)
+        imported = failed = 0
+        errors = []
+        chunk = []
+        with io.TextIOWrapper(upload, encoding='utf-8-sig', newline='') as text, self.storage.batch():
+            for row_number, row, error in iter_import_rows(text, file_format):
+                if not error:
+                    transaction, error = self.build_transaction(
+                        row.get('amount'), row.get('description'), row.get('type'), username, row.get('date'))
+                if error:
+                    failed += 1
+                    if len(errors) < MAX_IMPORT_ERRORS:
+                        errors.append({'row': row_number, 'message': error})
+                    continue
+                chunk.append(transaction)
+                if len(chunk) >= IMPORT_CHUNK_ROWS:
+                    self.storage.add_transactions(budget_id, chunk)
+                    imported += len(chunk)
+                    chunk = []
+            if chunk:
+                self.storage.add_transactions(budget_id, chunk)
+                imported += len(chunk)
+        if imported:
+            # Too many rows to push one by one; subscribers reload instead
+            self.publish(budget_id, 'transactions-imported', count=imported)
+
+        return {
+            "success": True,
+            "message": f"Imported {imported} transactions, {failed} rows failed.",
+            "imported": imported,
+            "failed": failed,
+            "errors": errors
+        }
+
+    @timed_operation
+    def calculate_balance(self, budget_id):
+        budget = self.storage.get_budget(budget_id)
+        if not budget:
+            return 0
+        return budget['balance']
+
+    @timed_operation
+    def invite_collaborator(self, budget_id, owner_id, collaborator_email):
+        # The "already a collaborator?" check and the add must not interleave
+        with self.locks.hold(('budget', budget_id)):
+            budget = self.storage.get_budget(budget_id)
+            if not budget:
+                return {"success": False, "message": "Budget not found!"}
+            
+            if budget['owner'] != owner_id:
+                return {"success": False, "message": "Only the budget owner can invite collaborators!"}
+            
+            # Find user by email
+            collaborator_id, collaborator = self.storage.find_user_by_email(collaborator_email)
+            
+            if not collaborator_id:
+                return {"success": False, "message": f"User with email '{collaborator_email}' not found!"}
+            
+            if collaborator_id == owner_id:
+                return {"success": False, "message": "You cannot invite yourself!"}
+            
+            if collaborator_id in budget['collaborators']:
+                return {"success": False, "message": f"User '{collaborator_email}' is already a collaborator!"}
+            
+            # Add collaborator
+            self.storage.add_collaborator(budget_id, collaborator_id)
+        self.publish(budget_id, 'collaborator-joined', username=collaborator['username'])
+        
+        return {"success": True, "message": f"Successfully invited '{collaborator['username']}' to collaborate!"}
+
+    @timed_operation
+    def apply_batch(self, user_id, operations, atomic=False):
+        # An ordered list of writes ({'op': 'create_budget' | 'set_budget' |
+        # 'add_transaction' | 'invite', ...the route's form fields}) applied
+        # under one persist. Everything is validated first, checking access
+        # once per budget; a budget_id of "$<n>" names the budget created by
+        # operation n of the same batch. With atomic, one invalid operation
+        # means nothing is written. An operation may carry an 'op_id' chosen
+        # by the client: one already applied is answered with its earlier
+        # result instead of being applied again, so a batch can be re-sent
+        # after a lost response.
+        budget_keys = [('budget', op['budget_id']) for op in operations
+                       if isinstance(op.get('budget_id'), str) and not op['budget_id'].startswith('$')]
+        # Held from validation to write, like invite_collaborator's check-then-add
+        with self.locks.hold(('batch', user_id), *budget_keys):
+            plans, results = self._plan_batch(user_id, operations)
+            failed = sum(1 for result in results if not result['success'])
+            if atomic and failed:
+                for result in results:
+                    if result['success'] and not result.get('replayed'):
+                        result.update(success=False, message="Not applied: another operation failed!")
+                        result.pop('budget_id', None)
+                return {"success": False, "message": f"Nothing applied, {failed} operations failed.",
+                        "applied": 0, "failed": failed, "results": results}
+            events = self._apply_batch(plans)
+            for operation, result in zip(operations, results):
+                if operation.get('op_id') and result['success'] and not result.get('replayed'):
+                    self.applied_ops.put((user_id, operation['op_id']), dict(result))
+
+        for budget_id, event_type, fields in events:
+            self.publish(budget_id, event_type, **fields)
+        applied = len(operations) - failed
+        return {"success": not failed, "message": f"Applied {applied} operations, {failed} failed.",
+                "applied": applied, "failed": failed, "results": results}
+
+    def _plan_batch(self, user_id, operations):
+        # Returns ([(op, budget_id, value)], [result per operation]); only
+        # valid operations get a plan
+        plans = []
+        results = []
+        budgets = {}
+        created = {}
+        invited = set()
+        op_ids = {}
+        username = self.profiles.username(user_id)
+        for index, operation in enumerate(operations):
+            op = operation.get('op')
+            result = {"success": False}
+            results.append(result)
+            if op not in BATCH_OPERATIONS:
+                result['message'] = f"Unknown operation '{op}'!"
+                continue
+            field = next((field for field in BATCH_TEXT_FIELDS
+                          if operation.get(field) is not None and not isinstance(operation[field], str)), None)
+            if field:
+                result['message'] = f"Field '{field}' must be a string!"
+                continue
+            op_id = operation.get('op_id')
+            if op_id:
+                if op_id in op_ids:
+                    # Repeated within this batch: the same outcome as the first
+                    earlier, earlier_result = op_ids[op_id]
+                    result.update(earlier_result)
+                    if f'${earlier}' in created:
+                        created[f'${index}'] = created[f'${earlier}']
+                    continue
+                op_ids[op_id] = (index, result)
+                replay = self.applied_ops.get((user_id, op_id))
+                if replay is not None:
+                    result.update(replay, replayed=True)
+                    budget = self.get_budget(replay['budget_id'], user_id) if 'budget_id' in replay else None
+                    if budget:
+                        created[f'${index}'] = budgets[budget['id']] = budget
+                    continue
+
+            if op == 'create_budget':
+                if not operation.get('name'):
+                    result['message'] = "Budget name is required!"
+                    continue
+                try:
+                    budget = self.new_budget(user_id, operation['name'], float(operation.get('initial_amount', 0)))
+                except (TypeError, ValueError):
+                    result['message'] = "Invalid initial amount!"
+                    continue
+                created[f'${index}'] = budgets[budget['id']] = budget
+                plans.append((op, budget['id'], budget))
+                result.update(success=True, message="Budget created successfully!", budget_id=budget['id'])
+                continue
+
+            budget_id = operation.get('budget_id')
+            if isinstance(budget_id, str) and budget_id.startswith('$'):
+                if budget_id not in created:
+                    result['message'] = f"No budget was created by operation {budget_id[1:]}!"
+                    continue
+                budget = created[budget_id]
+            elif isinstance(budget_id, str):
+                if budget_id not in budgets:
+                    budgets[budget_id] = self.get_budget(budget_id, user_id)
+                budget = budgets[budget_id]
+            else:
+                budget = None
+            if not budget:
+                result['message'] = "Budget not found or access denied!"
+                continue
+
+            if op == 'set_budget':
+                try:
+                    amount = float(operation.get('amount'))
+                except (TypeError, ValueError):
+                    result['message'] = "Please enter a valid number!"
+                    continue
+                if amount < 0:
+                    result['message'] = "Budget cannot be negative!"
+                    continue
+                plans.append((op, budget['id'], amount))
+                result.update(success=True, message=f"Budget set to ${amount:.2f}")
+            elif op == 'add_transaction':
+                transaction, error = self.build_transaction(
+                    operation.get('amount'), operation.get('description'), operation.get('type'), username,
+                    operation.get('date'))
+                if error:
+                    result['message'] = error
+                    continue
+                plans.append((op, budget['id'], transaction))
+                result.update(success=True, message="Transaction added successfully!")
+            else:
+                if budget['owner'] != user_id:
+                    result['message'] = "Only the budget owner can invite collaborators!"
+                    continue
+                email = operation.get('email') or ''
+                collaborator_id, collaborator = self.storage.find_user_by_email(email)
+                if not collaborator_id:
+                    result['message'] = f"User with email '{email}' not found!"
+                    continue
+                if collaborator_id == user_id:
+                    result['message'] = "You cannot invite yourself!"
+                    continue
+                if collaborator_id in budget['collaborators'] or (budget['id'], collaborator_id) in invited:
+                    result['message'] = f"User '{email}' is already a collaborator!"
+                    continue
+                invited.add((budget['id'], collaborator_id))
+                plans.append((op, budget['id'], (collaborator_id, collaborator['username'])))
+                result.update(success=True,
+                              message=f"Successfully invited '{collaborator['username']}' to collaborate!")
+        return plans, results
+
+    def _apply_batch(self, plans):
+        # Writes the plans in order inside one storage batch; consecutive
+        # transactions for the same budget go in as one append. Returns the
+        # events to publish once everything is written.
+        events = []
+        created = set()
+        run_budget, run = None, []
+
+        def flush_run():
+            if run:
+                self.storage.add_transactions(run_budget, run)
+                if run_budget not in created:
+                    if len(run) == 1:
+                        events.append((run_budget, 'transaction-added', {'transaction': run[0]}))
+                    else:
+                        events.append((run_budget, 'transactions-imported', {'count': len(run)}))
+
+        with self.storage.batch():
+            for op, budget_id, value in plans:
+                if op == 'add_transaction' and budget_id == run_budget:
+                    run.append(value)
+                    continue
+                flush_run()
+                run_budget, run = None, []
+                if op == 'add_transaction':
+                    run_budget, run = budget_id, [value]
+                elif op == 'create_budget':
+                    self.storage.create_budget(value)
+                    created.add(budget_id)
+                elif op == 'set_budget':
+                    self.storage.set_budget_amount(budget_id, value)
+                    if budget_id not in created:
+                        events.append((budget_id, 'budget-set', {}))
+                else:
+                    self.storage.add_collaborator(budget_id, value[0])
+                    if budget_id not in created:
+                        events.append((budget_id, 'collaborator-joined', {'username': value[1]}))
+            flush_run()
+        return events
+
+    @timed_operation
+    def get_budget_data(self, budget_id, user_id):
+        budget = self.get_budget(budget_id, user_id)
+        if not budget:
+            return None
+        
+        profiles = self.profiles.resolve([budget['owner']] + budget['collaborators'])
+        return {
+            'id': budget_id,
+            'name': budget['name'],
+            'budget': budget['budget'],
+            'balance': budget['balance'],
+            'transactions': self.storage.recent_transactions(budget_id, 20),
+            'owner': profiles.get(budget['owner'], {}).get('username', 'Unknown'),
+            'collaborators': [profiles.get(cid, {}).get('username', 'Unknown')
+                              for cid in budget['collaborators']],
+            'is_owner': budget['owner'] == user_id
+        }
+
+    @timed_operation
+    def budget_data_etag(self, budget_id, user_id):
+        # (etag, last_modified) for get_budget_data; owners and collaborators
+        # see different payloads so the role is part of the tag
+        budget = self.get_budget(budget_id, user_id)
+        if not budget:
+            return None
+        role = 'owner' if budget['owner'] == user_id else 'collaborator'
+        return f"budget-{budget_id}-{budget['version']}-{role}", parse_last_modified([budget['last_modified']])
+
+    @timed_operation
+    def budgets_etag(self, user_id):
+        # Changes whenever one of the user's budgets changes or the set of budgets does
+        versions = self.storage.budget_versions(user_id)
+        digest = hashlib.sha1(user_id.encode('utf-8'))
+        for budget_id, version, last_modified in versions:
+            digest.update(f"{budget_id}:{version};".encode('utf-8'))
+        return f"budgets-{digest.hexdigest()}", parse_last_modified([v[2] for v in versions])
+
+    @timed_operation
+    def sync_changes(self, user_id, since=None, limit=None):
+        # What changed in the user's budgets since the token: budgets that are
+        # new or have a new version, the transactions appended to them since,
+        # and budgets the user can no longer see. Transactions are append-only,
+        # so the token only needs each budget's version and transaction count.
+        # At most limit transactions are sent; 'more' says to call again.
+        known = decode_sync_token(since) if since else {}
+        remaining = limit or SYNC_BATCH_TRANSACTIONS
+        seen = {}
+        budgets = []
+        transactions = []
+        more = False
+        for budget_id, version, last_modified in self.storage.budget_versions(user_id):
+            previous = known.get(budget_id)
+            if previous is not None and previous[0] == version:
+                seen[budget_id] = previous
+                continue
+            budget = self.storage.get_budget(budget_id)
+            if budget is None:
+                continue
+            first = previous[1] if previous is not None else 0
+            if first > budget['transaction_count']:
+                raise ValueError("Invalid sync token")
+            rows = self.storage.transactions_since(budget_id, first, remaining) if remaining else []
+            remaining -= len(rows)
+            count = first + len(rows)
+            # A budget that did not fit keeps no version, so it is looked at again
+            done = count >= budget['transaction_count']
+            more = more or not done
+            seen[budget_id] = [budget['version'] if done else None, count]
+            budgets.append({
+                'id': budget_id,
+                'name': budget['name'],
+                'budget': budget['budget'],
+                'balance': budget['balance'],
+                'role': 'owner' if budget['owner'] == user_id else 'collaborator',
+                'version': budget['version'],
+                'last_modified': budget['last_modified']
+            })
+            transactions.extend(dict(transaction, budget_id=budget_id, seq=seq) for seq, transaction in rows)
+        return {
+            'budgets': budgets,
+            'transactions': transactions,
+            'removed': [budget_id for budget_id in known if budget_id not in seen],
+            'token': encode_sync_token(seen),
+            'more': more
+        }
+
+    @timed_operation
+    def get_transactions(self, budget_id, user_id, cursor=None, limit=20, filters=None):
+        budget = self.get_budget(budget_id, user_id)
+        if not budget:
+            return None
+
+        before = decode_cursor(cursor) if cursor else None
+        transactions, next_key = self.storage.page_transactions(budget_id, before, limit, filters or {})
+        return {
+            'transactions': transactions,
+            'next_cursor': encode_cursor(next_key) if next_key else None
+        }
+
+    @timed_operation
+    def get_analytics(self, budget_id, user_id, granularity='month', date_from=None, date_to=None):
+        # Reads the precomputed rollups; dates are YYYY-MM-DD and snap to whole buckets
+        budget = self.get_budget(budget_id, user_id)
+        if not budget:
+            return None
+        if granularity not in ROLLUP_GRANULARITIES:
+            raise ValueError(granularity)
+
+        index = ROLLUP_GRANULARITIES.index(granularity)
+        start = rollup_buckets(date.fromisoformat(date_from).isoformat())[index] if date_from else None
+        end = rollup_buckets(date.fromisoformat(date_to).isoformat())[index] if date_to else None
+        start_month = date_from[:7] if date_from else None
+        end_month = date_to[:7] if date_to else None
+
+        buckets = self.storage.get_rollups(budget_id, granularity, start, end)
+        users = self.storage.get_user_rollups(budget_id, start_month, end_month)
+        return {
+            'granularity': granularity,
+            'buckets': [{'bucket': bucket, 'income': income, 'expense': expense, 'count': count}
+                        for bucket, income, expense, count in buckets],
+            'collaborators': [{'added_by': added_by, 'income': income, 'expense': expense, 'count': count}
+                              for added_by, income, expense, count in users]
+        }
+
+    def export_transactions(self, budget_id, user_id, date_from=None, date_to=None):
+        # Returns (budget, lazy row iterator), or None without access
+        budget = self.get_budget(budget_id, user_id)
+        if not budget:
+            return None
+        return budget, self.storage.iter_transactions(budget_id, date_from, date_to)
+
+    def export_account_transactions(self, user_id, date_from=None, date_to=None):
+        # Every transaction the user can see, budget by budget
+        budgets = [(summary['id'], summary['name']) for summary in self.storage.budget_summaries(user_id)]
+        for budget_id, budget_name in budgets:
+            for transaction in self.storage.iter_transactions(budget_id, date_from, date_to):
+                row = dict(transaction, budget_id=budget_id, budget_name=budget_name)
+                yield row
@@ -0,0 +1,132 @@
+# Production build of the static files into static/dist/:
+#   - the PWA icon set (static/create_icons.py)
+#   - every static file under a content-hashed name, e.g. icon-192.3f9a0c1b2d.png
+#   - a .gz twin of each text file, so nothing is compressed per request
+#   - assets.json, mapping each original name to its hashed one
+#   - sw.js, with the hashed files as its precache list
+# flask_app serves the hashed files as immutable and asset_url() looks names up
+# in assets.json, so a changed file gets a new URL rather than a stale cache
+# hit. Without a build everything is served from static/ as before.
+#
+#   python build_assets.py [--no-icons]
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+ASSET_MANIFEST = 'assets.json'
+DIST_URL = '/static/dist/'
+
+# Files in static/ that are assets; sw.js is generated separately
+ASSET_SUFFIXES = ('.json', '.js', '.css', '.png', '.svg', '.ico')
+COMPRESSIBLE = ('.json', '.js', '.css', '.svg')
+HASH_LENGTH = 10
+
+
+def hashed_name(name, data):
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}'
+
+
+def write_file(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def compress(data):
+    # mtime=0 so the same input always builds the same bytes
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def read_sources(icons):
+    # {name: bytes} for every asset, icons first; manifest.json is returned
+    # separately since it refers to the others by URL
+    sources = {}
+    if icons:
+        from static.create_icons import create_icons
+        with tempfile.TemporaryDirectory() as directory:
+            for name in create_icons(directory):
+                with open(os.path.join(directory, name), 'rb') as f:
+                    sources[name] = f.read()
+    for name in sorted(os.listdir(STATIC_DIR)):
+        path = os.path.join(STATIC_DIR, name)
+        if name in sources or name == 'sw.js' or not name.endswith(ASSET_SUFFIXES) or not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as f:
+            sources[name] = f.read()
+    return sources, json.loads(sources.pop('manifest.json'))
+
+
+def web_manifest(manifest, assets):
+    # The app manifest with its icon URLs pointing at the hashed files
+    icons = []
+    for icon in manifest.get('icons', []):
+        name = icon['src'].rsplit('/', 1)[-1]
+        if name in assets:
+            icons.append(dict(icon, src=DIST_URL + assets[name]))
+    return dict(manifest, icons=icons)
+
+
+def service_worker(assets):
+    # static/sw.js with its cache name and precache list filled in. The
+    # cache name changes with the asset set, so a new build's worker
+    # replaces the old cache instead of serving from it.
+    with open(os.path.join(STATIC_DIR, 'sw.js'), 'r') as f:
+        source = f.read()
+    urls = [DIST_URL + hashed for hashed in assets.values()]
+    version = hashlib.sha256('\n'.join(urls).encode('utf-8')).hexdigest()[:HASH_LENGTH]
+    source = re.sub(r"const CACHE_NAME = .*?;", f"const CACHE_NAME = 'budget-manager-{version}';", source, count=1)
+    return re.sub(r"const urlsToCache = \[.*?\];", f"const urlsToCache = {json.dumps(urls, indent=2)};",
+                  source, count=1, flags=re.S)
+
+
+def build(icons=True):
+    # Returns (files, bytes, bytes as served) for the hashed assets
+    sources, manifest = read_sources(icons)
+    if os.path.isdir(DIST_DIR):
+        shutil.rmtree(DIST_DIR)
+    os.makedirs(DIST_DIR)
+
+    assets = {}
+    sizes = [0, 0]
+
+    def add(name, data):
+        assets[name] = hashed_name(name, data)
+        write_file(os.path.join(DIST_DIR, assets[name]), data)
+        sizes[0] += len(data)
+        if name.endswith(COMPRESSIBLE):
+            packed = compress(data)
+            if len(packed) < len(data):
+                write_file(os.path.join(DIST_DIR, assets[name] + '.gz'), packed)
+                data = packed
+        sizes[1] += len(data)
+
+    for name, data in sources.items():
+        add(name, data)
+    # Last, once the icons it lists have their hashed names
+    add('manifest.json', json.dumps(web_manifest(manifest, assets), indent=2).encode('utf-8'))
+
+    worker = service_worker(assets).encode('utf-8')
+    write_file(os.path.join(DIST_DIR, 'sw.js'), worker)
+    write_file(os.path.join(DIST_DIR, 'sw.js.gz'), compress(worker))
+    write_file(os.path.join(DIST_DIR, ASSET_MANIFEST), json.dumps(assets, indent=2).encode('utf-8'))
+    return len(assets), sizes[0], sizes[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the hashed, precompressed static assets")
+    parser.add_argument('--no-icons', dest='icons', action='store_false',
+                        help="don't generate the icon set; use any icon-*.png already in static/")
+    args = parser.parse_args()
+    files, total, served = build(args.icons)
+    print(f"Built {files} assets into {DIST_DIR} ({total / 1024:.1f} KB, {served / 1024:.1f} KB as served)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import os
+import queue
+import threading
+
+# Sent in place of the next event when a subscriber fell too far behind; the
+# client should reload instead of trusting its deltas
+RESYNC = {'type': 'resync'}
+
+
+class EventHub:
+    # Publish/subscribe of budget change events, one channel per budget.
+    # LocalEventHub only reaches subscribers in the same process; a
+    # multi-worker deployment needs an implementation backed by a broker.
+
+    def publish(self, channel, event):
+        raise NotImplementedError
+
+    def subscribe(self, channel):
+        # Returns an object with get(timeout) -> event or None, and close()
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class Subscription:
+    def __init__(self, hub, channel, max_queue):
+        self.hub = hub
+        self.channel = channel
+        self.events = queue.Queue(max_queue)
+        self.overflowed = False
+        # Called (from the publisher's thread) after each put, for readers
+        # that wait on something other than get(), e.g. an asyncio loop
+        self.listener = None
+
+    def put(self, event):
+        if self.overflowed:
+            return
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            # Never block the publisher on a slow reader
+            self.overflowed = True
+        if self.listener is not None:
+            self.listener()
+
+    def get(self, timeout=None):
+        # The next event, None on timeout, or RESYNC once events were dropped
+        if self.overflowed:
+            return RESYNC
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return RESYNC if self.overflowed else None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class LocalEventHub(EventHub):
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self.lock = threading.Lock()
+        self.channels = {}
+
+    def publish(self, channel, event):
+        with self.lock:
+            subscribers = list(self.channels.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(event)
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel, self.max_queue)
+        with self.lock:
+            self.channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.channels.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.channels[subscription.channel]
+
+    def subscriber_count(self, channel=None):
+        with self.lock:
+            if channel is not None:
+                return len(self.channels.get(channel, ()))
+            return sum(len(subscribers) for subscribers in self.channels.values())
+
+
+def make_event_hub():
+    # BUDGET_EVENTS selects the hub; only the in-process one ships here
+    backend = os.environ.get('BUDGET_EVENTS', 'local')
+    if backend == 'local':
+        return LocalEventHub(int(os.environ.get('EVENT_QUEUE', 100)))
+    raise ValueError(f"Unknown BUDGET_EVENTS backend: {backend}")
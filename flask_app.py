@@ -1,259 +1,188 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session
+from flask import Flask, Response, g, render_template, request, jsonify, redirect, url_for, send_from_directory, session
+from werkzeug.utils import secure_filename
+import csv
+import io
 import json
+import logging
+import mimetypes
 import os
-from datetime import datetime
-import uuid
-import bcrypt
-from email_validator import validate_email, EmailNotValidError
+import re
+import time
+import zlib
+from budgets import MAX_BATCH_OPERATIONS, BudgetManager, InvalidUpload
+from build_assets import HASH_LENGTH
+from cache import LRUCache
+from hashing import HasherBusy
+from metrics import REGISTRY
+from profiling import RequestProfiler
 
 app = Flask(__name__, static_folder='static')
 app.secret_key = 'your-secret-key-change-this-in-production'
 
-class BudgetManager:
-    def __init__(self):
-        self.data_file = "budgets_data.json"
-        self.users_file = "users_data.json"
-        self.load_data()
-
-    def load_data(self):
-        # Load budgets data
-        if os.path.exists(self.data_file):
-            try:
-                with open(self.data_file, 'r') as f:
-                    self.budgets = json.load(f)
-            except Exception as e:
-                print(f"Failed to load budgets data: {str(e)}")
-                self.budgets = {}
-        else:
-            self.budgets = {}
-
-        # Load users data
-        if os.path.exists(self.users_file):
-            try:
-                with open(self.users_file, 'r') as f:
-                    self.users = json.load(f)
-            except Exception as e:
-                print(f"Failed to load users data: {str(e)}")
-                self.users = {}
-        else:
-            self.users = {}
+EXPORT_COLUMNS = ('date', 'type', 'amount', 'description', 'added_by')
+ACCOUNT_EXPORT_COLUMNS = ('budget_id', 'budget_name') + EXPORT_COLUMNS
+EXPORT_CHUNK_BYTES = 64 * 1024
 
-    def save_data(self):
-        try:
-            with open(self.data_file, 'w') as f:
-                json.dump(self.budgets, f, indent=2)
-            with open(self.users_file, 'w') as f:
-                json.dump(self.users, f, indent=2)
-        except Exception as e:
-            print(f"Failed to save data: {str(e)}")
-
-    def register_user(self, email, username, password):
-        try:
-            # Validate email
-            validate_email(email)
-        except EmailNotValidError:
-            return {"success": False, "message": "Invalid email address!"}
-
-        # Check if email already exists
-        for user_data in self.users.values():
-            if user_data.get('email', '').lower() == email.lower():
-                return {"success": False, "message": "Email already registered!"}
-            if user_data.get('username', '').lower() == username.lower():
-                return {"success": False, "message": "Username already taken!"}
-
-        # Hash password
-        password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-        
-        user_id = str(uuid.uuid4())
-        self.users[user_id] = {
-            'email': email.lower(),
-            'username': username,
-            'password_hash': password_hash,
-            'budgets': [],
-            'shared_budgets': [],
-            'created_at': datetime.now().strftime("%Y-%m-%d %H:%M")
-        }
-        self.save_data()
-        return {"success": True, "message": "Account created successfully!", "user_id": user_id}
-
-    def authenticate_user(self, email, password):
-        for user_id, user_data in self.users.items():
-            if user_data.get('email', '').lower() == email.lower():
-                if bcrypt.checkpw(password.encode('utf-8'), user_data['password_hash'].encode('utf-8')):
-                    return {"success": True, "user_id": user_id, "username": user_data['username']}
-                else:
-                    return {"success": False, "message": "Invalid password!"}
-        return {"success": False, "message": "Email not found!"}
-
-    def get_user_by_id(self, user_id):
-        return self.users.get(user_id)
-
-    def create_budget(self, user_id, budget_name, initial_amount=0.0):
-        budget_id = str(uuid.uuid4())
-        budget = {
-            'id': budget_id,
-            'name': budget_name,
-            'owner': user_id,
-            'collaborators': [],
-            'budget': float(initial_amount),
-            'transactions': [],
-            'created_at': datetime.now().strftime("%Y-%m-%d %H:%M")
-        }
-        
-        self.budgets[budget_id] = budget
-        if user_id in self.users:
-            self.users[user_id]['budgets'].append(budget_id)
-        self.save_data()
-        return budget_id
-
-    def get_user_budgets(self, user_id):
-        if user_id not in self.users:
-            return []
-        
-        owned_budgets = []
-        shared_budgets = []
-        
-        for budget_id in self.users[user_id]['budgets']:
-            if budget_id in self.budgets:
-                budget = self.budgets[budget_id].copy()
-                budget['role'] = 'owner'
-                owned_budgets.append(budget)
-        
-        for budget_id in self.users[user_id]['shared_budgets']:
-            if budget_id in self.budgets:
-                budget = self.budgets[budget_id].copy()
-                budget['role'] = 'collaborator'
-                shared_budgets.append(budget)
-        
-        return owned_budgets + shared_budgets
-
-    def get_budget(self, budget_id, user_id):
-        if budget_id not in self.budgets:
-            return None
-        
-        budget = self.budgets[budget_id]
-        # Check if user has access to this budget
-        if (budget['owner'] == user_id or 
-            user_id in budget['collaborators'] or
-            budget_id in self.users.get(user_id, {}).get('shared_budgets', [])):
-            return budget
-        return None
-
-    def set_budget(self, budget_id, user_id, amount):
-        budget = self.get_budget(budget_id, user_id)
-        if not budget:
-            return {"success": False, "message": "Budget not found or access denied!"}
-        
-        try:
-            budget_amount = float(amount)
-            if budget_amount < 0:
-                return {"success": False, "message": "Budget cannot be negative!"}
-
-            self.budgets[budget_id]['budget'] = budget_amount
-            self.save_data()
-            return {"success": True, "message": f"Budget set to ${budget_amount:.2f}"}
-        except ValueError:
-            return {"success": False, "message": "Please enter a valid number!"}
-
-    def add_transaction(self, budget_id, user_id, amount, description, transaction_type):
-        budget = self.get_budget(budget_id, user_id)
-        if not budget:
-            return {"success": False, "message": "Budget not found or access denied!"}
-        
-        try:
-            amount = float(amount)
-            description = description.strip()
-
-            if amount <= 0:
-                return {"success": False, "message": "Amount must be positive!"}
-
-            if not description:
-                description = "No description"
-
-            transaction = {
-                'date': datetime.now().strftime("%Y-%m-%d %H:%M"),
-                'type': transaction_type,
-                'amount': amount,
-                'description': description,
-                'added_by': self.users.get(user_id, {}).get('username', 'Unknown')
-            }
-
-            self.budgets[budget_id]['transactions'].append(transaction)
-            self.save_data()
-            return {"success": True, "message": "Transaction added successfully!"}
-
-        except ValueError:
-            return {"success": False, "message": "Please enter a valid amount!"}
-
-    def calculate_balance(self, budget_id):
-        if budget_id not in self.budgets:
-            return 0
-        
-        budget = self.budgets[budget_id]
-        balance = budget['budget']
-        for transaction in budget['transactions']:
-            if transaction['type'] == 'income':
-                balance += transaction['amount']
-            else:
-                balance -= transaction['amount']
-        return balance
-
-    def invite_collaborator(self, budget_id, owner_id, collaborator_email):
-        if budget_id not in self.budgets:
-            return {"success": False, "message": "Budget not found!"}
-        
-        budget = self.budgets[budget_id]
-        if budget['owner'] != owner_id:
-            return {"success": False, "message": "Only the budget owner can invite collaborators!"}
-        
-        # Find user by email
-        collaborator_id = None
-        collaborator_username = None
-        for user_id, user_data in self.users.items():
-            if user_data.get('email', '').lower() == collaborator_email.lower():
-                collaborator_id = user_id
-                collaborator_username = user_data['username']
-                break
-        
-        if not collaborator_id:
-            return {"success": False, "message": f"User with email '{collaborator_email}' not found!"}
-        
-        if collaborator_id == owner_id:
-            return {"success": False, "message": "You cannot invite yourself!"}
-        
-        if collaborator_id in budget['collaborators']:
-            return {"success": False, "message": f"User '{collaborator_email}' is already a collaborator!"}
-        
-        # Add collaborator
-        self.budgets[budget_id]['collaborators'].append(collaborator_id)
-        self.users[collaborator_id]['shared_budgets'].append(budget_id)
-        self.save_data()
-        
-        return {"success": True, "message": f"Successfully invited '{collaborator_username}' to collaborate!"}
-
-    def get_budget_data(self, budget_id, user_id):
-        budget = self.get_budget(budget_id, user_id)
-        if not budget:
-            return None
-        
-        return {
-            'id': budget_id,
-            'name': budget['name'],
-            'budget': budget['budget'],
-            'balance': self.calculate_balance(budget_id),
-            'transactions': list(reversed(budget['transactions'][-20:])),
-            'owner': self.users.get(budget['owner'], {}).get('username', 'Unknown'),
-            'collaborators': [self.users.get(cid, {}).get('username', 'Unknown') for cid in budget['collaborators']],
-            'is_owner': budget['owner'] == user_id
-        }
+def iter_export(rows, file_format, columns):
+    # Serializes rows lazily into ~64KB text chunks
+    buffer = io.StringIO()
+    if file_format == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+
+    for row in rows:
+        if file_format == 'csv':
+            writer.writerow([row.get(column) for column in columns])
+        else:
+            buffer.write(json.dumps({column: row.get(column) for column in columns}) + '\n')
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
 
 # Initialize budget manager
 budget_manager = BudgetManager()
+# The server owns its data files: manage.py won't rewrite them while this
+# process is up. Under the debug reloader only the serving child takes it.
+if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN'):
+    budget_manager.storage.lock_files()
+
+# Idle event streams send a comment this often so proxies keep them open
+# and dead clients are noticed
+EVENT_HEARTBEAT_SECONDS = 15
+
+# Serialized API responses keyed by ETag; a new budget version means a new
+# key, so entries never need invalidating
+RESPONSE_CACHE_SIZE = 256
+response_cache = LRUCache(RESPONSE_CACHE_SIZE)
+
+logger = logging.getLogger(__name__)
+
+# Opt-in cProfile dumps of single requests; off unless PROFILE_DIR is set,
+# and the X-Profile header needs PROFILE_TOKEN
+request_profiler = RequestProfiler()
+
+REGISTRY.gauge('response_cache_entries', "Serialized responses held in the ETag cache", lambda: len(response_cache))
+REGISTRY.gauge('profile_cache_entries', "User profiles held by the resolver",
+               lambda: len(budget_manager.profiles.cache))
+if hasattr(budget_manager.events, 'subscriber_count'):
+    REGISTRY.gauge('event_subscribers', "Open budget event streams", budget_manager.events.subscriber_count)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.profile = request_profiler.start(request_profiler.requested(request.headers.get('X-Profile')))
+
+@app.after_request
+def record_request(response):
+    # Latency by route pattern (not raw path), so the label set stays small.
+    # Streamed bodies are timed up to the first byte only.
+    elapsed = time.perf_counter() - g.request_start
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    REGISTRY.histogram('http_request_duration_seconds', "Request latency by route", route=route,
+                       method=request.method, status=str(response.status_code)).observe(elapsed)
+    # Where a dump went is only logged; responses don't name server files
+    request_profiler.finish(g.pop('profile', None), elapsed, f"{request.method} {route}")
+    return response
+
+# Output of build_assets.py: content-hashed copies of the static files,
+# named in assets.json. Without a build, asset_url() falls back to static/.
+ASSET_DIR = os.path.join(app.static_folder, 'dist')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# name.<content hash>.ext, or its .gz twin; assets.json and the like keep their names
+HASHED_NAME = re.compile(r'\.[0-9a-f]{%d}\.[^./]+(\.gz)?$' % HASH_LENGTH)
+
+def load_asset_manifest():
+    try:
+        with open(os.path.join(ASSET_DIR, 'assets.json'), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+ASSETS = load_asset_manifest()
+
+@app.template_global()
+def asset_url(name):
+    hashed = ASSETS.get(name)
+    if hashed:
+        return f'/static/dist/{hashed}'
+    return url_for('static', filename=name)
+
+def send_built_file(filename):
+    # The precompressed twin when there is one and the client takes gzip
+    gzipped = filename + '.gz'
+    if request.accept_encodings['gzip'] and os.path.isfile(os.path.join(ASSET_DIR, gzipped)):
+        response = send_from_directory(ASSET_DIR, gzipped, mimetype=mimetypes.guess_type(filename)[0])
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = send_from_directory(ASSET_DIR, filename)
+    response.vary.add('Accept-Encoding')
+    return response
+
+@app.route('/static/dist/<path:filename>')
+def built_asset(filename):
+    # A new build gives changed files new names, so hashed ones never need
+    # revalidating; anything else in dist/ can change under the same URL
+    response = send_built_file(filename)
+    response.headers['Cache-Control'] = IMMUTABLE if HASHED_NAME.search(filename) else 'no-cache'
+    return response
+
+@app.route('/sw.js')
+def service_worker():
+    # Served from the root so its scope covers every page; always
+    # revalidated, since its precache list changes with each build
+    if os.path.isfile(os.path.join(ASSET_DIR, 'sw.js')):
+        response = send_built_file('sw.js')
+    else:
+        response = send_from_directory(app.static_folder, 'sw.js')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def render_page(template, **context):
+    with REGISTRY.histogram('template_render_seconds', "Jinja template render time", template=template).timer():
+        return render_template(template, **context)
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus text format; per process, so scrape every worker
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.errorhandler(HasherBusy)
+def hasher_busy(e):
+    response = jsonify({"success": False, "message": "Server is busy, please try again in a moment!"})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+def conditional_json(etag, last_modified, build):
+    # 304 if the client already has this version, otherwise the cached or freshly built body
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        body = response_cache.get(etag)
+        if body is None:
+            body = app.json.dumps(build())
+            response_cache.put(etag, body)
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    # Let the browser keep a copy but revalidate it on every poll
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 def get_current_user():
     user_id = session.get('user_id')
-    if user_id and user_id in budget_manager.users:
-        user_data = budget_manager.users[user_id]
+    user_data = budget_manager.profiles.get(user_id) if user_id else None
+    if user_data:
         return {'id': user_id, 'username': user_data['username'], 'email': user_data['email']}
     return None
 
@@ -261,22 +190,22 @@ def get_current_user():
 def index():
     user = get_current_user()
     if not user:
-        return render_template('login.html')
+        return render_page('login.html')
     
-    user_budgets = budget_manager.get_user_budgets(user['id'])
-    return render_template('dashboard.html', user=user, budgets=user_budgets)
+    user_budgets = budget_manager.get_user_budget_summaries(user['id'])
+    return render_page('dashboard.html', user=user, budgets=user_budgets)
 
 @app.route('/register')
 def register_page():
     if get_current_user():
         return redirect(url_for('index'))
-    return render_template('register.html')
+    return render_page('register.html')
 
 @app.route('/login')
 def login_page():
     if get_current_user():
         return redirect(url_for('index'))
-    return render_template('login.html')
+    return render_page('login.html')
 
 @app.route('/logout')
 def logout():
@@ -293,7 +222,7 @@ def budget_detail(budget_id):
     if not budget_data:
         return "Budget not found or access denied", 404
     
-    return render_template('budget.html', user=user, budget=budget_data)
+    return render_page('budget.html', user=user, budget=budget_data)
 
 @app.route('/api/register', methods=['POST'])
 def register():
@@ -349,11 +278,107 @@ def get_budget_data(budget_id):
     if not user:
         return jsonify({"error": "Authentication required!"})
     
-    budget_data = budget_manager.get_budget_data(budget_id, user['id'])
-    if not budget_data:
+    tag = budget_manager.budget_data_etag(budget_id, user['id'])
+    if not tag:
         return jsonify({"error": "Budget not found or access denied!"})
-    
-    return jsonify(budget_data)
+
+    etag, last_modified = tag
+    return conditional_json(etag, last_modified, lambda: budget_manager.get_budget_data(budget_id, user['id']))
+
+def open_event_stream(budget_id):
+    # Shared with asgi_app. Returns (subscription, opening chunk) for the
+    # current user's stream of this budget, or (None, error response).
+    user = get_current_user()
+    if not user:
+        return None, (jsonify({"error": "Authentication required!"}), 401)
+
+    # Subscribe before reading the version so nothing slips in between
+    subscription = budget_manager.events.subscribe(budget_id)
+    budget = budget_manager.get_budget(budget_id, user['id'])
+    if not budget:
+        subscription.close()
+        return None, (jsonify({"error": "Budget not found or access denied!"}), 404)
+
+    # A reconnecting EventSource sends the last version it saw
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    opening = f"retry: 3000\nid: {budget['version']}\n\n"
+    if last_event_id.isdigit() and int(last_event_id) < budget['version']:
+        opening += "event: resync\ndata: {}\n\n"
+    return subscription, opening
+
+def format_event(event):
+    if event['type'] == 'resync':
+        # Fell behind; the client reloads and reconnects
+        return "event: resync\ndata: {}\n\n"
+    return f"id: {event['version']}\nevent: {event['type']}\ndata: {app.json.dumps(event)}\n\n"
+
+EVENT_STREAM_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+@app.route('/api/budget/<budget_id>/events')
+def budget_events(budget_id):
+    subscription, opening = open_event_stream(budget_id)
+    if subscription is None:
+        return opening
+
+    def stream():
+        try:
+            yield opening
+            while True:
+                event = subscription.get(EVENT_HEARTBEAT_SECONDS)
+                if event is None:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield format_event(event)
+                if event['type'] == 'resync':
+                    return
+        finally:
+            subscription.close()
+
+    return Response(stream(), mimetype='text/event-stream', headers=EVENT_STREAM_HEADERS)
+
+@app.route('/api/budget/<budget_id>/transactions')
+def get_transactions(budget_id):
+    user = get_current_user()
+    if not user:
+        return jsonify({"error": "Authentication required!"}), 401
+
+    def amount_arg(name):
+        value = request.args.get(name)
+        return float(value) if value else None
+
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+        filters = {
+            'type': request.args.get('type'),
+            'date_from': request.args.get('from'),
+            'date_to': request.args.get('to'),
+            'added_by': request.args.get('added_by'),
+            'min_amount': amount_arg('min_amount'),
+            'max_amount': amount_arg('max_amount')
+        }
+        page = budget_manager.get_transactions(budget_id, user['id'], request.args.get('cursor'), limit, filters)
+    except ValueError:
+        return jsonify({"error": "Invalid cursor or filter!"}), 400
+
+    if page is None:
+        return jsonify({"error": "Budget not found or access denied!"}), 404
+    return jsonify(page)
+
+@app.route('/api/budget/<budget_id>/analytics')
+def get_analytics(budget_id):
+    user = get_current_user()
+    if not user:
+        return jsonify({"error": "Authentication required!"}), 401
+
+    try:
+        analytics = budget_manager.get_analytics(budget_id, user['id'], request.args.get('granularity', 'month'),
+                                                 request.args.get('from'), request.args.get('to'))
+    except ValueError:
+        return jsonify({"error": "Granularity must be day, week or month and dates YYYY-MM-DD!"}), 400
+
+    if analytics is None:
+        return jsonify({"error": "Budget not found or access denied!"}), 404
+    return jsonify(analytics)
 
 @app.route('/api/budget/<budget_id>/set_budget', methods=['POST'])
 def set_budget(budget_id):
@@ -374,9 +399,111 @@ def add_transaction(budget_id):
     amount = request.form.get('amount')
     description = request.form.get('description')
     transaction_type = request.form.get('type')
-    result = budget_manager.add_transaction(budget_id, user['id'], amount, description, transaction_type)
+    result = budget_manager.add_transaction(budget_id, user['id'], amount, description, transaction_type,
+                                            request.form.get('date'))
     return jsonify(result)
 
+@app.route('/api/sync', methods=['GET', 'POST'])
+def sync():
+    # Delta of the user's budgets since the token; no token means everything.
+    # The token grows with the number of budgets, so clients POST it as
+    # {"since": token}; ?since=<token> still works for small ones.
+    user = get_current_user()
+    if not user:
+        return jsonify({"error": "Authentication required!"}), 401
+    if request.method == 'POST':
+        payload = request.get_json(silent=True)
+        since = payload.get('since') if isinstance(payload, dict) else None
+        if since is not None and not isinstance(since, str):
+            return jsonify({"error": "Invalid sync token!"}), 400
+    else:
+        since = request.args.get('since')
+    try:
+        return jsonify(budget_manager.sync_changes(user['id'], since))
+    except ValueError:
+        return jsonify({"error": "Invalid sync token!"}), 400
+
+@app.route('/api/batch', methods=['POST'])
+def batch():
+    # {"operations": [...], "atomic": false}; see BudgetManager.apply_batch
+    user = get_current_user()
+    if not user:
+        return jsonify({"success": False, "message": "Authentication required!"})
+
+    payload = request.get_json(silent=True)
+    operations = payload.get('operations') if isinstance(payload, dict) else None
+    if not isinstance(operations, list) or not all(isinstance(op, dict) for op in operations):
+        return jsonify({"success": False, "message": "Expected a JSON list of operations!"}), 400
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify({"success": False,
+                        "message": f"At most {MAX_BATCH_OPERATIONS} operations per batch!"}), 413
+    return jsonify(budget_manager.apply_batch(user['id'], operations, bool(payload.get('atomic'))))
+
+@app.route('/api/budget/<budget_id>/import', methods=['POST'])
+def import_transactions(budget_id):
+    user = get_current_user()
+    if not user:
+        return jsonify({"success": False, "message": "Authentication required!"})
+
+    # Either a multipart upload in "file" or the raw request body
+    upload = request.files.get('file')
+    if upload is not None:
+        stream = upload.stream
+        default_format = 'ndjson' if (upload.filename or '').lower().endswith(('.ndjson', '.jsonl')) else 'csv'
+    else:
+        stream = request.stream
+        default_format = 'ndjson' if 'ndjson' in (request.mimetype or '') else 'csv'
+
+    file_format = request.args.get('format', default_format).lower()
+    try:
+        result = budget_manager.import_transactions(budget_id, user['id'], stream, file_format)
+    except InvalidUpload as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify(result)
+
+def export_response(rows, file_format, columns, filename):
+    chunks = iter_export(rows, file_format, columns)
+    headers = {
+        'Content-Disposition': f'attachment; filename="{filename}.{file_format}"',
+        'Vary': 'Accept-Encoding'
+    }
+    if request.accept_encodings['gzip']:
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    mimetype = 'text/csv' if file_format == 'csv' else 'application/x-ndjson'
+    return Response(chunks, mimetype=mimetype, headers=headers)
+
+@app.route('/api/budget/<budget_id>/export')
+def export_budget(budget_id):
+    user = get_current_user()
+    if not user:
+        return jsonify({"error": "Authentication required!"}), 401
+
+    file_format = request.args.get('format', 'csv').lower()
+    if file_format not in ('csv', 'ndjson'):
+        return jsonify({"error": "Format must be csv or ndjson!"}), 400
+
+    export = budget_manager.export_transactions(budget_id, user['id'], request.args.get('from'), request.args.get('to'))
+    if not export:
+        return jsonify({"error": "Budget not found or access denied!"}), 404
+
+    budget, rows = export
+    filename = secure_filename(budget['name']) or 'budget'
+    return export_response(rows, file_format, EXPORT_COLUMNS, filename)
+
+@app.route('/api/export')
+def export_account():
+    user = get_current_user()
+    if not user:
+        return jsonify({"error": "Authentication required!"}), 401
+
+    file_format = request.args.get('format', 'csv').lower()
+    if file_format not in ('csv', 'ndjson'):
+        return jsonify({"error": "Format must be csv or ndjson!"}), 400
+
+    rows = budget_manager.export_account_transactions(user['id'], request.args.get('from'), request.args.get('to'))
+    return export_response(rows, file_format, ACCOUNT_EXPORT_COLUMNS, 'budgets')
+
 @app.route('/api/budget/<budget_id>/invite', methods=['POST'])
 def invite_collaborator(budget_id):
     user = get_current_user()
@@ -392,18 +519,27 @@ def get_user_budgets_api():
     user = get_current_user()
     if not user:
         return jsonify({"error": "Authentication required!"}), 401
-    budgets = budget_manager.get_user_budgets(user['id'])
+
+    etag, last_modified = budget_manager.budgets_etag(user['id'])
+    return conditional_json(etag, last_modified, lambda: budget_list(user['id']))
+
+def budget_list(user_id):
+    budgets = budget_manager.get_user_budget_summaries(user_id)
     # Only return summary info for each budget
     budget_list = [
         {
             'id': b['id'],
             'name': b['name'],
+            'role': b['role'],
             'budget': b['budget'],
-            'balance': budget_manager.calculate_balance(b['id'])
+            'balance': b['balance'],
+            'transaction_count': b['transaction_count'],
+            'last_modified': b['last_modified']
         }
         for b in budgets
     ]
-    return jsonify({"budgets": budget_list})
+    return {"budgets": budget_list}
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,102 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from metrics import REGISTRY
+
+
+class HasherBusy(Exception):
+    pass
+
+
+# bcrypt is imported where it's used: only the worker processes (or the
+# first inline call) pay for it, not every process importing this module
+def _hash_password(password, rounds):
+    import bcrypt
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check_password(password, password_hash):
+    import bcrypt
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+
+class PasswordHasher:
+    # Runs bcrypt on a small process pool so request threads only wait on a
+    # future. At most workers + max_queue calls may be in flight; anything
+    # beyond that fails fast with HasherBusy instead of piling up.
+    def __init__(self, workers=None, max_queue=None, rounds=None, timeout=30):
+        self.rounds = rounds or int(os.environ.get('BCRYPT_ROUNDS', 12))
+        self.workers = workers if workers is not None else int(os.environ.get('HASH_WORKERS', os.cpu_count() or 2))
+        if max_queue is None:
+            max_queue = int(os.environ.get('HASH_QUEUE', self.workers * 4))
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max(1, self.workers) + max_queue)
+        self.executor = None
+        self.executor_lock = threading.Lock()
+        # Shared by every hasher in the process and exported on /metrics
+        self.latency = {op: REGISTRY.histogram('password_hash_seconds', "bcrypt calls, including time queued",
+                                               op=op)
+                        for op in ('hash', 'check')}
+        self.rejected = REGISTRY.counter('password_hash_rejected_total', "bcrypt calls refused with HasherBusy")
+
+    def hash_password(self, password):
+        return self._run('hash', _hash_password, password, self.rounds)
+
+    def check_password(self, password, password_hash):
+        return self._run('check', _check_password, password, password_hash)
+
+    def needs_rehash(self, password_hash):
+        # bcrypt hashes look like $2b$12$...; the middle field is the cost
+        try:
+            return int(password_hash.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def stats(self):
+        stats = {op: histogram.snapshot() for op, histogram in self.latency.items()}
+        stats['rejected'] = self.rejected.value
+        return stats
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def _run(self, op, func, *args):
+        if not self.slots.acquire(blocking=False):
+            self.rejected.inc()
+            raise HasherBusy()
+        start = time.perf_counter()
+        if self.workers == 0:
+            try:
+                return func(*args)
+            finally:
+                self._finish(op, start)
+        try:
+            future = self._executor().submit(func, *args)
+        except BaseException:
+            self._finish(op, start)
+            raise
+        # The slot is held until the worker is actually done with the call, so
+        # timed-out calls still count against the queue while they run
+        future.add_done_callback(lambda future: self._finish(op, start))
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # Dropped if it's still queued; the caller gets a 503 either way
+            future.cancel()
+            self.rejected.inc()
+            raise HasherBusy()
+
+    def _finish(self, op, start):
+        self.slots.release()
+        self.latency[op].observe(time.perf_counter() - start)
+
+    def _executor(self):
+        if self.executor is None:
+            with self.executor_lock:
+                if self.executor is None:
+                    self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self.executor
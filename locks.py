@@ -0,0 +1,135 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # No flock (Windows): FileLock never refuses
+    fcntl = None
+
+
+class DataFilesLocked(Exception):
+    pass
+
+
+class LockTable:
+    # One re-entrant lock per key, created on first use and dropped once
+    # nobody holds or waits for it, so the table only ever holds the keys
+    # currently in use
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    @contextmanager
+    def hold(self, *keys):
+        # Keys are always taken in sorted order, so two callers with
+        # overlapping key sets can't deadlock each other
+        held = []
+        try:
+            for key in sorted(set(keys)):
+                lock = self._acquire_entry(key)
+                try:
+                    lock.acquire()
+                except BaseException:
+                    self._release_entry(key)
+                    raise
+                held.append((key, lock))
+            yield
+        finally:
+            for key, lock in reversed(held):
+                lock.release()
+                self._release_entry(key)
+
+    def _acquire_entry(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = [threading.RLock(), 0]
+            entry[1] += 1
+            return entry[0]
+
+    def _release_entry(self, key):
+        with self.lock:
+            entry = self.entries[key]
+            entry[1] -= 1
+            if not entry[1]:
+                del self.entries[key]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SharedLock:
+    # Any number of shared holders or a single exclusive one. A waiting
+    # exclusive holder stops new shared holders from getting in, so it
+    # can't be starved by a steady stream of them.
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.shared_holders = 0
+        self.exclusive_held = False
+        self.exclusive_waiting = 0
+
+    @contextmanager
+    def shared(self):
+        with self.condition:
+            while self.exclusive_held or self.exclusive_waiting:
+                self.condition.wait()
+            self.shared_holders += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.shared_holders -= 1
+                if not self.shared_holders:
+                    self.condition.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self.condition:
+            self.exclusive_waiting += 1
+            try:
+                while self.exclusive_held or self.shared_holders:
+                    self.condition.wait()
+            finally:
+                self.exclusive_waiting -= 1
+            self.exclusive_held = True
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.exclusive_held = False
+                self.condition.notify_all()
+
+
+class FileLock:
+    # An exclusive flock on path, held until release(). The server takes it
+    # on its data files and maintenance commands refuse to run while it's
+    # held. The OS drops it when the process exits, so a crash leaves no
+    # stale lock behind; the file itself only records the last holder's pid.
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def acquire(self):
+        if self.file is not None or fcntl is None:
+            return
+        f = open(self.path, 'a+')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.seek(0)
+            pid = f.read().strip()
+            f.close()
+            holder = f'process {pid}' if pid else 'another process'
+            raise DataFilesLocked(f"{self.path} is held by {holder}; stop the server first")
+        f.seek(0)
+        f.truncate()
+        f.write(str(os.getpid()))
+        f.flush()
+        self.file = f
+
+    def release(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
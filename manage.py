@@ -0,0 +1,115 @@
+import argparse
+import os
+import sys
+from datetime import date, timedelta
+
+from locks import DataFilesLocked
+
+
+def migrate_sqlite(args):
+    from sqlite_storage import migrate_json_to_sqlite
+    users, budgets = migrate_json_to_sqlite(args.db, args.data_file, args.users_file, args.journal_file)
+    print(f"Imported {users} users and {budgets} budgets into {args.db}")
+
+
+def migrate_sharded(args):
+    from sharded_storage import migrate_json_to_sharded
+    users, budgets = migrate_json_to_sharded(args.dir, args.data_file, args.users_file, args.journal_file)
+    print(f"Wrote {users} users and {budgets} budgets under {args.dir}")
+
+
+def claim(storage):
+    # The storage, locked for this process; exits if a server holds it
+    try:
+        storage.lock_files()
+    except DataFilesLocked as e:
+        storage.close()
+        sys.exit(str(e))
+    return storage
+
+
+def compact(args):
+    from storage import JsonStorage
+    storage = claim(JsonStorage(args.data_file, args.users_file, args.journal_file))
+    storage.save_data()
+    storage.close()
+    print(f"Folded journal into {args.data_file} and {args.users_file}")
+
+
+def open_storage(args):
+    # The backend named by --storage on the files given on the command line
+    if args.storage == 'sqlite':
+        from sqlite_storage import SQLiteStorage
+        storage = SQLiteStorage(args.db)
+    elif args.storage == 'sharded':
+        from sharded_storage import ShardedStorage
+        storage = ShardedStorage(args.dir)
+    else:
+        from storage import JsonStorage
+        storage = JsonStorage(args.data_file, args.users_file, args.journal_file, lazy=True)
+    return claim(storage)
+
+
+def backfill_rollups(args):
+    storage = open_storage(args)
+    storage.rebuild_rollups(args.budget)
+    storage.close()
+    print(f"Rebuilt analytics rollups for {args.budget or 'all budgets'}")
+
+
+def archive(args):
+    storage = open_storage(args)
+    if not hasattr(storage, 'archive_transactions'):
+        storage.close()
+        sys.exit("Archiving is only supported by the json and sharded backends")
+    before = args.before or (date.today() - timedelta(days=args.days)).isoformat()
+    budgets, transactions = storage.archive_transactions(before, args.budget)
+    storage.close()
+    print(f"Archived {transactions} transactions older than {before} from {budgets} budgets")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Budget Manager maintenance commands")
+    parser.add_argument('--data-file', default='budgets_data.json')
+    parser.add_argument('--users-file', default='users_data.json')
+    parser.add_argument('--journal-file', default='budgets_journal.log')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    # For the commands that work on whichever backend the server uses
+    backend = argparse.ArgumentParser(add_help=False)
+    backend.add_argument('--storage', choices=('json', 'sqlite', 'sharded'),
+                         default=os.environ.get('BUDGET_STORAGE', 'json'))
+    backend.add_argument('--db', default=os.environ.get('BUDGET_SQLITE_PATH', 'budgets.db'),
+                         help="the SQLite database, with --storage sqlite")
+    backend.add_argument('--dir', default=os.environ.get('BUDGET_SHARD_DIR', 'budgets_shards'),
+                         help="the shard directory, with --storage sharded")
+
+    command = commands.add_parser('migrate-sqlite', help="import the JSON data files into a SQLite database")
+    command.add_argument('--db', default='budgets.db')
+    command.set_defaults(func=migrate_sqlite)
+
+    command = commands.add_parser('migrate-sharded', help="split the JSON data files into one file per budget and user")
+    command.add_argument('--dir', default='budgets_shards')
+    command.set_defaults(func=migrate_sharded)
+
+    command = commands.add_parser('compact', help="fold the journal into the JSON snapshot files")
+    command.set_defaults(func=compact)
+
+    command = commands.add_parser('backfill-rollups', parents=[backend],
+                                  help="rebuild the analytics rollups from the transactions")
+    command.add_argument('--budget', help="only this budget id")
+    command.set_defaults(func=backfill_rollups)
+
+    command = commands.add_parser('archive', parents=[backend],
+                                  help="move old transactions into compressed monthly segment files")
+    command.add_argument('--days', type=int, default=365, help="archive transactions older than this many days")
+    command.add_argument('--before', help="archive transactions dated before this YYYY-MM-DD instead")
+    command.add_argument('--budget', help="only this budget id")
+    command.set_defaults(func=archive)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; spans a fast dict lookup up to a slow bcrypt round
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Bytes; a one-line journal record up to a very large snapshot
+BYTE_BUCKETS = (1024, 16 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2,
+                256 * 1024 ** 2, 1024 ** 3)
+
+
+def format_labels(labels):
+    # (('route', '/x'), ...) -> '{route="/x",...}' in the Prometheus text format
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def render(self, name, labels):
+        return [f'{name}{format_labels(labels)} {format_value(self.value)}']
+
+
+class Gauge:
+    # Reads its value from a callback when rendered, e.g. a cache's size
+    def __init__(self, read):
+        self.read = read
+
+    def render(self, name, labels):
+        return [f'{name}{format_labels(labels)} {format_value(self.read())}']
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.lock = threading.Lock()
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    @contextmanager
+    def timer(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        with self.lock:
+            counts = list(self.counts)
+            total = self.count
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def snapshot(self):
+        with self.lock:
+            count, total = self.count, self.sum
+        return {
+            'count': count,
+            'avg': total / count if count else 0.0,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99)
+        }
+
+    def render(self, name, labels):
+        with self.lock:
+            counts, count, total = list(self.counts), self.count, self.sum
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{format_labels(labels + (("le", format_value(bound)),))} {cumulative}')
+        lines.append(f'{name}_sum{format_labels(labels)} {format_value(total)}')
+        lines.append(f'{name}_count{format_labels(labels)} {count}')
+        return lines
+
+
+class Registry:
+    # Named, labelled metrics for the /metrics endpoint. Asking again for
+    # the same name and labels returns the same metric, so modules declare
+    # theirs at import time and share them across instances.
+    def __init__(self):
+        self.lock = threading.Lock()
+        # name -> (type, help, {sorted label pairs: metric})
+        self.families = {}
+
+    def counter(self, name, help, **labels):
+        return self._metric(name, 'counter', help, labels, Counter)
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS, **labels):
+        return self._metric(name, 'histogram', help, labels, lambda: Histogram(buckets))
+
+    def gauge(self, name, help, read, **labels):
+        # Re-registering replaces the callback (e.g. a newer BudgetManager)
+        gauge = self._metric(name, 'gauge', help, labels, lambda: Gauge(read))
+        gauge.read = read
+        return gauge
+
+    def _metric(self, name, kind, help, labels, create):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            family = self.families.setdefault(name, (kind, help, {}))
+            metric = family[2].get(key)
+            if metric is None:
+                metric = family[2][key] = create()
+            return metric
+
+    def render(self):
+        with self.lock:
+            families = sorted((name, kind, help, list(metrics.items()))
+                              for name, (kind, help, metrics) in self.families.items())
+        lines = []
+        for name, kind, help, metrics in families:
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, metric in sorted(metrics, key=lambda item: item[0]):
+                lines.extend(metric.render(name, labels))
+        return '\n'.join(lines) + '\n'
+
+
+# Process-wide registry behind /metrics
+REGISTRY = Registry()
@@ -0,0 +1,41 @@
+import os
+import time
+
+from cache import LRUCache
+
+
+class ProfileResolver:
+    # user_id -> {'username', 'email'} for rendering pages. resolve() takes
+    # every id a view needs and makes at most one storage call, for the ids
+    # not already cached. Usernames and emails never change once registered
+    # and nothing deletes users, so entries are only dropped by the LRU or
+    # after ttl seconds; the TTL is the only invalidation. Unknown ids are
+    # not cached, so a user registered in another process shows up at once.
+    def __init__(self, storage, maxsize=None, ttl=None):
+        self.storage = storage
+        self.ttl = ttl if ttl is not None else float(os.environ.get('PROFILE_CACHE_TTL', 60))
+        self.cache = LRUCache(maxsize or int(os.environ.get('PROFILE_CACHE_SIZE', 4096)))
+
+    def resolve(self, user_ids):
+        now = time.monotonic()
+        profiles = {}
+        missing = set()
+        for user_id in user_ids:
+            entry = self.cache.get(user_id)
+            if entry is not None and entry[1] > now:
+                profiles[user_id] = entry[0]
+            else:
+                missing.add(user_id)
+        if missing:
+            found = self.storage.get_user_profiles(missing)
+            for user_id, profile in found.items():
+                self.cache.put(user_id, (profile, now + self.ttl))
+            profiles.update(found)
+        return profiles
+
+    def get(self, user_id):
+        return self.resolve((user_id,)).get(user_id)
+
+    def username(self, user_id, default='Unknown'):
+        profile = self.get(user_id)
+        return profile['username'] if profile else default
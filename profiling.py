@@ -0,0 +1,85 @@
+import cProfile
+import hmac
+import io
+import logging
+import os
+import pstats
+import random
+import re
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class RequestProfiler:
+    # Opt-in cProfile of single requests. Off unless PROFILE_DIR is set.
+    # Then a request is profiled when it sends "X-Profile: <PROFILE_TOKEN>"
+    # (ignored while no token is configured) or is picked at
+    # PROFILE_SAMPLE_RATE (0-1). Its stats are kept if it ran for at least
+    # PROFILE_SLOW_MS; header requests are always kept. Each dump is a .prof
+    # (snakeviz, or flameprof for a flame graph) plus a .txt of the top
+    # functions by cumulative time; only the newest PROFILE_MAX_DUMPS are kept.
+    #
+    # cProfile only sees the thread that started it, i.e. the request's own
+    # work, not other requests running beside it.
+    def __init__(self, directory=None, sample_rate=None, slow_ms=None, token=None, max_dumps=None):
+        self.directory = directory if directory is not None else os.environ.get('PROFILE_DIR')
+        self.sample_rate = sample_rate if sample_rate is not None else float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+        self.slow_ms = slow_ms if slow_ms is not None else float(os.environ.get('PROFILE_SLOW_MS', 500))
+        self.token = token if token is not None else os.environ.get('PROFILE_TOKEN', '')
+        self.max_dumps = max_dumps if max_dumps is not None else int(os.environ.get('PROFILE_MAX_DUMPS', 100))
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def requested(self, header):
+        # Whether an X-Profile header value asks for (and may have) a profile
+        return bool(self.token and header) and hmac.compare_digest(header.encode('utf-8'), self.token.encode('utf-8'))
+
+    def start(self, requested):
+        # Returns (profile, forced) or None when this request isn't profiled
+        if not self.directory:
+            return None
+        if not requested and not (self.sample_rate and random.random() < self.sample_rate):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already running in this process
+            return None
+        return profile, requested
+
+    def finish(self, started, elapsed, label):
+        # Returns the dump's path (without extension), or None if nothing was written
+        if started is None:
+            return None
+        profile, forced = started
+        profile.disable()
+        if not forced and elapsed * 1000 < self.slow_ms:
+            return None
+
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', label)[:80]
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(elapsed * 1000)}ms-{slug}-{uuid.uuid4().hex[:6]}"
+        path = os.path.join(self.directory, name)
+        profile.dump_stats(path + '.prof')
+        summary = io.StringIO()
+        stats = pstats.Stats(profile, stream=summary)
+        stats.sort_stats('cumulative').print_stats(40)
+        with open(path + '.txt', 'w') as f:
+            f.write(f"{label} took {elapsed * 1000:.1f}ms\n")
+            f.write(summary.getvalue())
+        logger.info(f"Profiled {label} ({elapsed * 1000:.1f}ms) to {path}.prof")
+        self.prune()
+        return path
+
+    def prune(self):
+        # Deletes the oldest dumps past max_dumps
+        dumps = sorted((entry.stat().st_mtime_ns, entry.path[:-len('.prof')])
+                       for entry in os.scandir(self.directory) if entry.name.endswith('.prof'))
+        for _, path in dumps[:max(len(dumps) - self.max_dumps, 0)]:
+            for extension in ('.prof', '.txt'):
+                try:
+                    os.remove(path + extension)
+                except FileNotFoundError:
+                    pass
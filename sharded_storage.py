@@ -0,0 +1,327 @@
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from urllib.parse import quote, unquote
+
+from cache import LRUCache
+from locks import FileLock, LockTable, SharedLock
+from metrics import REGISTRY
+from storage import JsonStorage, budget_index_fields, fsync_directory, rebuild_budget_rollups
+from transactions import json_default
+
+FLUSH_SECONDS = REGISTRY.histogram('budget_storage_write_seconds', "Time spent persisting changes",
+                                   backend='sharded', operation='flush')
+RECORD_WRITTEN = REGISTRY.counter('budget_storage_written_bytes_total', "Bytes written by storage backends",
+                                  backend='sharded', file='record')
+
+
+def write_json_atomic(path, data):
+    # Returns the number of bytes written
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    text = json.dumps(data, separators=(',', ':'), default=json_default)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_directory(os.path.dirname(path))
+    return len(text)
+
+
+def hashed_dir(root, key):
+    # Two levels of 256 directories keep every directory small
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(root, digest[:2], digest[2:4])
+
+
+class RecordShard:
+    # One kind of record ('budget' or 'user'), one JSON file per record. The
+    # mapping methods are the ones JsonStorage uses on its budgets/users
+    # dicts. Loaded records sit in an LRU capped by their file sizes; records
+    # being written are pinned in `dirty` until they are on disk.
+    def __init__(self, storage, kind, cache_bytes, on_load=None, on_evict=None, index_fields=None):
+        self.storage = storage
+        self.kind = kind
+        self.directory = os.path.join(storage.root, kind + 's')
+        self.on_load = on_load
+        self.index_fields = index_fields
+        self.cache = LRUCache(cache_bytes, on_evict=on_evict)
+        self.dirty = {}
+
+    def path(self, key):
+        return os.path.join(hashed_dir(self.directory, key), quote(key, safe='') + '.json')
+
+    def get(self, key, default=None):
+        record = self.dirty.get(key)
+        if record is None:
+            record = self.cache.get(key)
+        if record is None:
+            record = self.load(key)
+        return default if record is None else record
+
+    def load(self, key):
+        # Under the record lock, so a write in progress finishes first
+        with self.storage.locks.hold((self.kind, key)):
+            record = self.dirty.get(key) or self.cache.get(key)
+            if record is not None:
+                return record
+            try:
+                with open(self.path(key), 'r') as f:
+                    text = f.read()
+            except FileNotFoundError:
+                return None
+            record = json.loads(text)
+            if self.on_load is not None:
+                self.on_load(key, record)
+            self.cache.put(key, record, len(text))
+            return record
+
+    def summary_path(self, key):
+        return self.path(key)[:-len('.json')] + '.summary'
+
+    def fields(self, key):
+        # From the record if it's in memory, else from its .summary sidecar:
+        # index_fields() of the record, written next to it on every flush, so
+        # listing a user's budgets doesn't parse their transactions. The
+        # sidecar is only trusted when it's no older than the record; one
+        # left stale (a crash between the two writes) or missing (an older
+        # layout) is rebuilt from the record.
+        record = self.dirty.get(key) or self.cache.get(key)
+        if record is None:
+            try:
+                record_written = os.stat(self.path(key)).st_mtime_ns
+                with open(self.summary_path(key), 'r') as f:
+                    if os.fstat(f.fileno()).st_mtime_ns >= record_written:
+                        return json.loads(f.read())
+            except (FileNotFoundError, ValueError):
+                pass
+            with self.storage.locks.hold((self.kind, key)):
+                record = self[key]
+                if key not in self.dirty:
+                    self.write_summary(key, record)
+        return self.index_fields(record)
+
+    def write_summary(self, key, record):
+        # Not fsynced: a summary lost or left stale by a crash fails the
+        # check in fields() and is rebuilt from the record
+        if self.index_fields is None:
+            return
+        path = self.summary_path(key)
+        with open(path + '.tmp', 'w') as f:
+            f.write(json.dumps(self.index_fields(record), separators=(',', ':')))
+        os.replace(path + '.tmp', path)
+
+    def pin(self, key):
+        if key not in self.dirty:
+            record = self.get(key)
+            if record is not None:
+                self.dirty[key] = record
+
+    def flush(self, key):
+        with self.storage.locks.hold((self.kind, key)):
+            record = self.dirty.get(key)
+            if record is None:
+                return
+            with FLUSH_SECONDS.timer():
+                size = write_json_atomic(self.path(key), record)
+                self.write_summary(key, record)
+            RECORD_WRITTEN.inc(size)
+            del self.dirty[key]
+            self.cache.put(key, record, size)
+
+    def write(self, key, record):
+        write_json_atomic(self.path(key), record)
+        self.write_summary(key, record)
+
+    def __getitem__(self, key):
+        record = self.get(key)
+        if record is None:
+            raise KeyError(key)
+        return record
+
+    def __setitem__(self, key, record):
+        # New records are pinned until the commit writes them
+        self.dirty[key] = record
+
+    def __contains__(self, key):
+        return key in self.dirty or key in self.cache or os.path.exists(self.path(key))
+
+    def __iter__(self):
+        # Every stored key; walks the whole tree, so only for maintenance
+        seen = set(self.dirty)
+        yield from list(seen)
+        for folder, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.json'):
+                    key = unquote(name[:-5])
+                    if key not in seen:
+                        yield key
+
+
+class ShardedStorage(JsonStorage):
+    # Every budget and user in its own file under a hashed directory tree,
+    # loaded on first use and written back one file per change. Startup
+    # reads nothing; memory is bounded by the LRU caps, not the dataset.
+    #
+    # Reads and the in-memory bookkeeping are JsonStorage's; this class only
+    # swaps the budgets/users dicts for RecordShards and the snapshot plus
+    # journal for per-record writes. A change touching two records (e.g. a
+    # new budget and its owner's list) writes the budget first.
+    def __init__(self, root="budgets_shards", cache_bytes=64 * 1024 * 1024, user_cache_bytes=8 * 1024 * 1024):
+        self.root = root
+        self.batch_depth = 0
+        self.commit_lock = SharedLock()
+        self.locks = LockTable()
+        self.local = threading.local()
+        self.date_orders = {}
+        self.stale_orders = set()
+        self.archived_heads = {}
+        self.budgets = RecordShard(self, 'budget', cache_bytes, self._budget_loaded, self._budget_evicted,
+                                   budget_index_fields)
+        self.users = RecordShard(self, 'user', user_cache_bytes)
+        self.shards = {'budget': self.budgets, 'user': self.users}
+        self.archive_dir = os.path.join(root, 'archive')
+        self.segment_cache = LRUCache(int(os.environ.get('ARCHIVE_CACHE_ROWS', 100000)))
+        os.makedirs(root, exist_ok=True)
+        self.file_lock = FileLock(os.path.join(root, '.lock'))
+
+    def _budget_evicted(self, budget_id, budget):
+        # Anyone still holding the dict rebuilds its order on the next read
+        self.date_orders.pop(budget_id, None)
+        self.archived_heads.pop(budget_id, None)
+        self.stale_orders.add(budget_id)
+
+    def load_data(self):
+        pass
+
+    def save_data(self):
+        for kind, shard in self.shards.items():
+            for key in list(shard.dirty):
+                shard.flush(key)
+
+    def close(self):
+        self.save_data()
+        self.file_lock.release()
+
+    @contextmanager
+    def batch(self):
+        # Records changed inside the batch are written once, when this
+        # thread's outermost batch ends
+        depth = getattr(self.local, 'depth', 0)
+        if not depth:
+            self.local.pending = set()
+        self.local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self.local.depth = depth
+            if not depth:
+                for kind, key in sorted(self.local.pending):
+                    self.shards[kind].flush(key)
+
+    def _maybe_compact(self):
+        pass
+
+    def _commit(self, record):
+        keys = record_keys(record)
+        for kind, key in keys:
+            self.shards[kind].pin(key)
+        self._apply(record)
+        if getattr(self.local, 'depth', 0):
+            self.local.pending.update(keys)
+        else:
+            for kind, key in keys:
+                self.shards[kind].flush(key)
+
+    def find_user_by_email(self, email):
+        return self._find_user('email', email)
+
+    def find_user_by_username(self, username):
+        return self._find_user('username', username)
+
+    def _find_user(self, field, value):
+        try:
+            with open(self._index_path(field, value), 'r') as f:
+                user_id = f.read()
+        except FileNotFoundError:
+            return None, None
+        user = self.users.get(user_id)
+        return (user_id, user) if user is not None else (None, None)
+
+    def _index_path(self, field, value):
+        value = value.lower()
+        return os.path.join(hashed_dir(os.path.join(self.root, 'index', field), value),
+                            hashlib.sha1(value.encode('utf-8')).hexdigest())
+
+    def _index_user(self, user_id, user_data):
+        # First writer wins, like the dict index's setdefault
+        for field in ('email', 'username'):
+            path = self._index_path(field, user_data.get(field, ''))
+            if os.path.exists(path):
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'w') as f:
+                f.write(user_id)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + '.tmp', path)
+
+    def rebuild_rollups(self, budget_id=None):
+        for current_id in ([budget_id] if budget_id else list(self.budgets)):
+            with self.writing(('budget', current_id)):
+                self.budgets.pin(current_id)
+                rebuild_budget_rollups(self.budgets[current_id])
+                self.budgets.flush(current_id)
+
+    def archive_transactions(self, before, budget_id=None):
+        # One budget at a time, each written back as soon as it is done
+        changed = moved = 0
+        for current_id in ([budget_id] if budget_id else list(self.budgets)):
+            if not self._archivable(self.budgets[current_id], before):
+                continue
+            with self.writing(('budget', current_id)):
+                self.budgets.pin(current_id)
+                count = self._archivable(self.budgets[current_id], before)
+                if count:
+                    self._archive_budget(current_id, count)
+                    changed += 1
+                    moved += count
+                self.budgets.flush(current_id)
+        return changed, moved
+
+    def import_json(self, source):
+        # Copy every user and budget out of a loaded JsonStorage. Archived
+        # transactions come along as ordinary ones; their segments are
+        # under the source's directory, not ours.
+        for user_id, user in source.users.items():
+            self.users.write(user_id, user)
+            self._index_user(user_id, user)
+        for budget_id, budget in source.budgets.items():
+            record = dict(budget, transactions=list(budget['transactions']))
+            record.pop('archive', None)
+            self.budgets.write(budget_id, record)
+        return len(source.users), len(source.budgets)
+
+
+def record_keys(record):
+    # The (kind, key) records a journal-style record changes, budget first
+    op = record['op']
+    if op == 'register_user' or op == 'set_password_hash':
+        return [('user', record['user_id'])]
+    if op == 'create_budget':
+        return [('budget', record['budget']['id']), ('user', record['budget']['owner'])]
+    if op == 'add_collaborator':
+        return [('budget', record['budget_id']), ('user', record['user_id'])]
+    return [('budget', record['budget_id'])]
+
+
+def migrate_json_to_sharded(root="budgets_shards", data_file="budgets_data.json",
+                            users_file="users_data.json", journal_file="budgets_journal.log"):
+    source = JsonStorage(data_file, users_file, journal_file)
+    try:
+        return ShardedStorage(root).import_json(source)
+    finally:
+        source.close()
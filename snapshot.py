@@ -0,0 +1,164 @@
+import json
+import mmap
+import os
+import threading
+from collections.abc import MutableMapping
+
+from transactions import json_default
+
+
+def index_path(path):
+    return path + '.idx'
+
+
+class SnapshotFile:
+    # A snapshot written by LazyRecords.save(), memory-mapped, with the byte
+    # range of every record's value taken from the .idx file beside it.
+    # Opening one reads the index only; no record is parsed.
+    def __init__(self, path, entries):
+        self.path = path
+        # key -> [start, end, *index fields]
+        self.entries = {entry[0]: entry[1:] for entry in entries}
+        self.map = None
+        if self.entries:
+            with open(path, 'rb') as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @classmethod
+    def open(cls, path):
+        # None unless the .idx exists and was written for this exact file
+        try:
+            with open(index_path(path), 'r') as f:
+                index = json.load(f)
+            stat = os.stat(path)
+        except (OSError, ValueError):
+            return None
+        if index.get('size') != stat.st_size or index.get('mtime_ns') != stat.st_mtime_ns:
+            return None
+        return cls(path, index['entries'])
+
+    def raw(self, key):
+        start, end = self.entries[key][:2]
+        return self.map[start:end]
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+
+class LazyRecords(MutableMapping):
+    # Stands in for JsonStorage's budgets or users dict. Records still in
+    # the snapshot are parsed, passed to on_load and moved into `loaded` the
+    # first time they are read; after that they behave like dict values.
+    # index_fields(record) gives extra values kept in the .idx (e.g. a
+    # user's email) so they can be read without parsing the record.
+    def __init__(self, snapshot=None, on_load=None, index_fields=None):
+        self.snapshot = snapshot
+        self.loaded = {}
+        self.on_load = on_load
+        self.index_fields = index_fields
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        record = self.loaded.get(key)
+        if record is None:
+            record = self.load(key)
+        return default if record is None else record
+
+    def load(self, key):
+        with self.lock:
+            record = self.loaded.get(key)
+            if record is not None:
+                return record
+            if self.snapshot is None or key not in self.snapshot.entries:
+                return None
+            record = json.loads(self.snapshot.raw(key))
+            if self.on_load is not None:
+                self.on_load(key, record)
+            self.loaded[key] = record
+            return record
+
+    def load_all(self):
+        for key in list(self):
+            self.load(key)
+
+    def fields(self, key):
+        record = self.loaded.get(key)
+        if record is not None:
+            return self.index_fields(record)
+        fields = self.snapshot.entries[key][2:]
+        if not fields:
+            # An .idx written before these fields were kept
+            return self.index_fields(self.load(key))
+        return fields
+
+    def __getitem__(self, key):
+        record = self.get(key)
+        if record is None:
+            raise KeyError(key)
+        return record
+
+    def __setitem__(self, key, record):
+        self.loaded[key] = record
+
+    def __delitem__(self, key):
+        with self.lock:
+            found = self.loaded.pop(key, None) is not None
+            if self.snapshot is not None and self.snapshot.entries.pop(key, None) is not None:
+                found = True
+        if not found:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.loaded or (self.snapshot is not None and key in self.snapshot.entries)
+
+    def __iter__(self):
+        # Snapshot order, then records added since
+        entries = self.snapshot.entries if self.snapshot is not None else {}
+        yield from list(entries)
+        yield from [key for key in list(self.loaded) if key not in entries]
+
+    def __len__(self):
+        entries = self.snapshot.entries if self.snapshot is not None else {}
+        return len(entries) + sum(1 for key in list(self.loaded) if key not in entries)
+
+    def save(self, path):
+        # Write every record as one JSON object plus its .idx and switch to
+        # the new file. Records never loaded are copied over byte for byte.
+        # Callers keep writers out (see JsonStorage._save_snapshot); readers
+        # may keep loading from the old file until the switch.
+        entries = []
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            position = f.write(b'{')
+            for key in self:
+                record = self.loaded.get(key)
+                if record is None:
+                    value = self.snapshot.raw(key)
+                    fields = self.snapshot.entries[key][2:]
+                else:
+                    # dumps() takes the C encoder; dump() never does
+                    value = json.dumps(record, separators=(',', ':'), default=json_default).encode('utf-8')
+                    fields = self.index_fields(record) if self.index_fields else []
+                position += f.write((b',' if entries else b'') + json.dumps(key).encode('utf-8') + b':')
+                entries.append([key, position, position + len(value)] + list(fields))
+                position += f.write(value)
+            f.write(b'}')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+        stat = os.stat(path)
+        with open(index_path(path) + '.tmp', 'w') as f:
+            f.write(json.dumps({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'entries': entries},
+                               separators=(',', ':')))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(index_path(path) + '.tmp', index_path(path))
+
+        with self.lock:
+            if self.snapshot is not None:
+                self.snapshot.close()
+            self.snapshot = SnapshotFile(path, entries)
+        return stat.st_size
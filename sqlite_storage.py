@@ -0,0 +1,517 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from metrics import REGISTRY
+from storage import (PAGE_SCAN_FACTOR, ROLLUP_GRANULARITIES, StorageBackend, UserExists, add_to_rollups,
+                     empty_rollups, transaction_matches)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    email TEXT NOT NULL,
+    username TEXT NOT NULL,
+    password_hash TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS users_email ON users (email);
+CREATE UNIQUE INDEX IF NOT EXISTS users_username ON users (username COLLATE NOCASE);
+
+CREATE TABLE IF NOT EXISTS budgets (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    owner_id TEXT NOT NULL REFERENCES users (id),
+    budget REAL NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    income_total REAL NOT NULL DEFAULT 0,
+    expense_total REAL NOT NULL DEFAULT 0,
+    transaction_count INTEGER NOT NULL DEFAULT 0,
+    last_modified TEXT,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS budgets_owner ON budgets (owner_id);
+
+CREATE TABLE IF NOT EXISTS collaborators (
+    budget_id TEXT NOT NULL REFERENCES budgets (id),
+    user_id TEXT NOT NULL REFERENCES users (id),
+    PRIMARY KEY (budget_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS collaborators_user ON collaborators (user_id);
+
+CREATE TABLE IF NOT EXISTS transactions (
+    budget_id TEXT NOT NULL REFERENCES budgets (id),
+    seq INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    type TEXT,
+    amount REAL NOT NULL,
+    description TEXT NOT NULL,
+    added_by TEXT,
+    PRIMARY KEY (budget_id, seq)
+);
+CREATE INDEX IF NOT EXISTS transactions_budget_date ON transactions (budget_id, date, seq);
+
+CREATE TABLE IF NOT EXISTS rollups (
+    budget_id TEXT NOT NULL REFERENCES budgets (id),
+    granularity TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    income REAL NOT NULL DEFAULT 0,
+    expense REAL NOT NULL DEFAULT 0,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (budget_id, granularity, bucket)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS user_rollups (
+    budget_id TEXT NOT NULL REFERENCES budgets (id),
+    month TEXT NOT NULL,
+    added_by TEXT NOT NULL,
+    income REAL NOT NULL DEFAULT 0,
+    expense REAL NOT NULL DEFAULT 0,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (budget_id, month, added_by)
+) WITHOUT ROWID;
+"""
+
+# Columns added after the first release of the schema, with their DDL
+BUDGET_AGGREGATE_COLUMNS = {
+    'income_total': 'REAL NOT NULL DEFAULT 0',
+    'expense_total': 'REAL NOT NULL DEFAULT 0',
+    'transaction_count': 'INTEGER NOT NULL DEFAULT 0',
+    'last_modified': 'TEXT',
+    'version': 'INTEGER NOT NULL DEFAULT 0',
+}
+
+TRANSACTION_SECONDS = REGISTRY.histogram('budget_storage_write_seconds', "Time spent persisting changes",
+                                         backend='sqlite', operation='transaction')
+BATCH_SECONDS = REGISTRY.histogram('budget_storage_write_seconds', "Time spent persisting changes",
+                                   backend='sqlite', operation='batch')
+
+# Ids per IN (...) query; older SQLite builds allow 999 bound parameters
+IN_QUERY_CHUNK = 500
+
+
+class SQLiteStorage(StorageBackend):
+    # Normalized tables in one SQLite file. WAL mode lets several worker
+    # processes read while one writes, so nothing is cached in-process.
+    def __init__(self, path="budgets.db"):
+        self.path = path
+        self.local = threading.local()
+        self.connections = []
+        self.connections_lock = threading.Lock()
+        self.upgrade_schema()
+
+    def upgrade_schema(self):
+        conn = self.connection()
+        had_rollups = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'rollups'").fetchone()
+        conn.executescript(SCHEMA)
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(budgets)')}
+        missing = [name for name in BUDGET_AGGREGATE_COLUMNS if name not in columns]
+        if missing:
+            with conn:
+                for name in missing:
+                    conn.execute(f'ALTER TABLE budgets ADD COLUMN {name} {BUDGET_AGGREGATE_COLUMNS[name]}')
+            self.rebuild_aggregates()
+        if not had_rollups:
+            # Databases created before the rollup tables existed get them backfilled once
+            self.rebuild_rollups()
+
+    def rebuild_aggregates(self):
+        with self.transaction() as conn:
+            conn.execute(
+                """UPDATE budgets SET
+                       income_total = (SELECT COALESCE(SUM(amount), 0) FROM transactions t
+                                       WHERE t.budget_id = budgets.id AND t.type = 'income'),
+                       expense_total = (SELECT COALESCE(SUM(amount), 0) FROM transactions t
+                                        WHERE t.budget_id = budgets.id AND t.type IS NOT 'income'),
+                       transaction_count = (SELECT COUNT(*) FROM transactions t WHERE t.budget_id = budgets.id),
+                       last_modified = MAX(created_at, COALESCE((SELECT MAX(date) FROM transactions t
+                                                                 WHERE t.budget_id = budgets.id), ''))""")
+
+    def connection(self):
+        # One connection per thread, reused for every request it serves
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self.local.conn = conn
+            with self.connections_lock:
+                self.connections.append(conn)
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        # Commits on exit unless an enclosing batch() owns the transaction
+        conn = self.connection()
+        if getattr(self.local, 'batch_depth', 0):
+            yield conn
+        else:
+            with TRANSACTION_SECONDS.timer(), conn:
+                yield conn
+
+    @contextmanager
+    def batch(self):
+        conn = self.connection()
+        depth = getattr(self.local, 'batch_depth', 0)
+        self.local.batch_depth = depth + 1
+        try:
+            if depth:
+                yield
+            else:
+                with BATCH_SECONDS.timer(), conn:
+                    yield
+        finally:
+            self.local.batch_depth = depth
+
+    def close(self):
+        with self.connections_lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections = []
+        self.local = threading.local()
+
+    def get_user(self, user_id):
+        row = self.connection().execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+        return self._user(row)
+
+    def get_user_profiles(self, user_ids):
+        user_ids = list(user_ids)
+        conn = self.connection()
+        profiles = {}
+        # Chunked to stay under SQLite's bound-parameter limit
+        for start in range(0, len(user_ids), IN_QUERY_CHUNK):
+            chunk = user_ids[start:start + IN_QUERY_CHUNK]
+            rows = conn.execute(f"SELECT id, username, email FROM users WHERE id IN ({','.join('?' * len(chunk))})",
+                                chunk)
+            for row in rows:
+                profiles[row['id']] = {'username': row['username'], 'email': row['email']}
+        return profiles
+
+    def find_user_by_email(self, email):
+        row = self.connection().execute('SELECT * FROM users WHERE email = ?', (email.lower(),)).fetchone()
+        return (row['id'], self._user(row)) if row else (None, None)
+
+    def find_user_by_username(self, username):
+        row = self.connection().execute(
+            'SELECT * FROM users WHERE username = ? COLLATE NOCASE', (username,)).fetchone()
+        return (row['id'], self._user(row)) if row else (None, None)
+
+    def create_user(self, user_id, user):
+        # The unique indexes catch a registration that raced past
+        # register_user's checks, e.g. from another process
+        try:
+            with self.transaction() as conn:
+                conn.execute(
+                    'INSERT INTO users (id, email, username, password_hash, created_at) VALUES (?, ?, ?, ?, ?)',
+                    (user_id, user['email'], user['username'], user['password_hash'], user['created_at']))
+        except sqlite3.IntegrityError as error:
+            raise UserExists('email' if 'users.email' in str(error) else 'username')
+
+    def set_password_hash(self, user_id, password_hash):
+        with self.transaction() as conn:
+            conn.execute('UPDATE users SET password_hash = ? WHERE id = ?', (password_hash, user_id))
+
+    def get_budget(self, budget_id):
+        conn = self.connection()
+        row = conn.execute('SELECT * FROM budgets WHERE id = ?', (budget_id,)).fetchone()
+        return self._budget(conn, row)
+
+    def user_budgets(self, user_id):
+        conn = self.connection()
+        rows = conn.execute(
+            """SELECT b.*, 'owner' AS role FROM budgets b WHERE b.owner_id = ?
+               UNION ALL
+               SELECT b.*, 'collaborator' AS role FROM collaborators c
+               JOIN budgets b ON b.id = c.budget_id WHERE c.user_id = ?""",
+            (user_id, user_id)).fetchall()
+        return [(self._budget(conn, row), row['role']) for row in rows]
+
+    def budget_summaries(self, user_id):
+        # The stored aggregates make this one query, with no transaction rows read
+        conn = self.connection()
+        rows = conn.execute(
+            """SELECT b.*, 'owner' AS role FROM budgets b WHERE b.owner_id = ?
+               UNION ALL
+               SELECT b.*, 'collaborator' AS role FROM collaborators c
+               JOIN budgets b ON b.id = c.budget_id WHERE c.user_id = ?""",
+            (user_id, user_id)).fetchall()
+        collaborators = {}
+        budget_ids = [row['id'] for row in rows]
+        for start in range(0, len(budget_ids), IN_QUERY_CHUNK):
+            chunk = budget_ids[start:start + IN_QUERY_CHUNK]
+            for budget_id, collaborator_id in conn.execute(
+                    f"""SELECT budget_id, user_id FROM collaborators
+                        WHERE budget_id IN ({','.join('?' * len(chunk))}) ORDER BY rowid""", chunk):
+                collaborators.setdefault(budget_id, []).append(collaborator_id)
+        return [{
+            'id': row['id'],
+            'role': row['role'],
+            'name': row['name'],
+            'owner': row['owner_id'],
+            'collaborators': collaborators.get(row['id'], []),
+            'budget': row['budget'],
+            'balance': row['budget'] + row['income_total'] - row['expense_total'],
+            'transaction_count': row['transaction_count'],
+            'last_modified': row['last_modified'],
+            'version': row['version']
+        } for row in rows]
+
+    def budget_versions(self, user_id):
+        rows = self.connection().execute(
+            """SELECT id, version, last_modified FROM budgets WHERE owner_id = ?
+               UNION ALL
+               SELECT b.id, b.version, b.last_modified FROM collaborators c
+               JOIN budgets b ON b.id = c.budget_id WHERE c.user_id = ?""",
+            (user_id, user_id)).fetchall()
+        return [tuple(row) for row in rows]
+
+    def create_budget(self, budget):
+        with self.transaction() as conn:
+            conn.execute(
+                'INSERT INTO budgets (id, name, owner_id, budget, created_at, last_modified) VALUES (?, ?, ?, ?, ?, ?)',
+                (budget['id'], budget['name'], budget['owner'], budget['budget'], budget['created_at'],
+                 budget['created_at']))
+
+    def set_budget_amount(self, budget_id, amount):
+        with self.transaction() as conn:
+            conn.execute('UPDATE budgets SET budget = ?, last_modified = ?, version = version + 1 WHERE id = ?',
+                         (amount, datetime.now().strftime("%Y-%m-%d %H:%M"), budget_id))
+
+    def add_collaborator(self, budget_id, user_id):
+        with self.transaction() as conn:
+            inserted = conn.execute('INSERT OR IGNORE INTO collaborators (budget_id, user_id) VALUES (?, ?)',
+                                    (budget_id, user_id)).rowcount
+            if inserted:
+                conn.execute('UPDATE budgets SET version = version + 1 WHERE id = ?', (budget_id,))
+
+    def add_transaction(self, budget_id, transaction):
+        # seq is assigned inside the INSERT so concurrent writers in other
+        # processes can't hand out the same position
+        with self.transaction() as conn:
+            conn.execute(
+                """INSERT INTO transactions (budget_id, seq, date, type, amount, description, added_by)
+                   SELECT ?, COALESCE(MAX(seq) + 1, 0), ?, ?, ?, ?, ?
+                   FROM transactions WHERE budget_id = ?""",
+                (budget_id, transaction['date'], transaction['type'], transaction['amount'],
+                 transaction['description'], transaction.get('added_by'), budget_id))
+            income = transaction['type'] == 'income'
+            conn.execute(
+                """UPDATE budgets SET income_total = income_total + ?, expense_total = expense_total + ?,
+                       transaction_count = transaction_count + 1, version = version + 1,
+                       last_modified = MAX(COALESCE(last_modified, ''), ?) WHERE id = ?""",
+                (transaction['amount'] if income else 0, 0 if income else transaction['amount'],
+                 transaction['date'], budget_id))
+            self._add_rollups(conn, budget_id, [transaction])
+
+    def add_transactions(self, budget_id, transactions):
+        with self.transaction() as conn:
+            # The UPDATE takes the write lock before seq is read
+            income = sum(t['amount'] for t in transactions if t['type'] == 'income')
+            expense = sum(t['amount'] for t in transactions if t['type'] != 'income')
+            conn.execute(
+                """UPDATE budgets SET income_total = income_total + ?, expense_total = expense_total + ?,
+                       transaction_count = transaction_count + ?, version = version + 1,
+                       last_modified = MAX(COALESCE(last_modified, ''), ?) WHERE id = ?""",
+                (income, expense, len(transactions), max(t['date'] for t in transactions), budget_id))
+            first = conn.execute('SELECT COALESCE(MAX(seq) + 1, 0) FROM transactions WHERE budget_id = ?',
+                                 (budget_id,)).fetchone()[0]
+            conn.executemany(
+                """INSERT INTO transactions (budget_id, seq, date, type, amount, description, added_by)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                [(budget_id, first + i, t['date'], t['type'], t['amount'], t['description'], t.get('added_by'))
+                 for i, t in enumerate(transactions)])
+            self._add_rollups(conn, budget_id, transactions)
+
+    def recent_transactions(self, budget_id, limit):
+        rows = self.connection().execute(
+            """SELECT date, type, amount, description, added_by FROM transactions
+               WHERE budget_id = ? ORDER BY date DESC, seq DESC LIMIT ?""",
+            (budget_id, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def transactions_since(self, budget_id, seq, limit):
+        rows = self.connection().execute(
+            """SELECT seq, date, type, amount, description, added_by FROM transactions
+               WHERE budget_id = ? AND seq >= ? ORDER BY seq LIMIT ?""",
+            (budget_id, seq, limit)).fetchall()
+        return [(row['seq'], {key: row[key] for key in ('date', 'type', 'amount', 'description', 'added_by')})
+                for row in rows]
+
+    def page_transactions(self, budget_id, before, limit, filters):
+        # Walks the (budget_id, date, seq) index newest first. Residual
+        # filters are bounded by the same scan budget as the JSON backend.
+        where = ['budget_id = ?']
+        params = [budget_id]
+        if before is not None:
+            where.append('(date, seq) < (?, ?)')
+            params.extend(before)
+        if filters.get('date_from'):
+            where.append('date >= ?')
+            params.append(filters['date_from'])
+        if filters.get('date_to'):
+            where.append('date <= ?')
+            params.append(filters['date_to'] + '\uffff')
+        scan_limit = max(limit, 1) * PAGE_SCAN_FACTOR + 1
+        rows = self.connection().execute(
+            f"""SELECT seq, date, type, amount, description, added_by FROM transactions
+                WHERE {' AND '.join(where)} ORDER BY date DESC, seq DESC LIMIT ?""",
+            params + [scan_limit]).fetchall()
+
+        page = []
+        last = None
+        for row in rows:
+            if len(page) >= limit:
+                return page, last
+            last = (row['date'], row['seq'])
+            transaction = {k: row[k] for k in ('date', 'type', 'amount', 'description', 'added_by')}
+            if transaction_matches(transaction, filters):
+                page.append(transaction)
+        # A full scan budget means there may be older rows left
+        return page, (last if len(rows) == scan_limit else None)
+
+    def iter_transactions(self, budget_id, date_from=None, date_to=None):
+        where = ['budget_id = ?']
+        params = [budget_id]
+        if date_from:
+            where.append('date >= ?')
+            params.append(date_from)
+        if date_to:
+            where.append('date <= ?')
+            params.append(date_to + '\uffff')
+        cursor = self.connection().execute(
+            f"""SELECT date, type, amount, description, added_by FROM transactions
+                WHERE {' AND '.join(where)} ORDER BY date, seq""", params)
+        while True:
+            rows = cursor.fetchmany(500)
+            if not rows:
+                return
+            for row in rows:
+                yield dict(row)
+
+    def get_rollups(self, budget_id, granularity, start=None, end=None):
+        rows = self.connection().execute(
+            """SELECT bucket, income, expense, count FROM rollups
+               WHERE budget_id = ? AND granularity = ? AND bucket >= ? AND bucket <= ? ORDER BY bucket""",
+            (budget_id, granularity, start or '', end or '\uffff')).fetchall()
+        return [tuple(row) for row in rows]
+
+    def get_user_rollups(self, budget_id, start_month=None, end_month=None):
+        rows = self.connection().execute(
+            """SELECT added_by, SUM(income), SUM(expense), SUM(count) FROM user_rollups
+               WHERE budget_id = ? AND month >= ? AND month <= ? GROUP BY added_by ORDER BY added_by""",
+            (budget_id, start_month or '', end_month or '\uffff')).fetchall()
+        return [tuple(row) for row in rows]
+
+    def rebuild_rollups(self, budget_id=None):
+        if budget_id:
+            budget_ids = [budget_id]
+        else:
+            budget_ids = [row[0] for row in self.connection().execute('SELECT id FROM budgets')]
+        for current_id in budget_ids:
+            with self.transaction() as conn:
+                conn.execute('DELETE FROM rollups WHERE budget_id = ?', (current_id,))
+                conn.execute('DELETE FROM user_rollups WHERE budget_id = ?', (current_id,))
+                self._add_rollups(conn, current_id, self.iter_transactions(current_id))
+
+    def _add_rollups(self, conn, budget_id, transactions):
+        # Fold the transactions into bucket totals first, then upsert once per bucket
+        rollups = empty_rollups()
+        for transaction in transactions:
+            add_to_rollups(rollups, transaction)
+        conn.executemany(
+            """INSERT INTO rollups (budget_id, granularity, bucket, income, expense, count) VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT (budget_id, granularity, bucket) DO UPDATE SET income = income + excluded.income,
+               expense = expense + excluded.expense, count = count + excluded.count""",
+            [(budget_id, granularity, bucket, *totals)
+             for granularity in ROLLUP_GRANULARITIES for bucket, totals in rollups[granularity].items()])
+        conn.executemany(
+            """INSERT INTO user_rollups (budget_id, month, added_by, income, expense, count) VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT (budget_id, month, added_by) DO UPDATE SET income = income + excluded.income,
+               expense = expense + excluded.expense, count = count + excluded.count""",
+            [(budget_id, month, added_by, *totals)
+             for added_by, months in rollups['by_user'].items() for month, totals in months.items()])
+
+    def import_data(self, users, budgets):
+        # Bulk load dicts shaped like users_data.json / budgets_data.json
+        with self.transaction() as conn:
+            conn.executemany(
+                """INSERT INTO users (id, email, username, password_hash, created_at) VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT (id) DO UPDATE SET email = excluded.email, username = excluded.username,
+                   password_hash = excluded.password_hash""",
+                [(user_id, user['email'].lower(), user['username'], user['password_hash'], user['created_at'])
+                 for user_id, user in users.items()])
+            for budget_id, budget in budgets.items():
+                conn.execute(
+                    """INSERT INTO budgets (id, name, owner_id, budget, created_at, version) VALUES (?, ?, ?, ?, ?, ?)
+                       ON CONFLICT (id) DO UPDATE SET name = excluded.name, budget = excluded.budget,
+                       version = budgets.version + 1""",
+                    (budget_id, budget['name'], budget['owner'], budget['budget'], budget['created_at'],
+                     budget.get('version', 0)))
+                conn.executemany(
+                    'INSERT OR IGNORE INTO collaborators (budget_id, user_id) VALUES (?, ?)',
+                    [(budget_id, user_id) for user_id in budget['collaborators'] if user_id in users])
+                conn.execute('DELETE FROM transactions WHERE budget_id = ?', (budget_id,))
+                conn.executemany(
+                    """INSERT INTO transactions (budget_id, seq, date, type, amount, description, added_by)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                    [(budget_id, seq, t['date'], t['type'], t['amount'], t['description'], t.get('added_by'))
+                     for seq, t in enumerate(budget['transactions'])])
+        self.rebuild_aggregates()
+        # Changes other than transactions (e.g. a new amount) also stamp
+        # last_modified, and the recount above can't see those
+        with self.transaction() as conn:
+            conn.executemany('UPDATE budgets SET last_modified = MAX(last_modified, ?) WHERE id = ?',
+                             [(budget['last_modified'], budget_id) for budget_id, budget in budgets.items()
+                              if budget.get('last_modified')])
+        self.rebuild_rollups()
+
+    def _user(self, row):
+        if row is None:
+            return None
+        conn = self.connection()
+        owned = conn.execute('SELECT id FROM budgets WHERE owner_id = ? ORDER BY rowid', (row['id'],))
+        shared = conn.execute('SELECT budget_id FROM collaborators WHERE user_id = ? ORDER BY rowid', (row['id'],))
+        return {
+            'email': row['email'],
+            'username': row['username'],
+            'password_hash': row['password_hash'],
+            'budgets': [r[0] for r in owned],
+            'shared_budgets': [r[0] for r in shared],
+            'created_at': row['created_at']
+        }
+
+    def _budget(self, conn, row):
+        if row is None:
+            return None
+        collaborators = conn.execute(
+            'SELECT user_id FROM collaborators WHERE budget_id = ? ORDER BY rowid', (row['id'],))
+        return {
+            'id': row['id'],
+            'name': row['name'],
+            'owner': row['owner_id'],
+            'collaborators': [r[0] for r in collaborators],
+            'budget': row['budget'],
+            'created_at': row['created_at'],
+            'balance': row['budget'] + row['income_total'] - row['expense_total'],
+            'income_total': row['income_total'],
+            'expense_total': row['expense_total'],
+            'transaction_count': row['transaction_count'],
+            'last_modified': row['last_modified'],
+            'version': row['version']
+        }
+
+
+def migrate_json_to_sqlite(db_path="budgets.db", data_file="budgets_data.json",
+                           users_file="users_data.json", journal_file="budgets_journal.log"):
+    # One-shot import of the JSON snapshot (plus any pending journal records)
+    from storage import JsonStorage
+    source = JsonStorage(data_file, users_file, journal_file)
+    try:
+        target = SQLiteStorage(db_path)
+        target.import_data(source.users, source.budgets)
+        target.close()
+    finally:
+        source.close()
+    return len(source.users), len(source.budgets)
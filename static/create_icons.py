@@ -1,33 +1,40 @@
-
-from PIL import Image, ImageDraw
+from PIL import Image, ImageDraw, ImageFont
 import os
 
-def create_icon(size, filename):
-    # Create a simple icon with gradient background
-    img = Image.new('RGB', (size, size), color='white')
+# Every size the web manifest lists; 180 is the apple-touch-icon
+ICON_SIZES = (48, 72, 96, 128, 144, 152, 180, 192, 384, 512)
+
+def icon_name(size):
+    return f'icon-{size}.png'
+
+def gradient(size):
+    # #667eea-ish vertical gradient, built as arrays: one column of red/green
+    # values stretched across, blue constant, instead of a line per row
+    column = bytes(int(102 + (126 - 102) * (i / size)) for i in range(size))
+    channel = Image.frombytes('L', (1, size), column).resize((size, size), Image.NEAREST)
+    return Image.merge('RGB', (channel, channel, Image.new('L', (size, size), 234)))
+
+def create_icon(size, path):
+    img = gradient(size)
     draw = ImageDraw.Draw(img)
-    
-    # Draw gradient-like background
-    for i in range(size):
-        color_val = int(102 + (126 - 102) * (i / size))  # #667eea gradient
-        draw.line([(0, i), (size, i)], fill=(color_val, color_val, 234))
-    
-    # Draw simple dollar sign
+
+    # Dollar sign in a white circle, a third of the icon across
     center = size // 2
-    font_size = size // 3
-    
-    # Draw dollar sign outline
-    draw.ellipse([center-font_size//2, center-font_size//2, 
-                  center+font_size//2, center+font_size//2], 
-                 fill='white', outline='#333', width=3)
-    
-    # Draw $ symbol
-    draw.text((center-font_size//4, center-font_size//3), '$', 
-              fill='#333', anchor='mm')
-    
-    img.save(f'static/{filename}')
-    print(f'Created {filename}')
+    radius = size // 6
+    draw.ellipse([center - radius, center - radius, center + radius, center + radius],
+                 fill='white', outline='#333', width=max(1, size // 64))
+    draw.text((center, center), '$', fill='#333', anchor='mm', font=ImageFont.load_default(size=radius * 1.4))
+
+    img.save(path, optimize=True)
+
+def create_icons(directory='static', sizes=ICON_SIZES):
+    # Returns the file names written, in sizes order
+    names = []
+    for size in sizes:
+        create_icon(size, os.path.join(directory, icon_name(size)))
+        names.append(icon_name(size))
+    return names
 
 if __name__ == '__main__':
-    create_icon(192, 'icon-192.png')
-    create_icon(512, 'icon-512.png')
+    for name in create_icons():
+        print(f'Created {name}')
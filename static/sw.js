@@ -1,28 +1,39 @@
-
-const CACHE_NAME = 'budget-manager-v1';
+// build_assets.py writes a copy of this to static/dist/sw.js with the
+// cache name and precache list filled in from the asset manifest; the
+// hashed files it lists never change, so they are served from the cache.
+// Everything else (pages, API calls) goes to the network.
+const CACHE_NAME = 'budget-manager-dev';
 const urlsToCache = [
-  '/',
-  '/static/manifest.json',
-  '/static/icon-192.png',
-  '/static/icon-512.png'
+  '/static/manifest.json'
 ];
 
 self.addEventListener('install', event => {
   event.waitUntil(
     caches.open(CACHE_NAME)
       .then(cache => cache.addAll(urlsToCache))
+      .then(() => self.skipWaiting())
+  );
+});
+
+self.addEventListener('activate', event => {
+  // Drop the caches of earlier builds
+  event.waitUntil(
+    caches.keys()
+      .then(names => Promise.all(names
+        .filter(name => name.startsWith('budget-manager-') && name !== CACHE_NAME)
+        .map(name => caches.delete(name))))
+      .then(() => self.clients.claim())
   );
 });
 
 self.addEventListener('fetch', event => {
+  const url = new URL(event.request.url);
+  if (event.request.method !== 'GET' || url.origin !== self.location.origin ||
+      !urlsToCache.includes(url.pathname)) {
+    return;
+  }
   event.respondWith(
     caches.match(event.request)
-      .then(response => {
-        if (response) {
-          return response;
-        }
-        return fetch(event.request);
-      }
-    )
+      .then(response => response || fetch(event.request))
   );
 });
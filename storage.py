@@ -0,0 +1,854 @@
+import atexit
+import bisect
+import functools
+import gzip
+import itertools
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime
+from urllib.parse import quote
+
+from cache import LRUCache
+from journal import Journal
+from locks import FileLock, LockTable, SharedLock
+from metrics import BYTE_BUCKETS, REGISTRY
+from snapshot import LazyRecords, SnapshotFile
+from transactions import ArchivedDateOrder, TransactionStore, bisect_order
+
+logger = logging.getLogger(__name__)
+
+COMMIT_SECONDS = REGISTRY.histogram('budget_storage_write_seconds', "Time spent persisting changes",
+                                    backend='json', operation='commit')
+SNAPSHOT_SECONDS = REGISTRY.histogram('budget_storage_write_seconds', "Time spent persisting changes",
+                                      backend='json', operation='snapshot')
+SNAPSHOT_BYTES = REGISTRY.histogram('budget_snapshot_bytes', "Size of each JSON snapshot written", BYTE_BUCKETS)
+JOURNAL_WRITTEN = REGISTRY.counter('budget_storage_written_bytes_total', "Bytes written by storage backends",
+                                   backend='json', file='journal')
+SNAPSHOT_WRITTEN = REGISTRY.counter('budget_storage_written_bytes_total', "Bytes written by storage backends",
+                                    backend='json', file='snapshot')
+ARCHIVE_WRITTEN = REGISTRY.counter('budget_storage_written_bytes_total', "Bytes written by storage backends",
+                                   backend='json', file='archive')
+SEGMENT_LOADS = REGISTRY.counter('budget_archive_segment_loads_total', "Archived month segments read from disk")
+
+
+class UserExists(Exception):
+    # Raised by create_user when the email or username (args[0] says which)
+    # already belongs to someone
+    pass
+
+
+class StorageBackend:
+    # Everything BudgetManager needs from persistence. Users and budgets are
+    # plain dicts shaped like the records in users_data.json and
+    # budgets_data.json; transactions are only reached through the
+    # transaction methods so a backend never has to hold a full history.
+
+    def close(self):
+        pass
+
+    def lock_files(self):
+        # Claims the data for this process until close(); raises
+        # DataFilesLocked if another process already has. A no-op where the
+        # backend does its own locking.
+        pass
+
+    @contextmanager
+    def batch(self):
+        # Groups several mutations under a single persist
+        yield
+
+    def get_user(self, user_id):
+        raise NotImplementedError
+
+    def find_user_by_email(self, email):
+        # Returns (user_id, user) or (None, None)
+        raise NotImplementedError
+
+    def find_user_by_username(self, username):
+        raise NotImplementedError
+
+    def get_user_profiles(self, user_ids):
+        # {user_id: {'username', 'email'}} for the ids that exist. Backends
+        # with a round trip per lookup should answer this in one.
+        profiles = {}
+        for user_id in user_ids:
+            user = self.get_user(user_id)
+            if user is not None:
+                profiles[user_id] = {'username': user['username'], 'email': user['email']}
+        return profiles
+
+    def create_user(self, user_id, user):
+        # Backends that enforce unique emails/usernames raise UserExists
+        raise NotImplementedError
+
+    def set_password_hash(self, user_id, password_hash):
+        raise NotImplementedError
+
+    def get_budget(self, budget_id):
+        raise NotImplementedError
+
+    def user_budgets(self, user_id):
+        # Returns [(budget, role)] for owned budgets followed by shared ones
+        raise NotImplementedError
+
+    def budget_summaries(self, user_id):
+        # [budget_summary(budget, role)] in user_budgets order. Backends
+        # should answer this without reading any transactions.
+        return [budget_summary(budget, role) for budget, role in self.user_budgets(user_id)]
+
+    def budget_versions(self, user_id):
+        # [(budget_id, version, last_modified)] in user_budgets order, without
+        # loading the budgets themselves
+        return [(summary['id'], summary['version'], summary['last_modified'])
+                for summary in self.budget_summaries(user_id)]
+
+    def create_budget(self, budget):
+        raise NotImplementedError
+
+    def set_budget_amount(self, budget_id, amount):
+        raise NotImplementedError
+
+    def add_collaborator(self, budget_id, user_id):
+        raise NotImplementedError
+
+    def add_transaction(self, budget_id, transaction):
+        raise NotImplementedError
+
+    def add_transactions(self, budget_id, transactions):
+        for transaction in transactions:
+            self.add_transaction(budget_id, transaction)
+
+    def recent_transactions(self, budget_id, limit):
+        # Newest first
+        raise NotImplementedError
+
+    def page_transactions(self, budget_id, before, limit, filters):
+        # Newest first by (date, seq), strictly older than the `before` key.
+        # Returns (transactions, next_key); next_key is None on the last page.
+        raise NotImplementedError
+
+    def iter_transactions(self, budget_id, date_from=None, date_to=None):
+        # Oldest first, lazily, optionally limited to a date range
+        raise NotImplementedError
+
+    def transactions_since(self, budget_id, seq, limit):
+        # [(seq, transaction)] for positions seq, seq + 1, ... in the order
+        # they were added, at most limit of them
+        raise NotImplementedError
+
+    def get_rollups(self, budget_id, granularity, start=None, end=None):
+        # [(bucket, income, expense, count)] sorted by bucket, bounds inclusive
+        raise NotImplementedError
+
+    def get_user_rollups(self, budget_id, start_month=None, end_month=None):
+        # [(added_by, income, expense, count)] summed over the month range
+        raise NotImplementedError
+
+    def rebuild_rollups(self, budget_id=None):
+        raise NotImplementedError
+
+
+ROLLUP_GRANULARITIES = ('day', 'week', 'month')
+
+
+@functools.lru_cache(maxsize=4096)
+def rollup_buckets(day):
+    # 'YYYY-MM-DD' -> bucket keys in ROLLUP_GRANULARITIES order
+    year, week, _ = date.fromisoformat(day).isocalendar()
+    return day, f'{year}-W{week:02d}', day[:7]
+
+
+def empty_rollups():
+    return {'day': {}, 'week': {}, 'month': {}, 'by_user': {}}
+
+
+def add_to_rollups(rollups, transaction):
+    # Bucket totals are [income, expense, count]; per-user totals are by month
+    index = 0 if transaction['type'] == 'income' else 1
+    buckets = rollup_buckets(transaction['date'][:10])
+    user_months = rollups['by_user'].setdefault(transaction.get('added_by') or 'Unknown', {})
+    targets = [rollups[granularity].setdefault(bucket, [0.0, 0.0, 0])
+               for granularity, bucket in zip(ROLLUP_GRANULARITIES, buckets)]
+    targets.append(user_months.setdefault(buckets[2], [0.0, 0.0, 0]))
+    for totals in targets:
+        totals[index] += transaction['amount']
+        totals[2] += 1
+
+
+def rebuild_budget_rollups(budget):
+    budget['rollups'] = empty_rollups()
+    for transaction in budget['transactions']:
+        add_to_rollups(budget['rollups'], transaction)
+
+
+# Page scans stop after this many rows per requested row, so a very
+# selective filter returns a short page with a cursor instead of walking
+# the whole history in one request
+PAGE_SCAN_FACTOR = 50
+
+
+def transaction_matches(transaction, filters):
+    if filters.get('type') and transaction['type'] != filters['type']:
+        return False
+    if filters.get('added_by') and transaction.get('added_by') != filters['added_by']:
+        return False
+    if filters.get('min_amount') is not None and transaction['amount'] < filters['min_amount']:
+        return False
+    if filters.get('max_amount') is not None and transaction['amount'] > filters['max_amount']:
+        return False
+    return True
+
+
+# version goes up by one on every change to a budget, so it can key caches
+# and ETags; it is never reset by a recount
+AGGREGATE_FIELDS = ('balance', 'income_total', 'expense_total', 'transaction_count', 'last_modified', 'version')
+
+
+def empty_archive():
+    # budget['archive'] once transactions were archived: how many (always
+    # seqs 0..count-1), their totals and latest date, and the
+    # [month, first seq, rows] of each segment file
+    return {'count': 0, 'income_total': 0.0, 'expense_total': 0.0, 'last_date': '', 'segments': []}
+
+
+def rebuild_aggregates(budget):
+    # Full recount, used when a snapshot predates the aggregates or
+    # disagrees. Archived transactions are counted from the totals carried
+    # forward in budget['archive'], without reading their segments.
+    archive = budget.get('archive') or empty_archive()
+    budget['income_total'] = archive['income_total']
+    budget['expense_total'] = archive['expense_total']
+    budget['transaction_count'] = archive['count']
+    budget['last_modified'] = budget.get('created_at')
+    if archive['count']:
+        budget['last_modified'] = max(budget['last_modified'] or '', archive['last_date'])
+    transactions = budget['transactions']
+    for transaction in (transactions.live() if archive['count'] else transactions):
+        add_to_aggregates(budget, transaction)
+    budget['balance'] = budget['budget'] + budget['income_total'] - budget['expense_total']
+    budget['version'] = budget.get('version', 0)
+
+
+def record_version(budget, record):
+    # The version a journal record leaves its budget at. Records carry it,
+    # so replaying one the snapshot already holds changes nothing; those
+    # from older journals fall back to counting.
+    return record.get('version', budget['version'] + 1)
+
+
+def add_to_aggregates(budget, transaction):
+    if transaction['type'] == 'income':
+        budget['income_total'] += transaction['amount']
+    else:
+        budget['expense_total'] += transaction['amount']
+    budget['transaction_count'] += 1
+    budget['balance'] = budget['budget'] + budget['income_total'] - budget['expense_total']
+    # Imported history can be older than what is already there
+    budget['last_modified'] = max(budget['last_modified'] or '', transaction['date'])
+
+
+def upgrade_budget(budget):
+    # Recompute derived fields a stored budget lacks or has out of step
+    if (any(field not in budget for field in AGGREGATE_FIELDS)
+            or budget['transaction_count'] != len(budget['transactions'])):
+        rebuild_aggregates(budget)
+    rollups = budget.get('rollups')
+    if rollups is None or sum(totals[2] for totals in rollups['month'].values()) != len(budget['transactions']):
+        rebuild_budget_rollups(budget)
+
+
+# What the dashboard and budget lists need from a budget, besides its id
+# and the caller's role; JsonStorage keeps these in the snapshot .idx
+SUMMARY_FIELDS = ('name', 'owner', 'collaborators', 'budget', 'balance', 'transaction_count', 'last_modified',
+                  'version')
+
+
+def budget_summary(budget, role):
+    summary = {'id': budget['id'], 'role': role}
+    for field in SUMMARY_FIELDS:
+        summary[field] = budget[field]
+    return summary
+
+
+def budget_index_fields(budget):
+    return [budget[field] for field in SUMMARY_FIELDS]
+
+
+def user_index_fields(user):
+    # What JsonStorage's email/username indexes need from a user record
+    return [user.get('email', ''), user.get('username', '')]
+
+
+def fsync_directory(directory):
+    # Makes a rename inside the directory durable; POSIX only
+    if os.name != 'posix':
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class JsonStorage(StorageBackend):
+    # Whole dataset in memory, persisted as two JSON snapshots plus a journal
+    def __init__(self, data_file="budgets_data.json", users_file="users_data.json",
+                 journal_file="budgets_journal.log", compact_min_bytes=1024 * 1024, lazy=False,
+                 archive_dir=None, segment_cache_rows=None):
+        self.data_file = data_file
+        self.users_file = users_file
+        self.lazy = lazy
+        # Archived transactions, one gzipped JSON file per budget and month,
+        # read back on demand and kept in an LRU capped by row count
+        self.archive_dir = archive_dir or os.path.join(os.path.dirname(os.path.abspath(data_file)),
+                                                       'budgets_archive')
+        self.segment_cache = LRUCache(segment_cache_rows or int(os.environ.get('ARCHIVE_CACHE_ROWS', 100000)))
+        # The journal is folded back into the snapshot files once it grows
+        # past the snapshot itself, so compaction cost stays amortized O(1)
+        # per byte written.
+        self.compact_min_bytes = compact_min_bytes
+        self.snapshot_bytes = 0
+        self.batch_depth = 0
+        self.batch_lock = threading.Lock()
+        # Writers hold commit_lock shared plus the lock of every budget or
+        # user record they touch, so writes to different budgets run side by
+        # side; snapshots take commit_lock exclusively
+        self.commit_lock = SharedLock()
+        self.locks = LockTable()
+        # Background thread writing the snapshot once the journal is due
+        self.compactor = None
+        self.journal = Journal(journal_file)
+        self.file_lock = FileLock(data_file + '.lock')
+        self.load_data()
+        self.journal.open()
+        if self.lazy and self.needs_index:
+            # Rewrite once with the .idx so the next start can be lazy too
+            self.save_data()
+        atexit.register(self.close)
+
+    def load_data(self):
+        # Budgets whose transactions are not already in date order (e.g.
+        # imported history) get an explicit seq list sorted by (date, seq).
+        # For archived budgets it holds the live rows only; archived_heads
+        # caches their merge with the archive (see ArchivedDateOrder).
+        self.date_orders = {}
+        self.stale_orders = set()
+        self.archived_heads = {}
+
+        # Each snapshot is memory-mapped and only its .idx is read here;
+        # records are parsed as they are first used. Eager mode parses them
+        # all up front.
+        self.needs_index = False
+        self.budgets = self._open_records(self.data_file, 'budgets', self._budget_loaded, budget_index_fields)
+        self.users = self._open_records(self.users_file, 'users', index_fields=user_index_fields)
+        if not self.lazy:
+            self.budgets.load_all()
+            self.users.load_all()
+
+        self.snapshot_bytes = sum(os.path.getsize(path) for path in (self.data_file, self.users_file)
+                                  if os.path.exists(path))
+
+        # Lowercased email/username -> user_id, kept current by _apply
+        self.build_indexes()
+
+        # Replay mutations recorded since the last snapshot
+        for record in self.journal.replay():
+            self._apply(record)
+
+    def _open_records(self, path, label, on_load=None, index_fields=None):
+        snapshot = SnapshotFile.open(path)
+        records = LazyRecords(snapshot, on_load, index_fields)
+        if snapshot is None and os.path.exists(path):
+            # No .idx written for this file (older layout, or edited by
+            # hand), so read it whole
+            try:
+                with open(path, 'r') as f:
+                    data = json.load(f)
+            except Exception as e:
+                logger.error(f"Failed to load {label} data: {str(e)}")
+                data = {}
+            for key, record in data.items():
+                if on_load is not None:
+                    on_load(key, record)
+                records[key] = record
+            self.needs_index = self.needs_index or bool(data)
+        return records
+
+    def _budget_loaded(self, budget_id, budget):
+        budget['transactions'] = TransactionStore(budget['transactions'], budget.get('archive'),
+                                                  functools.partial(self._read_segment, budget_id))
+        upgrade_budget(budget)
+        self.date_orders.pop(budget_id, None)
+        self.archived_heads.pop(budget_id, None)
+        self.stale_orders.discard(budget_id)
+        self._index_transactions(budget_id, budget['transactions'], 0)
+
+    def build_indexes(self):
+        # From the .idx for users not loaded yet
+        self.email_index = {}
+        self.username_index = {}
+        for user_id in self.users:
+            email, username = self.users.fields(user_id)
+            self.email_index.setdefault(email.lower(), user_id)
+            self.username_index.setdefault(username.lower(), user_id)
+
+    def _index_user(self, user_id, user_data):
+        email, username = user_index_fields(user_data)
+        self.email_index.setdefault(email.lower(), user_id)
+        self.username_index.setdefault(username.lower(), user_id)
+
+    def save_data(self):
+        with self.commit_lock.exclusive():
+            self._save_snapshot()
+
+    def _save_snapshot(self):
+        # Write a full snapshot and truncate the journal. Each file is
+        # replaced atomically; replay is idempotent, so a crash between the
+        # two renames and the truncate only re-applies already saved records.
+        # Callers hold commit_lock exclusively, so no record can land in the
+        # journal between the snapshot and the truncate.
+        try:
+            with SNAPSHOT_SECONDS.timer():
+                self.snapshot_bytes = self.budgets.save(self.data_file) + self.users.save(self.users_file)
+                for directory in {os.path.dirname(os.path.abspath(path)) for path in (self.data_file, self.users_file)}:
+                    fsync_directory(directory)
+            SNAPSHOT_BYTES.observe(self.snapshot_bytes)
+            SNAPSHOT_WRITTEN.inc(self.snapshot_bytes)
+            self.journal.reset()
+        except Exception as e:
+            logger.exception(f"Failed to save data: {str(e)}")
+
+    def lock_files(self):
+        self.file_lock.acquire()
+
+    def close(self):
+        compactor = self.compactor
+        if compactor is not None:
+            compactor.join()
+        self.journal.close()
+        self.file_lock.release()
+
+    @contextmanager
+    def batch(self):
+        # Compaction and the batched journal fsync wait until every open
+        # batch, in any thread, has finished
+        with self.batch_lock:
+            self.batch_depth += 1
+            self.journal.hold += 1
+        try:
+            yield
+        finally:
+            with self.batch_lock:
+                self.batch_depth -= 1
+                self.journal.hold -= 1
+                done = not self.batch_depth
+            if done:
+                self.journal.sync()
+                self._maybe_compact()
+
+    @contextmanager
+    def writing(self, *keys):
+        # keys name the records a write touches, e.g. ('budget', budget_id)
+        with self.commit_lock.shared():
+            with self.locks.hold(*keys):
+                yield
+        if not self.batch_depth:
+            self._maybe_compact()
+
+    def get_user(self, user_id):
+        return self.users.get(user_id)
+
+    def find_user_by_email(self, email):
+        user_id = self.email_index.get(email.lower())
+        return (user_id, self.users[user_id]) if user_id else (None, None)
+
+    def find_user_by_username(self, username):
+        user_id = self.username_index.get(username.lower())
+        return (user_id, self.users[user_id]) if user_id else (None, None)
+
+    def create_user(self, user_id, user):
+        with self.writing(('user', user_id)):
+            self._commit({'op': 'register_user', 'user_id': user_id, 'user': user})
+
+    def set_password_hash(self, user_id, password_hash):
+        with self.writing(('user', user_id)):
+            self._commit({'op': 'set_password_hash', 'user_id': user_id, 'password_hash': password_hash})
+
+    def get_budget(self, budget_id):
+        return self.budgets.get(budget_id)
+
+    def user_budgets(self, user_id):
+        user = self.users.get(user_id)
+        if user is None:
+            return []
+        owned = [(self.budgets[bid], 'owner') for bid in user['budgets'] if bid in self.budgets]
+        shared = [(self.budgets[bid], 'collaborator') for bid in user['shared_budgets'] if bid in self.budgets]
+        return owned + shared
+
+    def budget_summaries(self, user_id):
+        # Budgets not loaded yet are summarized from the .idx, so listing
+        # them never parses their transactions
+        user = self.users.get(user_id)
+        if user is None:
+            return []
+        summaries = []
+        for role, budget_ids in (('owner', user['budgets']), ('collaborator', user['shared_budgets'])):
+            for budget_id in budget_ids:
+                if budget_id in self.budgets:
+                    summary = {'id': budget_id, 'role': role}
+                    summary.update(zip(SUMMARY_FIELDS, self.budgets.fields(budget_id)))
+                    summaries.append(summary)
+        return summaries
+
+    def create_budget(self, budget):
+        with self.writing(('budget', budget['id']), ('user', budget['owner'])):
+            self._commit({'op': 'create_budget', 'budget': budget})
+
+    def set_budget_amount(self, budget_id, amount):
+        with self.writing(('budget', budget_id)):
+            self._commit({
+                'op': 'set_budget',
+                'budget_id': budget_id,
+                'amount': amount,
+                'date': datetime.now().strftime("%Y-%m-%d %H:%M"),
+                'version': self.budgets[budget_id]['version'] + 1
+            })
+
+    def add_collaborator(self, budget_id, user_id):
+        with self.writing(('budget', budget_id), ('user', user_id)):
+            self._commit({'op': 'add_collaborator', 'budget_id': budget_id, 'user_id': user_id,
+                          'version': self.budgets[budget_id]['version'] + 1})
+
+    def add_transaction(self, budget_id, transaction):
+        # seq is read under the budget lock so concurrent appends can't share one
+        with self.writing(('budget', budget_id)):
+            self._commit({
+                'op': 'add_transaction',
+                'budget_id': budget_id,
+                'seq': len(self.budgets[budget_id]['transactions']),
+                'transaction': transaction,
+                'version': self.budgets[budget_id]['version'] + 1
+            })
+
+    def add_transactions(self, budget_id, transactions):
+        with self.writing(('budget', budget_id)):
+            self._commit({
+                'op': 'add_transactions',
+                'budget_id': budget_id,
+                'seq': len(self.budgets[budget_id]['transactions']),
+                'transactions': transactions,
+                'version': self.budgets[budget_id]['version'] + 1
+            })
+
+    def recent_transactions(self, budget_id, limit):
+        return self.page_transactions(budget_id, None, limit, {})[0]
+
+    def transactions_since(self, budget_id, seq, limit):
+        transactions = self.budgets[budget_id]['transactions']
+        return [(position, transactions[position])
+                for position in range(seq, min(len(transactions), seq + limit))]
+
+    def page_transactions(self, budget_id, before, limit, filters):
+        transactions, order, start, end, key = self._date_range(
+            budget_id, filters.get('date_from'), filters.get('date_to'))
+        # Narrow to the cursor by bisection, then walk down
+        if before is not None:
+            end = min(end, bisect_order(order, tuple(before), key))
+
+        page = []
+        position = end
+        floor = max(start, end - max(limit, 1) * PAGE_SCAN_FACTOR)
+        while position > floor and len(page) < limit:
+            position -= 1
+            transaction = transactions[order[position]]
+            if transaction_matches(transaction, filters):
+                page.append(transaction)
+        next_key = key(order[position]) if position > start else None
+        return page, next_key
+
+    def iter_transactions(self, budget_id, date_from=None, date_to=None):
+        transactions, order, start, end, key = self._date_range(budget_id, date_from, date_to)
+        # Slicing copies only the seq list, so concurrent inserts into the
+        # order can't shift the walk
+        for seq in order[start:end]:
+            yield transactions[seq]
+
+    def get_rollups(self, budget_id, granularity, start=None, end=None):
+        buckets = self.budgets[budget_id]['rollups'][granularity]
+        return sorted((bucket, *totals) for bucket, totals in buckets.items()
+                      if (not start or bucket >= start) and (not end or bucket <= end))
+
+    def get_user_rollups(self, budget_id, start_month=None, end_month=None):
+        users = []
+        for added_by, months in self.budgets[budget_id]['rollups']['by_user'].items():
+            income = expense = 0.0
+            count = 0
+            for month, totals in months.items():
+                if (not start_month or month >= start_month) and (not end_month or month <= end_month):
+                    income += totals[0]
+                    expense += totals[1]
+                    count += totals[2]
+            if count:
+                users.append((added_by, income, expense, count))
+        return sorted(users)
+
+    def rebuild_rollups(self, budget_id=None):
+        with self.commit_lock.exclusive():
+            for current_id in ([budget_id] if budget_id else list(self.budgets)):
+                rebuild_budget_rollups(self.budgets[current_id])
+            self._save_snapshot()
+
+    def archive_transactions(self, before, budget_id=None):
+        # Moves each budget's transactions dated before `before`
+        # ('YYYY-MM-DD') out of the snapshot into per-month segment files
+        # and carries their totals forward in budget['archive']. Only the
+        # leading run of transactions in date order can go, so every seq
+        # stays where it was. Returns (budgets changed, transactions moved).
+        changed = moved = 0
+        with self.commit_lock.exclusive():
+            for current_id in ([budget_id] if budget_id else list(self.budgets)):
+                count = self._archivable(self.budgets[current_id], before)
+                if count:
+                    self._archive_budget(current_id, count)
+                    changed += 1
+                    moved += count
+            if changed:
+                self._save_snapshot()
+        return changed, moved
+
+    def _archivable(self, budget, before):
+        # How many live transactions, oldest first, are dated before
+        # `before` and not older than the one before them
+        transactions = budget['transactions']
+        last = transactions.archive['last_date'] if transactions.archive else ''
+        count = 0
+        for seq in range(transactions.base, len(transactions)):
+            day = transactions.date(seq)
+            if not isinstance(day, str) or day >= before or day < last:
+                break
+            last = day
+            count += 1
+        return count
+
+    def _archive_budget(self, budget_id, count):
+        budget = self.budgets[budget_id]
+        transactions = budget['transactions']
+        archive = budget.get('archive') or empty_archive()
+        archive = dict(archive, segments=[list(segment) for segment in archive['segments']])
+        rows = [transactions[seq] for seq in range(transactions.base, transactions.base + count)]
+
+        # Rows are in date order, so each month is one run
+        seq = archive['count']
+        for month, group in itertools.groupby(rows, key=lambda row: row['date'][:7]):
+            group = list(group)
+            first = seq
+            seq += len(group)
+            segments = archive['segments']
+            if segments and segments[-1][0] == month:
+                # The previous run stopped partway through this month
+                group = self._read_segment(budget_id, month)[:segments[-1][2]] + group
+                segments[-1][2] = len(group)
+            else:
+                segments.append([month, first, len(group)])
+            ARCHIVE_WRITTEN.inc(self._write_segment(budget_id, month, group))
+
+        for row in rows:
+            archive['income_total' if row['type'] == 'income' else 'expense_total'] += row['amount']
+        archive['count'] += count
+        archive['last_date'] = rows[-1]['date']
+
+        live = [transactions[seq] for seq in range(transactions.base + count, len(transactions))]
+        budget['archive'] = archive
+        budget['transactions'] = TransactionStore(live, archive, functools.partial(self._read_segment, budget_id))
+        self.date_orders.pop(budget_id, None)
+        self.archived_heads.pop(budget_id, None)
+        self.stale_orders.discard(budget_id)
+        self._index_transactions(budget_id, budget['transactions'], 0)
+
+    def _segment_path(self, budget_id, month):
+        return os.path.join(self.archive_dir, quote(budget_id, safe=''), month + '.json.gz')
+
+    def _read_segment(self, budget_id, month):
+        rows = self.segment_cache.get((budget_id, month))
+        if rows is None:
+            with gzip.open(self._segment_path(budget_id, month), 'rb') as f:
+                rows = json.loads(f.read())
+            SEGMENT_LOADS.inc()
+            self.segment_cache.put((budget_id, month), rows, len(rows))
+        return rows
+
+    def _write_segment(self, budget_id, month, rows):
+        # Returns the compressed size. Written before the snapshot that
+        # refers to it, so a crash in between leaves an unused file at worst.
+        path = self._segment_path(budget_id, month)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as f:
+                f.write(json.dumps(rows, separators=(',', ':')).encode('utf-8'))
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(path + '.tmp', path)
+        fsync_directory(os.path.dirname(path))
+        self.segment_cache.pop((budget_id, month))
+        return os.path.getsize(path)
+
+    def _date_range(self, budget_id, date_from, date_to):
+        # Positions [start, end) of the date order within the given range
+        transactions = self.budgets[budget_id]['transactions']
+        order = self._date_order(budget_id)
+        if transactions.base:
+            order = ArchivedDateOrder(transactions, order or range(transactions.base, len(transactions)),
+                                      functools.partial(self._archived_head, budget_id))
+        elif order is None:
+            order = range(len(transactions))
+        key = transactions.date_key
+
+        start = bisect_order(order, (date_from,), key) if date_from else 0
+        end = bisect_order(order, (date_to + '\uffff',), key, right=True) if date_to else len(order)
+        return transactions, order, start, end, key
+
+    def _index_transactions(self, budget_id, transactions, first):
+        # Keep date_orders current after transactions[first:] were appended.
+        # Out-of-order bulk appends only mark the order stale; it is rebuilt
+        # once, on the next read.
+        order = self.date_orders.get(budget_id)
+        if order is None:
+            if transactions.in_order(first):
+                return
+        elif len(transactions) - first == 1 and budget_id not in self.stale_orders:
+            bisect.insort(order, first, key=transactions.date_key)
+            # Only a row dated before the archive changes the merged head
+            if transactions.base and transactions.date(first) < transactions.archive['last_date']:
+                self.archived_heads.pop(budget_id, None)
+            return
+        self.archived_heads.pop(budget_id, None)
+        self.stale_orders.add(budget_id)
+
+    def _date_order(self, budget_id):
+        if budget_id in self.stale_orders:
+            # Rebuilt under the budget lock so a concurrent append can't be
+            # left out of the new order
+            with self.locks.hold(('budget', budget_id)):
+                if budget_id in self.stale_orders:
+                    self.date_orders[budget_id] = self.budgets[budget_id]['transactions'].date_order()
+                    self.stale_orders.discard(budget_id)
+        return self.date_orders.get(budget_id)
+
+    def _archived_head(self, budget_id, order):
+        # Built for the first query that reaches below the archive's last
+        # date; this is what reads every archived segment
+        head = self.archived_heads.get(budget_id)
+        if head is None:
+            with self.locks.hold(('budget', budget_id)):
+                head = self.archived_heads.get(budget_id)
+                if head is None:
+                    head = self.archived_heads[budget_id] = order.build_head()
+        return head
+
+    def _commit(self, record):
+        # Callers hold the locks for the records it touches (see writing())
+        with COMMIT_SECONDS.timer():
+            self._apply(record)
+            JOURNAL_WRITTEN.inc(self.journal.append(record))
+
+    def _needs_compaction(self):
+        return self.journal.size >= max(self.compact_min_bytes, self.snapshot_bytes)
+
+    def _maybe_compact(self):
+        # The snapshot is written on its own thread, so the write that
+        # crossed the threshold returns at once; writers that arrive while
+        # it runs wait on commit_lock as before
+        if self._needs_compaction():
+            with self.batch_lock:
+                if self.compactor is not None and self.compactor.is_alive():
+                    return
+                self.compactor = threading.Thread(target=self._compact, name='journal-compact', daemon=True)
+                self.compactor.start()
+
+    def _compact(self):
+        with self.commit_lock.exclusive():
+            # Another compaction may have run while we waited, and a batch
+            # opened since then compacts when it ends
+            if self._needs_compaction() and not self.batch_depth:
+                self._save_snapshot()
+
+    def _apply(self, record):
+        op = record['op']
+        if op == 'register_user':
+            if record['user_id'] not in self.users:
+                self.users[record['user_id']] = record['user']
+                self._index_user(record['user_id'], record['user'])
+        elif op == 'set_password_hash':
+            if record['user_id'] in self.users:
+                self.users[record['user_id']]['password_hash'] = record['password_hash']
+        elif op == 'create_budget':
+            budget = record['budget']
+            if budget['id'] not in self.budgets:
+                # A copy, so the record itself still serializes as plain JSON
+                budget = dict(budget, transactions=TransactionStore(budget['transactions']))
+                if any(field not in budget for field in AGGREGATE_FIELDS):
+                    rebuild_aggregates(budget)
+                if 'rollups' not in budget:
+                    rebuild_budget_rollups(budget)
+                self.budgets[budget['id']] = budget
+            owner = self.users.get(budget['owner'])
+            if owner is not None and budget['id'] not in owner['budgets']:
+                owner['budgets'].append(budget['id'])
+        elif op == 'set_budget':
+            budget = self.budgets.get(record['budget_id'])
+            if budget is not None and record_version(budget, record) > budget['version']:
+                budget['budget'] = record['amount']
+                budget['balance'] = budget['budget'] + budget['income_total'] - budget['expense_total']
+                budget['last_modified'] = record.get('date', budget['last_modified'])
+                budget['version'] = record_version(budget, record)
+        elif op == 'add_transaction':
+            budget = self.budgets.get(record['budget_id'])
+            # seq is the transaction's position; anything below the current
+            # length is already part of the snapshot
+            if budget is not None and len(budget['transactions']) <= record['seq']:
+                budget['transactions'].append(record['transaction'])
+                add_to_aggregates(budget, record['transaction'])
+                add_to_rollups(budget['rollups'], record['transaction'])
+                budget['version'] = record_version(budget, record)
+                self._index_transactions(record['budget_id'], budget['transactions'],
+                                         len(budget['transactions']) - 1)
+        elif op == 'add_transactions':
+            budget = self.budgets.get(record['budget_id'])
+            if budget is not None and record_version(budget, record) > budget['version']:
+                # Skip the part of the chunk the snapshot already holds
+                first = len(budget['transactions'])
+                for transaction in record['transactions'][max(0, first - record['seq']):]:
+                    budget['transactions'].append(transaction)
+                    add_to_aggregates(budget, transaction)
+                    add_to_rollups(budget['rollups'], transaction)
+                budget['version'] = record_version(budget, record)
+                self._index_transactions(record['budget_id'], budget['transactions'], first)
+        elif op == 'add_collaborator':
+            budget = self.budgets.get(record['budget_id'])
+            collaborator = self.users.get(record['user_id'])
+            if budget is not None and record['user_id'] not in budget['collaborators']:
+                budget['collaborators'].append(record['user_id'])
+                budget['version'] = record_version(budget, record)
+            if collaborator is not None and record['budget_id'] not in collaborator['shared_budgets']:
+                collaborator['shared_budgets'].append(record['budget_id'])
+        else:
+            logger.warning(f"Skipping unknown journal record: {op}")
+
+
+def make_storage():
+    # BUDGET_STORAGE selects the backend; the JSON files remain the default
+    backend = os.environ.get('BUDGET_STORAGE', 'json')
+    if backend == 'json':
+        # BUDGET_LAZY_LOAD=0 parses every record at startup
+        return JsonStorage(lazy=os.environ.get('BUDGET_LAZY_LOAD', '1') != '0')
+    if backend == 'sqlite':
+        from sqlite_storage import SQLiteStorage
+        return SQLiteStorage(os.environ.get('BUDGET_SQLITE_PATH', 'budgets.db'))
+    if backend == 'sharded':
+        from sharded_storage import ShardedStorage
+        return ShardedStorage(os.environ.get('BUDGET_SHARD_DIR', 'budgets_shards'),
+                              int(os.environ.get('BUDGET_CACHE_MB', 64)) * 1024 * 1024)
+    raise ValueError(f"Unknown BUDGET_STORAGE backend: {backend}")
@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+import budgets
+from budgets import BudgetManager
+from hashing import PasswordHasher
+from storage import JsonStorage
+
+
+@pytest.fixture(scope='session')
+def flask_app(tmp_path_factory):
+    # flask_app opens (and locks) the storage in the working directory when
+    # it's imported, so import it from an empty one
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('app'))
+    try:
+        import flask_app
+    finally:
+        os.chdir(cwd)
+    flask_app.app.testing = True
+    return flask_app
+
+
+@pytest.fixture
+def manager(flask_app, tmp_path, monkeypatch):
+    # A fresh JSON storage behind the routes for each test; cheap bcrypt and
+    # no DNS lookups for the example.com addresses
+    monkeypatch.setattr(budgets, 'email_is_valid', lambda email: True)
+    manager = BudgetManager(JsonStorage(str(tmp_path / 'budgets.json'), str(tmp_path / 'users.json'),
+                                       str(tmp_path / 'journal.log')),
+                            PasswordHasher(workers=0, rounds=4))
+    monkeypatch.setattr(flask_app, 'budget_manager', manager)
+    yield manager
+    manager.close()
+
+
+@pytest.fixture
+def login(flask_app, manager):
+    # login('alice') -> a test client with alice registered and signed in
+    def login(username):
+        client = flask_app.app.test_client()
+        email = f'{username}@example.com'
+        client.post('/api/register', data={'email': email, 'username': username, 'password': 'secret1'})
+        assert client.post('/api/login', data={'email': email, 'password': 'secret1'}).get_json()['success']
+        return client
+    return login
@@ -0,0 +1,68 @@
+from sharded_storage import ShardedStorage
+from sqlite_storage import SQLiteStorage
+from storage import ROLLUP_GRANULARITIES, JsonStorage, rebuild_aggregates
+
+# Each backend opened on its files under a directory
+BACKENDS = {
+    'json': lambda path: JsonStorage(str(path / 'budgets.json'), str(path / 'users.json'), str(path / 'journal.log')),
+    'sqlite': lambda path: SQLiteStorage(str(path / 'budgets.db')),
+    'sharded': lambda path: ShardedStorage(str(path / 'shards')),
+}
+
+
+def user_record(username):
+    return {'email': f'{username}@example.com', 'username': username, 'password_hash': '',
+            'budgets': [], 'shared_budgets': [], 'created_at': '2025-01-01 09:00'}
+
+
+def budget_record(budget_id, owner, amount):
+    budget = {'id': budget_id, 'name': budget_id.title(), 'owner': owner, 'collaborators': [],
+              'budget': amount, 'transactions': [], 'created_at': '2025-01-01 09:00'}
+    rebuild_aggregates(budget)
+    return budget
+
+
+def transaction(day, kind, amount, added_by='alice'):
+    return {'date': f'2025-{day} 12:00', 'type': kind, 'amount': amount, 'description': f'{kind} {amount}',
+            'added_by': added_by}
+
+
+def populate(storage):
+    # The same sequence of writes for every backend: two users, a shared
+    # budget with single and batched appends (one out of date order), an
+    # amount change, and a second budget of bob's
+    storage.create_user('u1', user_record('alice'))
+    storage.create_user('u2', user_record('bob'))
+    storage.create_budget(budget_record('home', 'u1', 100.0))
+    storage.add_transaction('home', transaction('01-02', 'expense', 10.0))
+    storage.add_transactions('home', [transaction('01-05', 'income', 50.0),
+                                      transaction('02-01', 'expense', 5.5, 'bob'),
+                                      transaction('01-03', 'expense', 1.0)])
+    storage.set_budget_amount('home', 200.0)
+    storage.add_collaborator('home', 'u2')
+    storage.create_budget(budget_record('trip', 'u2', 0.0))
+    storage.add_transaction('trip', transaction('03-10', 'income', 20.0, 'bob'))
+
+
+def state(storage, stamps=True):
+    # Everything the app can read back after populate(). stamps=False drops
+    # last_modified, which set_budget_amount takes from the clock.
+    def summaries(user_id):
+        return [{field: value for field, value in summary.items() if stamps or field != 'last_modified'}
+                for summary in storage.budget_summaries(user_id)]
+
+    budgets = {}
+    for budget_id in ('home', 'trip'):
+        budgets[budget_id] = {
+            'transactions': storage.transactions_since(budget_id, 0, 100),
+            'recent': storage.recent_transactions(budget_id, 2),
+            'january': list(storage.iter_transactions(budget_id, '2025-01-01', '2025-01-31')),
+            'rollups': {granularity: storage.get_rollups(budget_id, granularity)
+                        for granularity in ROLLUP_GRANULARITIES},
+            'by_user': storage.get_user_rollups(budget_id),
+        }
+    return {
+        'summaries': {user_id: summaries(user_id) for user_id in ('u1', 'u2')},
+        'users': [storage.find_user_by_email('ALICE@example.com')[0], storage.find_user_by_username('Bob')[0]],
+        'budgets': budgets,
+    }
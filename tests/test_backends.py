@@ -0,0 +1,46 @@
+import pytest
+
+from helpers import BACKENDS, populate, state
+from sharded_storage import migrate_json_to_sharded
+from sqlite_storage import migrate_json_to_sqlite
+
+
+def populated_state(open_backend, path):
+    storage = open_backend(path)
+    populate(storage)
+    written = state(storage, stamps=False)
+    storage.close()
+    return written
+
+
+@pytest.mark.parametrize('backend', sorted(BACKENDS))
+def test_backend_reads_back_what_it_wrote_after_reopening(tmp_path, backend):
+    written = populated_state(BACKENDS[backend], tmp_path)
+    storage = BACKENDS[backend](tmp_path)
+    assert state(storage, stamps=False) == written
+    storage.close()
+
+
+def test_backends_agree_on_the_same_writes(tmp_path):
+    states = {}
+    for backend, open_backend in BACKENDS.items():
+        (tmp_path / backend).mkdir()
+        states[backend] = populated_state(open_backend, tmp_path / backend)
+    assert states['sqlite'] == states['json']
+    assert states['sharded'] == states['json']
+
+
+def test_migrations_carry_everything_over(tmp_path):
+    # From a snapshot plus a journal that hasn't been folded into it yet
+    source = BACKENDS['json'](tmp_path)
+    populate(source)
+    expected = state(source)
+    source.close()
+    files = (str(tmp_path / 'budgets.json'), str(tmp_path / 'users.json'), str(tmp_path / 'journal.log'))
+
+    assert migrate_json_to_sqlite(str(tmp_path / 'budgets.db'), *files) == (2, 2)
+    assert migrate_json_to_sharded(str(tmp_path / 'shards'), *files) == (2, 2)
+    for backend in ('sqlite', 'sharded'):
+        storage = BACKENDS[backend](tmp_path)
+        assert state(storage) == expected, backend
+        storage.close()
@@ -0,0 +1,99 @@
+def post_batch(client, operations, atomic=False):
+    return client.post('/api/batch', json={'operations': operations, 'atomic': atomic})
+
+
+def budgets_of(client):
+    return client.get('/api/budgets').get_json()['budgets']
+
+
+def test_operations_can_refer_to_a_budget_created_earlier_in_the_batch(login):
+    alice = login('alice')
+    bob = login('bob')
+    response = post_batch(alice, [
+        {'op': 'create_budget', 'name': 'Trip', 'initial_amount': '100'},
+        {'op': 'add_transaction', 'budget_id': '$0', 'amount': '30', 'type': 'expense', 'description': 'Fuel'},
+        {'op': 'add_transaction', 'budget_id': '$0', 'amount': 5, 'type': 'income', 'date': '2025-01-02'},
+        {'op': 'set_budget', 'budget_id': '$0', 'amount': '200'},
+        {'op': 'invite', 'budget_id': '$0', 'email': 'bob@example.com'},
+        {'op': 'add_transaction', 'budget_id': '$9', 'amount': '1', 'type': 'expense'},
+    ]).get_json()
+
+    assert [result['success'] for result in response['results']] == [True] * 5 + [False]
+    assert response['results'][5]['message'] == "No budget was created by operation 9!"
+    assert (response['applied'], response['failed']) == (5, 1)
+    budget_id = response['results'][0]['budget_id']
+    data = alice.get(f'/api/budget/{budget_id}/data').get_json()
+    assert data['balance'] == 175.0
+    assert [budget['id'] for budget in budgets_of(bob)] == [budget_id]
+
+
+def test_fields_of_the_wrong_type_fail_their_operation_only(login):
+    alice = login('alice')
+    login('bob')
+    budget_id = alice.post('/api/create_budget', data={'name': 'Home'}).get_json()['budget_id']
+    response = post_batch(alice, [
+        {'op': 'add_transaction', 'budget_id': budget_id, 'amount': '1', 'type': 'expense', 'description': 5},
+        {'op': 'add_transaction', 'budget_id': budget_id, 'amount': '1', 'type': ['expense']},
+        {'op': 'add_transaction', 'budget_id': budget_id, 'amount': '1', 'type': 'expense', 'date': 20250101},
+        {'op': 'add_transaction', 'budget_id': budget_id, 'amount': [1], 'type': 'expense'},
+        {'op': 'invite', 'budget_id': budget_id, 'email': 5},
+        {'op': 'create_budget', 'name': ['x']},
+        {'op': 'add_transaction', 'budget_id': budget_id, 'amount': '2', 'type': 'Income'},
+    ])
+
+    assert response.status_code == 200
+    messages = [result.get('message') for result in response.get_json()['results']]
+    assert messages == ["Field 'description' must be a string!", "Field 'type' must be a string!",
+                        "Field 'date' must be a string!", "Please enter a valid amount!",
+                        "Field 'email' must be a string!", "Field 'name' must be a string!",
+                        "Transaction added successfully!"]
+    assert [budget['name'] for budget in budgets_of(alice)] == ['Home']
+    data = alice.get(f'/api/budget/{budget_id}/data').get_json()
+    assert [(t['type'], t['amount']) for t in data['transactions']] == [('income', 2.0)]
+    assert data['collaborators'] == []
+
+
+def test_atomic_batch_applies_nothing_if_one_operation_fails(login):
+    alice = login('alice')
+    operations = [
+        {'op': 'create_budget', 'name': 'Trip'},
+        {'op': 'add_transaction', 'budget_id': '$0', 'amount': '30', 'type': 'expense'},
+        {'op': 'set_budget', 'budget_id': '$0', 'amount': '-1'},
+    ]
+    response = post_batch(alice, operations, atomic=True).get_json()
+    assert (response['success'], response['applied'], response['failed']) == (False, 0, 1)
+    assert [result['message'] for result in response['results'][:2]] == ["Not applied: another operation failed!"] * 2
+    assert budgets_of(alice) == []
+
+    # Without atomic the valid operations go through
+    response = post_batch(alice, operations).get_json()
+    assert (response['success'], response['applied']) == (False, 2)
+    assert [budget['transaction_count'] for budget in budgets_of(alice)] == [1]
+
+
+def test_malformed_batches_are_refused(login):
+    alice = login('alice')
+    assert alice.post('/api/batch', json={'operations': 'nope'}).status_code == 400
+    assert alice.post('/api/batch', json={'operations': [1]}).status_code == 400
+    assert alice.post('/api/batch', data='not json').status_code == 400
+    response = post_batch(alice, [{'op': 'drop_budget'}]).get_json()
+    assert response['results'][0]['message'] == "Unknown operation 'drop_budget'!"
+
+
+def test_a_batch_sent_again_is_not_applied_twice(login):
+    alice = login('alice')
+    operations = [
+        {'op': 'create_budget', 'op_id': 'a1', 'name': 'Trip'},
+        {'op': 'add_transaction', 'op_id': 'a2', 'budget_id': '$0', 'amount': '30', 'type': 'expense'},
+    ]
+    first = post_batch(alice, operations).get_json()
+    # The response was lost, so the client sends the page again with one more operation
+    second = post_batch(alice, operations + [
+        {'op': 'add_transaction', 'op_id': 'a3', 'budget_id': '$0', 'amount': '5', 'type': 'income'},
+        {'op': 'add_transaction', 'op_id': 'a3', 'budget_id': '$0', 'amount': '5', 'type': 'income'},
+    ]).get_json()
+
+    assert second['success'] and second['applied'] == 4
+    assert second['results'][0]['budget_id'] == first['results'][0]['budget_id']
+    assert [result.get('replayed', False) for result in second['results']] == [True, True, False, False]
+    assert [(budget['transaction_count'], budget['balance']) for budget in budgets_of(alice)] == [(2, -25.0)]
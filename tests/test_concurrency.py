@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+
+from helpers import BACKENDS, budget_record, transaction, user_record
+
+THREADS = 8
+WRITES = 25
+
+
+def run_threads(target):
+    errors = []
+
+    def run(index):
+        try:
+            target(index)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+@pytest.mark.parametrize('backend', sorted(BACKENDS))
+def test_concurrent_writers_lose_nothing(tmp_path, backend):
+    # Every thread appends to one shared budget and to its own, mixing
+    # single and batched appends, while collaborators are added
+    storage = BACKENDS[backend](tmp_path)
+    storage.create_user('owner', user_record('owner'))
+    storage.create_budget(budget_record('shared', 'owner', 0.0))
+    for index in range(THREADS):
+        storage.create_user(f'u{index}', user_record(f'user{index}'))
+        storage.create_budget(budget_record(f'own{index}', f'u{index}', 0.0))
+
+    def write(index):
+        for n in range(WRITES):
+            row = transaction('01-01', 'income', 1.0, f'user{index}')
+            storage.add_transaction('shared', row)
+            storage.add_transactions(f'own{index}', [row, row])
+        storage.add_collaborator('shared', f'u{index}')
+
+    run_threads(write)
+
+    def check(storage):
+        summaries = {summary['id']: summary for summary in storage.budget_summaries('u0')}
+        shared = summaries['shared']
+        assert shared['transaction_count'] == THREADS * WRITES
+        assert shared['balance'] == THREADS * WRITES
+        assert sorted(shared['collaborators']) == sorted(f'u{index}' for index in range(THREADS))
+        # One version per append and per collaborator, none lost to a race
+        assert shared['version'] == THREADS * WRITES + THREADS
+        rows = storage.transactions_since('shared', 0, THREADS * WRITES + 1)
+        assert [seq for seq, _ in rows] == list(range(THREADS * WRITES))
+        for index in range(THREADS):
+            own = storage.budget_summaries(f'u{index}')[0]
+            assert (own['transaction_count'], own['version']) == (2 * WRITES, WRITES)
+        assert sum(row[3] for row in storage.get_user_rollups('shared')) == THREADS * WRITES
+
+    check(storage)
+    storage.close()
+    storage = BACKENDS[backend](tmp_path)
+    check(storage)
+    storage.close()
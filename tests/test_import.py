@@ -0,0 +1,71 @@
+import io
+import json
+
+import budgets
+
+
+def new_budget(client):
+    return client.post('/api/create_budget', data={'name': 'Home'}).get_json()['budget_id']
+
+
+def upload(client, budget_id, body, filename):
+    return client.post(f'/api/budget/{budget_id}/import',
+                       data={'file': (io.BytesIO(body), filename)}, content_type='multipart/form-data')
+
+
+def transactions(client, budget_id):
+    data = client.get(f'/api/budget/{budget_id}/data').get_json()
+    return [(t['type'], t['amount'], t['description']) for t in reversed(data['transactions'])]
+
+
+def test_csv_import_reports_bad_rows_and_keeps_the_rest(login):
+    alice = login('alice')
+    budget_id = new_budget(alice)
+    body = ('﻿Date,Type,Amount,Description\n'
+            '2025-01-02 10:00,expense,12.5,Lunch\n'
+            '2025-01-03,transfer,5,Moved\n'
+            'yesterday,income,5,Gift\n'
+            '2025-01-04,income,nan,Odd\n'
+            '2025/01/05,Income,100,Salary\n').encode('utf-8')
+    result = upload(alice, budget_id, body, 'bank.csv').get_json()
+
+    assert (result['imported'], result['failed']) == (2, 3)
+    assert result['errors'] == [
+        {'row': 2, 'message': "Transaction type must be income or expense!"},
+        {'row': 3, 'message': "Please enter a valid date!"},
+        {'row': 4, 'message': "Please enter a valid amount!"},
+    ]
+    assert transactions(alice, budget_id) == [('expense', 12.5, 'Lunch'), ('income', 100.0, 'Salary')]
+
+
+def test_ndjson_rows_with_values_of_the_wrong_type_are_reported(login):
+    alice = login('alice')
+    budget_id = new_budget(alice)
+    rows = [
+        {'type': 'expense', 'amount': 3, 'description': 'Coffee'},
+        {'type': 'expense', 'amount': 3, 'description': 123},
+        {'type': 1, 'amount': 3},
+        {'type': 'income', 'amount': True},
+        {'type': 'income', 'amount': 3, 'date': 20250101},
+        ['not', 'an', 'object'],
+    ]
+    body = '\n'.join(json.dumps(row) for row in rows) + '\n{"type": "income",\n'
+    result = upload(alice, budget_id, body.encode('utf-8'), 'export.ndjson').get_json()
+
+    assert (result['imported'], result['failed']) == (1, 6)
+    assert [error['message'] for error in result['errors']] == [
+        "Description must be text!", "Transaction type must be income or expense!", "Please enter a valid amount!",
+        "Please enter a valid date!", "Each line must be a JSON object!", "Invalid JSON!"]
+    assert transactions(alice, budget_id) == [('expense', 3.0, 'Coffee')]
+
+
+def test_upload_that_is_not_utf8_is_refused_before_anything_is_written(login, monkeypatch):
+    monkeypatch.setattr(budgets, 'IMPORT_CHUNK_ROWS', 1)
+    alice = login('alice')
+    budget_id = new_budget(alice)
+    body = 'type,amount\n' + 'expense,1\n' * 50
+    response = upload(alice, budget_id, body.encode('utf-8') + b'income,2,caf\xe9\n', 'bank.csv')
+
+    assert response.status_code == 400
+    assert response.get_json() == {'success': False, 'message': "The file must be UTF-8 text!"}
+    assert transactions(alice, budget_id) == []
@@ -0,0 +1,76 @@
+import os
+
+from helpers import populate, state, transaction
+from storage import JsonStorage
+
+
+def open_storage(tmp_path, **kwargs):
+    return JsonStorage(str(tmp_path / 'budgets.json'), str(tmp_path / 'users.json'), str(tmp_path / 'journal.log'),
+                       **kwargs)
+
+
+def test_journal_alone_restores_every_write(tmp_path):
+    storage = open_storage(tmp_path)
+    populate(storage)
+    expected = state(storage)
+    # No snapshot was written; appends reach the file as they happen
+    storage.close()
+    assert not os.path.exists(tmp_path / 'budgets.json')
+
+    storage = open_storage(tmp_path)
+    assert state(storage) == expected
+    storage.close()
+
+
+def test_replay_over_a_snapshot_that_already_has_the_records(tmp_path):
+    # A crash after the snapshot files were replaced but before the journal
+    # was truncated: replay must not apply anything twice
+    storage = open_storage(tmp_path)
+    populate(storage)
+    expected = state(storage)
+    storage.budgets.save(storage.data_file)
+    storage.users.save(storage.users_file)
+    storage.close()
+    assert os.path.getsize(tmp_path / 'journal.log') > 0
+
+    storage = open_storage(tmp_path)
+    assert state(storage) == expected
+    assert [summary['version'] for summary in storage.budget_summaries('u2')] == [1, 4]
+    storage.close()
+
+
+def test_torn_journal_tail_is_cut_off(tmp_path):
+    storage = open_storage(tmp_path)
+    populate(storage)
+    expected = state(storage)
+    storage.close()
+    size = os.path.getsize(tmp_path / 'journal.log')
+    with open(tmp_path / 'journal.log', 'ab') as f:
+        f.write(b'{"op":"add_transaction","budget_id":"home","se')
+
+    storage = open_storage(tmp_path)
+    assert state(storage) == expected
+    assert os.path.getsize(tmp_path / 'journal.log') == size
+    # Later appends land after the last good record and replay cleanly
+    storage.add_transaction('home', transaction('04-01', 'income', 1.0))
+    expected = state(storage)
+    storage.close()
+
+    storage = open_storage(tmp_path)
+    assert state(storage) == expected
+    storage.close()
+
+
+def test_compaction_folds_the_journal_into_the_snapshot(tmp_path):
+    storage = open_storage(tmp_path, compact_min_bytes=0)
+    with storage.batch():
+        populate(storage)
+    # The snapshot is written in the background
+    storage.compactor.join()
+    expected = state(storage)
+    assert os.path.getsize(tmp_path / 'journal.log') == 0
+    storage.close()
+
+    storage = open_storage(tmp_path)
+    assert state(storage) == expected
+    storage.close()
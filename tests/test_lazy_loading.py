@@ -0,0 +1,73 @@
+import os
+
+from helpers import populate, state, transaction
+from snapshot import index_path
+from storage import JsonStorage
+
+
+def open_storage(tmp_path, lazy):
+    return JsonStorage(str(tmp_path / 'budgets.json'), str(tmp_path / 'users.json'), str(tmp_path / 'journal.log'),
+                       lazy=lazy)
+
+
+def write_snapshot(tmp_path):
+    storage = open_storage(tmp_path, lazy=False)
+    populate(storage)
+    storage.save_data()
+    expected = state(storage)
+    storage.close()
+    return expected
+
+
+def test_lazy_and_eager_loading_read_the_same(tmp_path):
+    expected = write_snapshot(tmp_path)
+    for lazy in (True, False):
+        storage = open_storage(tmp_path, lazy)
+        assert state(storage) == expected, lazy
+        storage.close()
+
+
+def test_lazy_start_parses_no_budget_until_it_is_read(tmp_path):
+    write_snapshot(tmp_path)
+    storage = open_storage(tmp_path, lazy=True)
+    assert not storage.budgets.loaded and not storage.users.loaded
+
+    # Lookups and the dashboard come from the .idx
+    assert storage.email_index['bob@example.com'] == 'u2'
+    assert [summary['balance'] for summary in storage.budget_summaries('u2')] == [20.0, 233.5]
+    assert not storage.budgets.loaded
+
+    assert storage.recent_transactions('trip', 1)[0]['amount'] == 20.0
+    assert list(storage.budgets.loaded) == ['trip']
+    storage.close()
+
+
+def test_writes_to_a_lazy_storage_survive_a_reload(tmp_path):
+    write_snapshot(tmp_path)
+    storage = open_storage(tmp_path, lazy=True)
+    storage.add_transaction('home', transaction('05-01', 'income', 7.0))
+    storage.set_budget_amount('trip', 5.0)
+    storage.save_data()
+    expected = state(storage)
+    storage.close()
+
+    storage = open_storage(tmp_path, lazy=False)
+    assert state(storage) == expected
+    storage.close()
+
+
+def test_missing_or_stale_index_falls_back_to_a_full_parse(tmp_path):
+    expected = write_snapshot(tmp_path)
+    os.remove(index_path(str(tmp_path / 'budgets.json')))
+    # An .idx that no longer matches its file is ignored
+    with open(tmp_path / 'users.json', 'a') as f:
+        f.write(' ')
+
+    storage = open_storage(tmp_path, lazy=True)
+    assert state(storage) == expected
+    storage.close()
+    # The lazy start wrote a fresh .idx for next time
+    storage = open_storage(tmp_path, lazy=True)
+    assert storage.budgets.snapshot is not None and not storage.budgets.loaded
+    assert state(storage) == expected
+    storage.close()
@@ -0,0 +1,17 @@
+import os
+
+from profiling import RequestProfiler
+
+
+def test_header_needs_the_configured_token(tmp_path):
+    assert not RequestProfiler(str(tmp_path), token='').requested('1')
+    profiler = RequestProfiler(str(tmp_path), token='s3cret')
+    assert not profiler.requested(None) and not profiler.requested('1')
+    assert profiler.requested('s3cret')
+
+
+def test_only_the_newest_dumps_are_kept(tmp_path):
+    profiler = RequestProfiler(str(tmp_path), token='s3cret', max_dumps=2)
+    paths = [profiler.finish(profiler.start(True), 0.001, f"GET /{n}") for n in range(4)]
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(path) + extension
+                                                  for path in paths[2:] for extension in ('.prof', '.txt'))
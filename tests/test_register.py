@@ -0,0 +1,22 @@
+import budgets
+from budgets import BudgetManager
+from hashing import PasswordHasher
+from helpers import user_record
+from sqlite_storage import SQLiteStorage
+
+
+def test_sqlite_unique_indexes_answer_a_registration_that_raced_the_checks(tmp_path, monkeypatch):
+    monkeypatch.setattr(budgets, 'email_is_valid', lambda email: True)
+    storage = SQLiteStorage(str(tmp_path / 'budgets.db'))
+    manager = BudgetManager(storage, PasswordHasher(workers=0, rounds=4))
+    # Another process registered alice between the checks and the insert
+    storage.create_user('u1', user_record('alice'))
+    monkeypatch.setattr(storage, 'find_user_by_email', lambda email: (None, None))
+    monkeypatch.setattr(storage, 'find_user_by_username', lambda username: (None, None))
+
+    assert manager.register_user('alice@example.com', 'someone', 'secret1') == {
+        "success": False, "message": "Email already registered!"}
+    assert manager.register_user('someone@example.com', 'ALICE', 'secret1') == {
+        "success": False, "message": "Username already taken!"}
+    assert manager.register_user('someone@example.com', 'someone', 'secret1')['success']
+    manager.close()
@@ -0,0 +1,29 @@
+from budgets import encode_sync_token
+
+
+def sync(client, token):
+    return client.post('/api/sync', json={'since': token})
+
+
+def test_sync_token_round_trip(login):
+    alice = login('alice')
+    budget_id = alice.post('/api/create_budget', data={'name': 'Home'}).get_json()['budget_id']
+    alice.post(f'/api/budget/{budget_id}/add_transaction', data={'amount': '3', 'type': 'expense'})
+    delta = sync(alice, None).get_json()
+    assert [budget['id'] for budget in delta['budgets']] == [budget_id] and len(delta['transactions']) == 1
+
+    delta = sync(alice, delta['token']).get_json()
+    assert (delta['budgets'], delta['transactions'], delta['more']) == ([], [], False)
+
+
+def test_tokens_the_server_could_not_have_issued_are_refused(login):
+    alice = login('alice')
+    budget_id = alice.post('/api/create_budget', data={'name': 'Home'}).get_json()['budget_id']
+    # Well formed, but several MB once decompressed
+    oversized = encode_sync_token({f'budget-{n}': [None, 0] for n in range(200000)})
+    for token in [encode_sync_token({budget_id: [None, -1]}), encode_sync_token({budget_id: [None, 5]}),
+                  encode_sync_token({budget_id: [True, 0]}), encode_sync_token({budget_id: [None, 1.5]}),
+                  oversized, 'not a token']:
+        response = sync(alice, token)
+        assert response.status_code == 400, token
+        assert response.get_json() == {"error": "Invalid sync token!"}
@@ -0,0 +1,89 @@
+import json
+
+from helpers import populate, transaction
+from storage import JsonStorage
+from transactions import ArchivedDateOrder, TransactionStore, bisect_order, json_default
+
+# Rows the columns can't hold exactly, next to regular ones
+ODD_ROWS = [
+    {'date': '2025-01-04', 'type': 'expense', 'amount': 2.0, 'description': 'no time', 'added_by': 'alice'},
+    dict(transaction('01-05', 'expense', 3.0), category='food'),
+    {'date': '2025-01-06 08:00', 'type': 'income', 'amount': 4.0, 'description': 'no author'},
+    dict(transaction('01-07', 'expense', 0.0), amount='5'),
+]
+
+
+def test_rows_read_back_exactly_as_stored():
+    rows = [transaction('01-01', 'income', 10.0), *ODD_ROWS, transaction('01-08', 'expense', 1.5, 'bob')]
+    store = TransactionStore(rows)
+
+    assert len(store) == len(rows)
+    assert list(store) == rows
+    assert store[-1] == rows[-1]
+    assert len(store.odd) == len(ODD_ROWS)
+    assert json.dumps({'transactions': store}, default=json_default) == json.dumps({'transactions': rows})
+
+
+def test_rows_are_returned_as_copies():
+    store = TransactionStore([transaction('01-01', 'income', 10.0), ODD_ROWS[1]])
+    for seq in range(len(store)):
+        store[seq]['amount'] = 99.0
+    assert [row['amount'] for row in store] == [10.0, 3.0]
+
+
+def test_date_order_with_rows_out_of_order():
+    store = TransactionStore([transaction('01-03', 'income', 1.0), transaction('01-01', 'income', 2.0)])
+    assert not store.in_order()
+    store.append(ODD_ROWS[0])
+    store.append(transaction('01-01', 'expense', 3.0))
+    # By (date, seq): equal dates keep their order, odd dates sort as text
+    assert store.date_order() == [1, 3, 0, 2]
+
+
+def test_archived_rows_come_from_their_segments():
+    segments = {'2024-12': [transaction('01-01', 'income', 1.0), transaction('01-02', 'expense', 2.0)]}
+    archive = {'count': 2, 'income_total': 1.0, 'expense_total': 2.0, 'last_date': '2025-01-02 12:00',
+               'segments': [['2024-12', 0, 2]]}
+    store = TransactionStore([transaction('01-03', 'income', 3.0)], archive, segments.__getitem__)
+
+    assert len(store) == 3
+    assert list(store) == segments['2024-12'] + [transaction('01-03', 'income', 3.0)]
+    assert store.to_list() == [transaction('01-03', 'income', 3.0)]
+    assert store.in_order()
+    store.append(transaction('01-01', 'expense', 4.0))
+    assert not store.in_order()
+    # Live rows only; merging in the archive is ArchivedDateOrder's job
+    assert store.date_order() == [3, 2]
+
+
+def test_archived_date_order_builds_its_head_only_when_read():
+    segments = {'2024-12': [transaction('01-01', 'income', 1.0), transaction('01-02', 'expense', 2.0)]}
+    archive = {'count': 2, 'income_total': 1.0, 'expense_total': 2.0, 'last_date': '2025-01-02 12:00',
+               'segments': [['2024-12', 0, 2]]}
+    store = TransactionStore([transaction('01-03', 'income', 3.0), transaction('01-01', 'expense', 4.0),
+                              transaction('01-04', 'income', 5.0)], archive, segments.__getitem__)
+    heads = []
+    order = ArchivedDateOrder(store, store.date_order(), lambda order: heads.append(1) or order.build_head())
+
+    assert (len(order), order.head_length) == (5, 3)
+    assert bisect_order(order, ('2025-01-03',), store.date_key) == 3
+    assert order[3:] == [2, 4] and not heads
+    assert list(order) == [0, 3, 1, 2, 4] and heads == [1]
+
+
+def test_archived_budget_reads_segments_only_for_queries_below_the_archive(tmp_path):
+    storage = JsonStorage(str(tmp_path / 'budgets.json'), str(tmp_path / 'users.json'), str(tmp_path / 'journal.log'))
+    populate(storage)
+    assert storage.archive_transactions('2025-01-04') == (1, 1)
+    # Live rows 01-05, 02-01, 01-03 and one dated before the archived 01-02
+    storage.add_transaction('home', transaction('01-01', 'income', 7.0))
+    expected = sorted(storage.transactions_since('home', 0, 100), key=lambda row: (row[1]['date'], row[0]))
+    storage.segment_cache.clear()
+
+    assert [row['date'][:10] for row in storage.recent_transactions('home', 2)] == ['2025-02-01', '2025-01-05']
+    assert list(storage.iter_transactions('home', '2025-01-03')) == [row for seq, row in expected[-3:]]
+    assert not storage.archived_heads and not len(storage.segment_cache)
+
+    assert list(storage.iter_transactions('home')) == [row for seq, row in expected]
+    assert storage.page_transactions('home', None, 10, {})[0] == [row for seq, row in reversed(expected)]
+    storage.close()
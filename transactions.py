@@ -0,0 +1,248 @@
+import bisect
+import functools
+import heapq
+from array import array
+from datetime import date, timedelta
+
+TRANSACTION_FIELDS = ('date', 'type', 'amount', 'description', 'added_by')
+FIELD_SET = frozenset(TRANSACTION_FIELDS)
+
+EPOCH = date(1970, 1, 1)
+
+# 'HH:MM' <-> minute of the day
+TIMES_OF_DAY = [f'{minute // 60:02d}:{minute % 60:02d}' for minute in range(1440)]
+MINUTE_OF_DAY = {text: minute for minute, text in enumerate(TIMES_OF_DAY)}
+
+
+@functools.lru_cache(maxsize=65536)
+def day_number(day):
+    # 'YYYY-MM-DD' -> days since 1970, or None unless it is exactly that form
+    try:
+        value = date.fromisoformat(day)
+    except ValueError:
+        return None
+    return (value - EPOCH).days if value.isoformat() == day else None
+
+
+@functools.lru_cache(maxsize=65536)
+def day_string(days):
+    return (EPOCH + timedelta(days=days)).isoformat()
+
+
+def minutes_to_date(minutes):
+    return day_string(minutes // 1440) + ' ' + TIMES_OF_DAY[minutes % 1440]
+
+
+def date_to_minutes(value):
+    # "%Y-%m-%d %H:%M" -> minutes since 1970, or None for anything that
+    # would not come back out of minutes_to_date unchanged
+    if type(value) is not str or len(value) != 16 or value[10] != ' ':
+        return None
+    minute = MINUTE_OF_DAY.get(value[11:])
+    days = day_number(value[:10])
+    if minute is None or days is None:
+        return None
+    return days * 1440 + minute
+
+
+class InternTable:
+    # Repeated values (types, usernames) stored once and referenced by index
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def code(self, value):
+        try:
+            return self.codes[value]
+        except KeyError:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+            return code
+
+
+class TransactionStore:
+    # A budget's transactions in columns: amounts and dates in flat arrays,
+    # type and added_by as indexes into small intern tables. Indexing or
+    # iterating gives back the usual transaction dicts, built on the fly,
+    # so callers (and the JSON snapshot) see the same shape as before.
+    #
+    # Rows that don't fit the columns exactly (a date in another format,
+    # missing or extra keys) are kept as their original dict in `odd`.
+    #
+    # With an archive (see JsonStorage.archive_transactions), seqs below
+    # archive['count'] are in compressed month segments instead; reading one
+    # calls load_segment(month), which the storage caches. The columns hold
+    # the rows from there on, so a live row's column index is seq - base.
+    def __init__(self, transactions=(), archive=None, load_segment=None):
+        self.archive = archive
+        self.base = archive['count'] if archive else 0
+        self.segment_starts = [first for month, first, count in archive['segments']] if archive else []
+        self.load_segment = load_segment
+        self.amounts = array('d')
+        self.minutes = array('q')
+        self.types = bytearray()
+        self.added_by = array('I')
+        self.descriptions = []
+        self.type_table = InternTable()
+        self.user_table = InternTable()
+        self.odd = {}
+        self.odd_dates = False
+        self.extend(transactions)
+
+    def append(self, transaction):
+        if transaction.keys() == FIELD_SET:
+            minutes = date_to_minutes(transaction['date'])
+            amount = transaction['amount']
+            type_code = self.type_table.code(transaction['type'])
+            if minutes is not None and type(amount) in (float, int) and type_code < 256:
+                self.amounts.append(amount)
+                self.minutes.append(minutes)
+                self.types.append(type_code)
+                self.added_by.append(self.user_table.code(transaction['added_by']))
+                # Appended last: len() only counts rows whose columns are all set
+                self.descriptions.append(transaction['description'])
+                return
+
+        minutes = date_to_minutes(transaction.get('date'))
+        if minutes is None:
+            self.odd_dates = True
+        self.odd[len(self.descriptions)] = dict(transaction)
+        self.amounts.append(0.0)
+        self.minutes.append(minutes or 0)
+        self.types.append(0)
+        self.added_by.append(0)
+        self.descriptions.append(None)
+
+    def extend(self, transactions):
+        for transaction in transactions:
+            self.append(transaction)
+
+    def archived(self, seq):
+        # The stored dict of an archived row; callers must not change it
+        index = bisect.bisect_right(self.segment_starts, seq) - 1
+        month, first, count = self.archive['segments'][index]
+        return self.load_segment(month)[seq - first]
+
+    def date(self, seq):
+        if seq < self.base:
+            return self.archived(seq)['date']
+        seq -= self.base
+        odd = self.odd.get(seq)
+        if odd is not None:
+            return odd.get('date')
+        return minutes_to_date(self.minutes[seq])
+
+    def in_order(self, first=1):
+        # Whether dates are non-decreasing from position first - 1 on. The
+        # archived rows are in order (only such runs are archived), so only
+        # the first live row is compared with them.
+        first = max(first, 1)
+        if first <= self.base:
+            if len(self) > self.base and self.date(self.base) < self.archive['last_date']:
+                return False
+            first = self.base + 1
+        if self.odd_dates:
+            return all(self.date(i) >= self.date(i - 1) for i in range(first, len(self)))
+        minutes = self.minutes
+        return all(minutes[i] >= minutes[i - 1] for i in range(first - self.base, len(minutes)))
+
+    def date_key(self, seq):
+        return self.date(seq), seq
+
+    def date_order(self):
+        # Live positions sorted by (date, seq); sort() is stable, so equal
+        # dates keep their seq order. Archived rows are already in order and
+        # are left out (see ArchivedDateOrder), so no segment is read.
+        if self.odd_dates:
+            return sorted(range(self.base, len(self)), key=self.date_key)
+        if self.base:
+            base = self.base
+            return sorted(range(base, len(self)), key=lambda seq: self.minutes[seq - base])
+        return sorted(range(len(self)), key=self.minutes.__getitem__)
+
+    def __len__(self):
+        return self.base + len(self.descriptions)
+
+    def __getitem__(self, seq):
+        if seq < 0:
+            seq += len(self)
+        if seq < self.base:
+            return dict(self.archived(seq))
+        seq -= self.base
+        odd = self.odd.get(seq)
+        if odd is not None:
+            return dict(odd)
+        return {
+            'date': minutes_to_date(self.minutes[seq]),
+            'type': self.type_table.values[self.types[seq]],
+            'amount': self.amounts[seq],
+            'description': self.descriptions[seq],
+            'added_by': self.user_table.values[self.added_by[seq]]
+        }
+
+    def __iter__(self):
+        for seq in range(len(self)):
+            yield self[seq]
+
+    def live(self):
+        # The rows not archived, oldest first
+        for seq in range(self.base, len(self)):
+            yield self[seq]
+
+    def to_list(self):
+        # What the snapshot stores: archived rows stay in their segments
+        return list(self.live())
+
+
+class ArchivedDateOrder:
+    # The (date, seq) order of a TransactionStore with an archive, given the
+    # order of its live rows. Archived rows are in order and dated up to
+    # archive['last_date'], so the live rows dated from then on are the tail
+    # of the order as they are. The head merges the archived rows with any
+    # live rows dated earlier; it is only built, by load_head(self), when a
+    # position in it is read.
+    def __init__(self, transactions, live, load_head):
+        archive = transactions.archive
+        self.transactions = transactions
+        self.live = live
+        self.split = bisect.bisect_left(live, (archive['last_date'],), key=transactions.date_key)
+        self.head_length = transactions.base + self.split
+        # Every key in the head is below this one
+        self.head_bound = (archive['last_date'], transactions.base)
+        self.load_head = load_head
+        self.head = None
+
+    def build_head(self):
+        if not self.split:
+            return range(self.transactions.base)
+        return list(heapq.merge(range(self.transactions.base), self.live[:self.split],
+                                key=self.transactions.date_key))
+
+    def __len__(self):
+        return self.head_length + len(self.live) - self.split
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[index] for index in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if position >= self.head_length:
+            return self.live[position - self.head_length + self.split]
+        if self.head is None:
+            self.head = self.load_head(self)
+        return self.head[position]
+
+
+def bisect_order(order, target, key, right=False):
+    # bisect over a date order by (date, seq) keys. A target above an
+    # ArchivedDateOrder's head is searched for in its tail only, so the
+    # head is never built for it.
+    lo = order.head_length if isinstance(order, ArchivedDateOrder) and target >= order.head_bound else 0
+    return (bisect.bisect_right if right else bisect.bisect_left)(order, target, lo, key=key)
+
+
+def json_default(value):
+    # default= hook so json.dumps writes a TransactionStore as its list
+    if isinstance(value, TransactionStore):
+        return value.to_list()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")